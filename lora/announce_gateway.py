@@ -0,0 +1,51 @@
+"""Broadcasts the LoRa gateway's port on the local network so that monitor_lora_pi.py can find it
+without scanning. Run this on the gateway Pi, e.g. from /etc/rc.local:
+
+    python3 /home/pi/lora/announce_gateway.py &
+"""
+
+import argparse
+import socket
+import time
+
+
+ANNOUNCE_PORT = 6005
+ANNOUNCE_PREFIX = b"LORA-GATEWAY "
+
+
+def announce_forever(gateway_port: int, interval_s: float) -> None:
+    message = ANNOUNCE_PREFIX + str(gateway_port).encode()
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        while True:
+            try:
+                sock.sendto(message, ("255.255.255.255", ANNOUNCE_PORT))
+            except OSError:
+                # Probably not connected to the hotspot yet
+                pass
+            time.sleep(interval_s)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="LoRa gateway announcer",
+        description="Broadcasts the LoRa gateway's port so that the monitor can find it",
+    )
+    parser.add_argument(
+        "--port",
+        action="store",
+        type=int,
+        dest="port",
+        default=6004,
+        help="The port the LoRa gateway is serving from.",
+    )
+    parser.add_argument(
+        "--interval",
+        action="store",
+        type=float,
+        dest="interval_s",
+        default=0.5,
+        help="Seconds between announcements.",
+    )
+    parser_options = parser.parse_args()
+    announce_forever(parser_options.port, parser_options.interval_s)
@@ -0,0 +1,76 @@
+"""Append-only archive of everything the LoRa gateway sends, so that the track survives restarting
+the monitor, and so that flights can be replayed for testing.
+
+Each line is the time the message was received, in seconds since the epoch, then the gateway's
+JSON exactly as it was sent:
+
+    1712597891.123 {"class": "POSN", "index": 0, "channel": 0, "payload": "KE0FZV", ...}
+"""
+
+import os
+import time
+import typing
+
+
+class PacketArchive:
+    """Appends received messages to the archive, flushing each one so that nothing is lost if the
+    monitor is killed.
+    """
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self._file = open(file_name, "a")
+        # If the monitor was killed while writing, don't glue the next message onto the
+        # partial one
+        if self._file.tell() > 0:
+            with open(file_name, "rb") as file:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b"\n":
+                    self._file.write("\n")
+
+    def append(self, received_s: float, line: str) -> None:
+        self._file.write(f"{received_s:.3f} {line}\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def read_archive(file_name: str, since_s: float = 0.0) -> typing.Iterator[typing.Tuple[float, str]]:
+    """Yields the receive time and message of everything archived since since_s. Missing files
+    are treated as empty.
+    """
+    try:
+        file = open(file_name)
+    except FileNotFoundError:
+        return
+    with file:
+        for raw_line in file:
+            if not raw_line.endswith("\n"):
+                # Partially written when the monitor was killed
+                break
+            timestamp_str, _, line = raw_line.rstrip("\n").partition(" ")
+            try:
+                timestamp_s = float(timestamp_str)
+            except ValueError:
+                continue
+            # Check before doing anything else with the line, so that skipping old flights is fast
+            if timestamp_s < since_s or not line:
+                continue
+            yield timestamp_s, line
+
+
+def replay(file_name: str, speed: float) -> typing.Iterator[typing.Tuple[float, str]]:
+    """Like read_archive, but waits between messages so they come out at speed times the rate
+    they were received. A speed of 0 doesn't wait at all.
+    """
+    first_s: typing.Optional[float] = None
+    start = time.monotonic()
+    for timestamp_s, line in read_archive(file_name):
+        if first_s is None:
+            first_s = timestamp_s
+        if speed > 0:
+            wait_s = start + (timestamp_s - first_s) / speed - time.monotonic()
+            if wait_s > 0:
+                time.sleep(wait_s)
+        yield timestamp_s, line
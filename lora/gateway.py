@@ -0,0 +1,784 @@
+"""A client for the LoRa gateway, and the state of each payload it hears. Shared by
+monitor_lora_pi.py and the ground station.
+
+The gateway sends one JSON message per line over TCP, e.g. POSN messages with a payload's
+position. If its address isn't known, it's found by scanning the subnet, or from its UDP
+announcements if it runs announce_gateway.py.
+"""
+
+import argparse
+import asyncio
+import csv
+import dataclasses
+import datetime
+import fcntl
+import json
+import logging
+import os
+import socket
+import sys
+import termios
+import threading
+import time
+import typing
+
+import announce_gateway
+import archive
+import link_quality
+import ukhas
+
+# Shared with the APRS monitor
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "rtl-sdr"))
+import track
+
+
+# Link states that mean everything is working, even if nothing has been heard yet
+HEALTHY_LINK_STATES = ("up", "up, idle")
+# KML colors (aabbggrr) for each payload's track, in the order they're first heard
+PAYLOAD_COLORS = ("ff0000ff", "ffff0000", "ff00ff00", "ff00ffff", "ffff00ff", "ffffff00")
+
+logger = logging.getLogger(__file__)
+
+
+@dataclasses.dataclass
+class Status:
+    index: int
+    channel: int
+    payload: str
+    time: str  # e.g. "16:52:24"
+    latitude_d: float
+    longitude_d: float
+    altitude_m: float
+    snr: int
+    rssi: int
+    ferr: float
+    temperature_c: float
+    sentence: str  # e.g. "$$KE0FZV,328,16:52:24,39.99717,-105.22822,01543,0,0,0,18.9*8302"
+
+
+@dataclasses.dataclass
+class PayloadState:
+    """Everything known about one payload on one channel."""
+    payload: str
+    channel: int
+    color: str
+    status: typing.Optional[Status] = None
+    last_seen: typing.Optional[datetime.datetime] = None
+    packet_count: int = 0
+    simplified_track: track.TrackSimplifier = dataclasses.field(default_factory=track.TrackSimplifier)
+    link: link_quality.LinkQuality = dataclasses.field(default_factory=link_quality.LinkQuality)
+
+    @property
+    def name(self) -> str:
+        return f"{self.payload} ch {self.channel}"
+
+    def update(self, status: Status, now: datetime.datetime) -> None:
+        self.status = status
+        self.last_seen = now
+        self.packet_count += 1
+        self.simplified_track.add((status.longitude_d, status.latitude_d, status.altitude_m))
+        self.link.add(now.timestamp(), status.index, status.snr, status.rssi, status.ferr)
+
+
+class PayloadTable:
+    """The state of each payload and channel that the gateway has heard, and which one is shown
+    on the screen. Payloads are looked up by (payload, channel), so adding more doesn't slow
+    down handling each packet.
+    """
+
+    def __init__(self):
+        self._states: typing.Dict[typing.Tuple[str, int], PayloadState] = {}
+        # In the order they were first heard. Only ever appended to, so other threads can
+        # iterate over a copy without locking.
+        self.ordered: typing.List[PayloadState] = []
+        self.selected = 0
+
+    def __len__(self) -> int:
+        return len(self.ordered)
+
+    def get(self, payload: str, channel: int) -> PayloadState:
+        state = self._states.get((payload, channel))
+        if state is None:
+            state = PayloadState(
+                payload=payload,
+                channel=channel,
+                color=PAYLOAD_COLORS[len(self.ordered) % len(PAYLOAD_COLORS)],
+            )
+            self._states[(payload, channel)] = state
+            self.ordered.append(state)
+        return state
+
+    def page(self, step: int) -> None:
+        if self.ordered:
+            self.selected = (self.selected + step) % len(self.ordered)
+
+    @property
+    def selected_state(self) -> typing.Optional[PayloadState]:
+        if not self.ordered:
+            return None
+        return self.ordered[self.selected]
+
+
+class Liveness:
+    """Learns how often the gateway usually sends something, so that a connection that has gone
+    quiet (e.g. the phone's hotspot dropped and TCP hasn't noticed) can be detected quickly.
+
+    The gateway only sends when it hears a payload, so a healthy gateway is silent until launch.
+    A connection is only judged after something has come over it, and then only after a silence
+    that's long compared to both minimum_dead_s and how often it usually sends. Before that, TCP
+    keepalive has to notice a dead connection.
+    """
+
+    def __init__(self, minimum_stale_s: float = 5.0, minimum_dead_s: float = 120.0):
+        self.minimum_stale_s = minimum_stale_s
+        self.minimum_dead_s = minimum_dead_s
+        # Exponential moving average of the time between reads
+        self.average_interval_s: typing.Optional[float] = None
+        # Whether anything has come over the current connection
+        self.heard_since_reset = False
+        self._last_heard = time.monotonic()
+
+    def reset(self) -> None:
+        self._last_heard = time.monotonic()
+        self.heard_since_reset = False
+
+    def heard(self, now: float) -> None:
+        interval_s = now - self._last_heard
+        # The first read on a connection only says how long it was idle, not how often it sends
+        if self.heard_since_reset:
+            if self.average_interval_s is None:
+                self.average_interval_s = interval_s
+            else:
+                self.average_interval_s = 0.9 * self.average_interval_s + 0.1 * interval_s
+        self.heard_since_reset = True
+        self._last_heard = now
+
+    def silent_s(self, now: float) -> float:
+        return now - self._last_heard
+
+    @property
+    def stale_after_s(self) -> float:
+        return max(self.minimum_stale_s, 3 * (self.average_interval_s or 0.0))
+
+    @property
+    def dead_after_s(self) -> float:
+        return max(self.minimum_dead_s, 10 * (self.average_interval_s or 0.0))
+
+    def is_stale(self, now: float) -> bool:
+        return self.heard_since_reset and self.silent_s(now) > self.stale_after_s
+
+    def is_dead(self, now: float) -> bool:
+        return self.heard_since_reset and self.silent_s(now) > self.dead_after_s
+
+
+class LineReader:
+    """Reads newline separated lines from a socket into a reusable buffer. Lines that are split
+    across reads are kept until the rest shows up, so nothing is dropped even if the gateway has
+    a backlog.
+    """
+
+    def __init__(self, sock: socket.socket, buffer_size: int = 64 * 1024):
+        # Only used to check the backlog, since reads are done by the caller
+        self._sock = sock
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        # Unprocessed data is in self._buffer[self._start:self._end]
+        self._start = 0
+        self._end = 0
+        self.bytes_read = 0
+        self.lines_read = 0
+        self._created = time.monotonic()
+
+    def _make_room(self) -> None:
+        if self._end < len(self._buffer):
+            return
+        pending = self._end - self._start
+        if self._start > 0:
+            # Move the partial line to the front
+            self._buffer[:pending] = self._view[self._start:self._end]
+        else:
+            # A single line bigger than the whole buffer, so grow it
+            self._view.release()
+            new_buffer = bytearray(len(self._buffer) * 2)
+            new_buffer[:pending] = self._buffer[:pending]
+            self._buffer = new_buffer
+            self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = pending
+
+    def buffer_for_read(self) -> memoryview:
+        """Returns the free part of the buffer, for reading into directly, e.g. with
+        loop.sock_recv_into. Call commit with the number of bytes that were read.
+        """
+        self._make_room()
+        return self._view[self._end:]
+
+    def commit(self, count: int) -> typing.List[str]:
+        """Returns the lines that were completed by reading count bytes into buffer_for_read.
+        Raises ConnectionError if count is 0, i.e. the gateway closed the connection.
+        """
+        if count == 0:
+            raise ConnectionError("Gateway closed the connection")
+        self._end += count
+        self.bytes_read += count
+
+        lines = []
+        while True:
+            newline = self._buffer.find(b"\n", self._start, self._end)
+            if newline == -1:
+                break
+            lines.append(self._buffer[self._start:newline].decode(errors="replace"))
+            self._start = newline + 1
+        if self._start == self._end:
+            self._start = 0
+            self._end = 0
+        self.lines_read += len(lines)
+        return lines
+
+    @property
+    def bytes_per_s(self) -> float:
+        return self.bytes_read / max(time.monotonic() - self._created, 1e-6)
+
+    @property
+    def backlog_bytes(self) -> int:
+        """Bytes waiting to be processed, both in our buffer and in the kernel's."""
+        try:
+            waiting = bytearray(4)
+            fcntl.ioctl(self._sock.fileno(), termios.FIONREAD, waiting)
+            kernel_bytes = int.from_bytes(waiting, sys.byteorder)
+        except (OSError, ValueError):
+            # Closed
+            kernel_bytes = 0
+        return self._end - self._start + kernel_bytes
+
+    def format_stats(self) -> str:
+        return f"{self.bytes_per_s / 1000:.1f} kB/s, backlog {self.backlog_bytes} B"
+
+
+class FakeGateway(threading.Thread):
+    """Serves made up POSN messages like the LoRa gateway does, for testing. Messages take turns
+    coming from each of the payloads, which are (payload, channel). If drop_after is given, each
+    connection is dropped halfway through the message after that many, and the whole message is
+    sent again on the next connection.
+    """
+
+    def __init__(
+        self,
+        rate_hz: float = 1.0,
+        port: int = 0,
+        payloads: typing.Sequence[typing.Tuple[str, int]] = (("KE0FZV", 0), ("KE0FZV-2", 1)),
+        drop_after: typing.Optional[int] = None,
+    ):
+        super().__init__(daemon=True)
+        self._server = socket.create_server(("127.0.0.1", port))
+        self.port: int = self._server.getsockname()[1]
+        self.rate_hz = rate_hz
+        self.payloads = payloads
+        self.drop_after = drop_after
+        self.stop = False
+        self.sent_count = 0
+        self.drop_count = 0
+
+    def make_message(self, count: int) -> bytes:
+        payload, channel = self.payloads[count % len(self.payloads)]
+        index = count // len(self.payloads)
+        now = datetime.datetime.now()
+        time_str = datetime.datetime.strftime(now, "%H:%M:%S")
+        # Spread the payloads out so their tracks don't overlap
+        latitude_d = 39.99717 + index * 0.00001 + channel * 0.01
+        longitude_d = -105.22822 + index * 0.00001
+        altitude_m = 1543 + index
+        sentence = ukhas.format_sentence(
+            (payload, str(index), time_str, f"{latitude_d:.5f}", f"{longitude_d:.5f}", f"{altitude_m:05}", "0", "0", "0", "18.9")
+        )
+        message = {
+            "class": "POSN",
+            "index": index,
+            "channel": channel,
+            "payload": payload,
+            "time": time_str,
+            "lat": latitude_d,
+            "lon": longitude_d,
+            "alt": altitude_m,
+            "rate": 0.0,
+            "snr": 11,
+            "rssi": -68,
+            "ferr": -1.1,
+            "sentence": sentence,
+        }
+        return (json.dumps(message) + "\n").encode()
+
+    def run(self) -> None:
+        self._server.settimeout(0.1)
+        with self._server:
+            while not self.stop:
+                try:
+                    connection, _ = self._server.accept()
+                except socket.timeout:
+                    continue
+                with connection:
+                    try:
+                        connection_count = 0
+                        while not self.stop:
+                            message = self.make_message(self.sent_count)
+                            if connection_count == self.drop_after:
+                                connection.sendall(message[:len(message) // 2])
+                                self.drop_count += 1
+                                break
+                            connection.sendall(message)
+                            self.sent_count += 1
+                            connection_count += 1
+                            if self.rate_hz > 0:
+                                time.sleep(1 / self.rate_hz)
+                    except OSError:
+                        continue
+
+
+LINK_QUALITY_FILE_NAME = "lora-link-quality.csv"
+LINK_QUALITY_INTERVAL_S = 10
+
+
+def export_link_quality(file_name: str, payloads: PayloadTable) -> None:
+    """Appends a row with each payload's link statistics to a CSV file, for graphing later."""
+    states = list(payloads.ordered)
+    if not states:
+        return
+    write_header = not os.path.exists(file_name)
+    with open(file_name, "a", newline="") as file:
+        writer = csv.writer(file)
+        if write_header:
+            writer.writerow(["time", "payload", "channel", "packets", "last_seen"] + states[0].link.csv_header())
+        now = datetime.datetime.now()
+        for state in states:
+            state.link.expire(now.timestamp())
+            last_seen = state.last_seen.isoformat(timespec="seconds") if state.last_seen is not None else ""
+            writer.writerow([now.isoformat(timespec="seconds"), state.payload, state.channel, state.packet_count, last_seen] + state.link.csv_row())
+
+
+class GatewayClient(threading.Thread):
+    """Keeps a connection to the gateway open, reconnecting with exponential backoff if it
+    drops or goes quiet for much longer than the gateway usually does. Every position message
+    updates its payload's state in payloads, then on_status is called with that state. on_line
+    is called with every message first, and whether it arrived live rather than being restored
+    or replayed. Both are called from this thread.
+    """
+    MIN_BACKOFF_S = 0.5
+    MAX_BACKOFF_S = 8.0
+    CONNECT_TIMEOUT_S = 2.0
+
+    def __init__(
+        self,
+        ip: typing.Optional[str],
+        port: int,
+        scan: bool,
+        payloads: PayloadTable,
+        on_status: typing.Optional[typing.Callable[[PayloadState], None]] = None,
+        on_line: typing.Optional[typing.Callable[[datetime.datetime, str, bool], None]] = None,
+    ):
+        # If not given, it's found by scanning
+        self.ip = ip
+        self.port = port
+        self.scan = scan or ip is None
+        self.payloads = payloads
+        self.on_status = on_status
+        self.on_line = on_line
+        self.reader: typing.Optional[LineReader] = None
+        self.liveness = Liveness()
+        self.ingest_stats = ukhas.IngestStats()
+        self.link_state = "connecting"
+        self.archive: typing.Optional[archive.PacketArchive] = None
+        self.replay_file_name: typing.Optional[str] = None
+        self.replay_speed = 10.0
+        self.stop = False
+        super().__init__(daemon=True)
+
+    @property
+    def link_healthy(self) -> bool:
+        """Whether the link is working, or there isn't one because an archive is being replayed."""
+        return self.link_state in HEALTHY_LINK_STATES or self.replay_file_name is not None
+
+    def format_link(self) -> typing.Tuple[str, str, bool]:
+        """The link state, the reader's stats, and whether the link is healthy, for the status
+        window.
+        """
+        stats = self.reader.format_stats() + ", " if self.reader is not None else ""
+        return f"Link: {self.link_state}", f"{stats}{self.ingest_stats.rejected} bad", self.link_healthy
+
+    def run(self):
+        try:
+            if self.replay_file_name is not None:
+                self._replay(self.replay_file_name)
+            else:
+                asyncio.run(self._run_async())
+        except Exception as exc:
+            logger.error(f"GatewayClient exiting: {exc}", exc_info=exc)
+
+    def restore(self, file_name: str, since_s: float) -> None:
+        """Reloads recently archived messages, e.g. after restarting mid-flight."""
+        start = time.perf_counter()
+        count = 0
+        for timestamp_s, line in archive.read_archive(file_name, since_s):
+            self.try_process_line(line, datetime.datetime.fromtimestamp(timestamp_s))
+            count += 1
+        if count > 0:
+            logger.info(f"Restored {count} messages from {file_name} in {time.perf_counter() - start:.2f} s")
+
+    def _replay(self, file_name: str) -> None:
+        """Plays back an archive through the same processing as live messages, for testing."""
+        count = 0
+        for _, line in archive.replay(file_name, self.replay_speed):
+            if self.stop:
+                return
+            self.try_process_line(line, datetime.datetime.now())
+            count += 1
+            self.link_state = f"replayed {count}"
+        self.link_state = f"replay done, {count}"
+        # Keep the results on the screen
+        while not self.stop:
+            time.sleep(0.5)
+
+    async def _run_async(self):
+        loop = asyncio.get_running_loop()
+        backoff_s = self.MIN_BACKOFF_S
+        while not self.stop:
+            if self.ip is None:
+                self.link_state = "scanning"
+                self.ip = await discover_lora_ip(self.port)
+                if self.ip is None:
+                    self.link_state = "not found"
+                    await asyncio.sleep(self.MAX_BACKOFF_S)
+                    continue
+                logger.info(f"Found gateway at {self.ip}")
+
+            self.link_state = "connecting"
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            try:
+                await asyncio.wait_for(loop.sock_connect(sock, (self.ip, self.port)), self.CONNECT_TIMEOUT_S)
+            except (OSError, asyncio.TimeoutError) as exc:
+                sock.close()
+                self.link_state = f"down, retry in {backoff_s:.1f} s"
+                logger.warning(f"Unable to connect to gateway {self.ip}:{self.port}: {exc!r}")
+                await asyncio.sleep(backoff_s)
+                if backoff_s == self.MAX_BACKOFF_S and self.scan:
+                    self.link_state = "scanning"
+                    ip = await discover_lora_ip(self.port)
+                    if ip is not None and ip != self.ip:
+                        logger.warning(f"Gateway moved from {self.ip} to {ip}")
+                        self.ip = ip
+                        backoff_s = self.MIN_BACKOFF_S
+                        continue
+                backoff_s = min(backoff_s * 2, self.MAX_BACKOFF_S)
+                continue
+
+            logger.info(f"Connected to gateway {self.ip}:{self.port}")
+            enable_keepalive(sock)
+            backoff_s = self.MIN_BACKOFF_S
+            self.link_state = "up"
+            self.liveness.reset()
+            self.reader = LineReader(sock)
+            try:
+                await self._read_until_dead(loop, sock, self.reader)
+            except (ConnectionError, OSError) as exc:
+                logger.warning(f"Lost connection to gateway: {exc!r}")
+            finally:
+                self.reader = None
+                sock.close()
+
+    async def _read_until_dead(self, loop: asyncio.AbstractEventLoop, sock: socket.socket, reader: LineReader):
+        last_stats = time.monotonic()
+        while not self.stop:
+            now = time.monotonic()
+            if now - last_stats > 60:
+                last_stats = now
+                logger.debug("Read %d lines, %s", reader.lines_read, reader.format_stats())
+
+            if self.liveness.is_dead(now):
+                logger.info(f"Nothing from the gateway in {self.liveness.silent_s(now):.0f} s, reconnecting")
+                return
+            if self.liveness.is_stale(now):
+                self.link_state = "stale"
+            else:
+                self.link_state = "up" if self.liveness.heard_since_reset else "up, idle"
+
+            try:
+                # Wake up periodically to check on the liveness
+                count = await asyncio.wait_for(loop.sock_recv_into(sock, reader.buffer_for_read()), 1.0)
+            except asyncio.TimeoutError:
+                continue
+            self.liveness.heard(time.monotonic())
+            for raw_sentence in reader.commit(count):
+                self.try_process_line(raw_sentence)
+
+    def try_process_line(self, raw_sentence: str, received: typing.Optional[datetime.datetime] = None) -> None:
+        """Same as process_line, but logs errors instead of raising them, so that one bad
+        message doesn't stop the rest, live or restored.
+        """
+        try:
+            self.process_line(raw_sentence, received)
+        except Exception as exc:
+            logger.error(f"Unable to process {raw_sentence!r}: {exc}", exc_info=exc)
+
+    def process_line(self, raw_sentence: str, received: typing.Optional[datetime.datetime] = None) -> None:
+        """Handles a message from the gateway. If received is given, the message is being
+        restored or replayed, so it's not archived or logged again.
+        """
+        stripped = raw_sentence.strip()
+        if len(stripped) == 0:
+            return
+
+        live = received is None
+        if received is None:
+            received = datetime.datetime.now()
+        if live:
+            logger.debug(stripped)
+            if self.archive is not None:
+                self.archive.append(received.timestamp(), stripped)
+        if self.on_line is not None:
+            self.on_line(received, stripped, live)
+
+        # Sample message:
+        # {
+        #   "class": "POSN",
+        #   "index": 0,
+        #   "channel": 0,
+        #   "payload": "KE0FZV",
+        #   "time": "16:52:24",
+        #   "lat": 39.99717,
+        #   "lon": -105.22822,
+        #   "alt": 1543,
+        #   "rate": 0.0,
+        #   "snr": 11,
+        #   "rssi": -68,
+        #   "ferr": -1.1,
+        #   "sentence": "$$KE0FZV,328,16:52:24,39.99717,-105.22822,01543,0,0,0,18.9*8302"
+        # }
+        rejected_count = self.ingest_stats.rejected
+        result = ukhas.parse_gateway_line(stripped, self.ingest_stats)
+        if result is None:
+            if self.ingest_stats.rejected > rejected_count:
+                logger.warning(f"Rejected corrupted packet {stripped}")
+            return
+        parsed, sentence = result
+        status = Status(
+            index=sentence.index,
+            channel=parsed.get("channel", 0),
+            payload=sentence.payload,
+            time=sentence.time,
+            latitude_d=sentence.latitude_d,
+            longitude_d=sentence.longitude_d,
+            altitude_m=sentence.altitude_m,
+            snr=parsed.get("snr"),
+            rssi=parsed.get("rssi"),
+            ferr=parsed.get("ferr"),
+            temperature_c=sentence.temperature_c,
+            sentence=parsed.get("sentence"),
+        )
+        state = self.payloads.get(status.payload, status.channel)
+        state.update(status, received)
+        if self.on_status is not None:
+            self.on_status(state)
+
+
+LORA_IP_CACHE_FILE_NAME = "lora-gateway-ip.txt"
+
+
+def enable_keepalive(sock: socket.socket) -> None:
+    """Has the kernel probe an idle connection, so that a dead one is noticed in about a minute
+    even if nothing was expected over it.
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # These are Linux only
+    for option, value in (("TCP_KEEPIDLE", 30), ("TCP_KEEPINTVL", 10), ("TCP_KEEPCNT", 3)):
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+
+def get_my_ip() -> typing.Optional[str]:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(0)
+        try:
+            # Doesn't even have to be reachable
+            sock.connect(("10.254.254.254", 1))
+            ip = sock.getsockname()[0]
+        except Exception:
+            ip = None
+    return ip
+
+
+def load_cached_lora_ip() -> typing.Optional[str]:
+    try:
+        with open(LORA_IP_CACHE_FILE_NAME) as file:
+            return file.read().strip() or None
+    except OSError:
+        return None
+
+
+def save_cached_lora_ip(ip: str) -> None:
+    try:
+        with open(LORA_IP_CACHE_FILE_NAME, "w") as file:
+            file.write(ip)
+    except OSError as exc:
+        logger.debug(f"Unable to cache the gateway's IP: {exc}")
+
+
+class _AnnouncementProtocol(asyncio.DatagramProtocol):
+    def __init__(self, port: int, found: "asyncio.Future[str]"):
+        self.port = port
+        self.found = found
+
+    def datagram_received(self, data: bytes, address: typing.Tuple[str, int]) -> None:
+        if data == announce_gateway.ANNOUNCE_PREFIX + str(self.port).encode() and not self.found.done():
+            self.found.set_result(address[0])
+
+
+async def discover_lora_ip(port: int, deadline_s: float = 3.0) -> typing.Optional[str]:
+    """Find the LoRa gateway's IP address. Tries the last address it was found at first, then
+    tries every address on the subnet at once while listening for the gateway's UDP
+    announcement, whichever answers first.
+    """
+    loop = asyncio.get_running_loop()
+
+    async def connect(address: str, timeout_s: float) -> typing.Optional[str]:
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(address, port), timeout_s)
+        except (OSError, asyncio.TimeoutError):
+            return None
+        writer.close()
+        return address
+
+    cached = load_cached_lora_ip()
+    if cached is not None:
+        if await connect(cached, 0.3):
+            return cached
+
+    found: "asyncio.Future[str]" = loop.create_future()
+    transport = None
+    try:
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: _AnnouncementProtocol(port, found),
+            local_addr=("0.0.0.0", announce_gateway.ANNOUNCE_PORT),
+            allow_broadcast=True,
+        )
+    except OSError as exc:
+        logger.debug(f"Unable to listen for announcements: {exc}")
+
+    tasks: typing.Set[asyncio.Future] = {found}
+    my_ip = get_my_ip()
+    if my_ip is not None:
+        *parts, last_str = my_ip.split(".")
+        partial = ".".join(parts)
+        logger.debug(f"Scanning for LoRa on {partial}.1-254")
+        tasks.update(
+            asyncio.ensure_future(connect(f"{partial}.{octet}", deadline_s))
+            for octet in range(1, 255)
+            if str(octet) != last_str
+        )
+
+    result = None
+    try:
+        end = loop.time() + deadline_s
+        while tasks and result is None:
+            remaining_s = end - loop.time()
+            if remaining_s <= 0:
+                break
+            done, tasks = await asyncio.wait(tasks, timeout=remaining_s, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.result() is not None:
+                    result = task.result()
+                    break
+    finally:
+        for task in tasks:
+            task.cancel()
+        if transport is not None:
+            transport.close()
+
+    if result is not None:
+        save_cached_lora_ip(result)
+    return result
+
+
+def find_lora_ip(port: int) -> typing.Optional[str]:
+    """Find the LoRa gateway's IP address"""
+    return asyncio.run(discover_lora_ip(port))
+
+
+def self_test() -> bool:
+    """Runs GatewayClient against FakeGateway, which drops the connection in the middle of a
+    message now and then, and is down before and after. Checks that the partial messages are
+    discarded, that the client reconnects, and that its backoff starts over once it's connected.
+    Returns whether everything passed.
+    """
+    # Find a free port for the gateway to use later
+    with socket.create_server(("127.0.0.1", 0)) as probe:
+        port = probe.getsockname()[1]
+
+    lines: typing.List[str] = []
+    client = GatewayClient("127.0.0.1", port, False, PayloadTable(), on_line=lambda _, line, __: lines.append(line))
+    client.MIN_BACKOFF_S = 0.1
+    client.MAX_BACKOFF_S = 0.8
+    client.start()
+
+    def wait_for(condition: typing.Callable[[], bool], timeout_s: float = 10.0) -> bool:
+        deadline = time.monotonic() + timeout_s
+        while not condition():
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+    passed = True
+
+    def check(name: str, ok: bool) -> None:
+        nonlocal passed
+        passed = passed and ok
+        print(f"{name}: {'ok' if ok else 'FAILED'}")
+
+    check("Backs off while the gateway is down", wait_for(lambda: client.link_state == "down, retry in 0.8 s"))
+
+    fake_gateway = FakeGateway(rate_hz=100, port=port, drop_after=5)
+    fake_gateway.start()
+    check("Reconnects after dropped connections", wait_for(lambda: fake_gateway.drop_count >= 3 and len(lines) >= 20))
+    fake_gateway.stop = True
+    fake_gateway.join()
+
+    # The first retry after losing the connection should be at the minimum again
+    down_state = ""
+
+    def went_down() -> bool:
+        nonlocal down_state
+        down_state = client.link_state
+        return down_state.startswith("down")
+
+    check("Backoff resets after connecting", wait_for(went_down) and down_state == "down, retry in 0.1 s")
+    client.stop = True
+
+    # Every message should have come through whole, once, and in order
+    expected = []
+    for count in range(fake_gateway.sent_count):
+        message = json.loads(fake_gateway.make_message(count))
+        expected.append((message["payload"], message["index"]))
+    try:
+        received = [(message["payload"], message["index"]) for message in map(json.loads, lines)]
+    except (ValueError, KeyError):
+        received = []
+    check("Partial messages are discarded", received == expected and client.ingest_stats.rejected == 0)
+    return passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="LoRa gateway client",
+        description="The gateway client is used by monitor_lora_pi.py and the ground station. This only tests it.",
+    )
+    parser.add_argument(
+        "--self-test",
+        action="store_true",
+        default=False,
+        help="Check the client against a fake gateway that drops the connection, and exit.",
+        dest="self_test",
+    )
+    parser_options = parser.parse_args()
+    if parser_options.self_test:
+        sys.exit(0 if self_test() else 1)
+    parser.print_help()
@@ -0,0 +1,227 @@
+"""Rolling statistics about how well each payload is being received, so we can tell when to
+re-aim the antenna. Everything is updated incrementally, so each packet takes the same amount
+of time no matter how long the windows are. Old values are only dropped when something is added
+or expire() is called, so call expire() before showing the statistics, in case the payload has
+gone quiet.
+"""
+
+import collections
+import math
+import typing
+
+
+# Seconds
+WINDOWS_S = (60, 600)
+# Used for the low end of the signal, since that's what decides whether packets get through
+LOW_PERCENTILE = 0.1
+
+
+class RollingStats:
+    """Mean, minimum, maximum, and percentiles of the values from the last window_s seconds.
+    Percentiles come from a histogram with bins resolution wide between low and high, so adding
+    a value is O(1) and finding a percentile only depends on the number of bins.
+    """
+
+    def __init__(self, window_s: float, low: float, high: float, resolution: float):
+        self.window_s = window_s
+        self.low = low
+        self.resolution = resolution
+        self._bins = [0] * (int(round((high - low) / resolution)) + 1)
+        # Time, value, and bin of each value in the window, oldest first
+        self._values: typing.Deque[typing.Tuple[float, float, int]] = collections.deque()
+        self._sum = 0.0
+        # Monotonic queues: the oldest entry is the minimum (maximum) of the window
+        self._minimums: typing.Deque[typing.Tuple[float, float]] = collections.deque()
+        self._maximums: typing.Deque[typing.Tuple[float, float]] = collections.deque()
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def add(self, timestamp_s: float, value: float) -> None:
+        bin_index = min(max(int(round((value - self.low) / self.resolution)), 0), len(self._bins) - 1)
+        self._values.append((timestamp_s, value, bin_index))
+        self._bins[bin_index] += 1
+        self._sum += value
+        while self._minimums and self._minimums[-1][1] >= value:
+            self._minimums.pop()
+        self._minimums.append((timestamp_s, value))
+        while self._maximums and self._maximums[-1][1] <= value:
+            self._maximums.pop()
+        self._maximums.append((timestamp_s, value))
+        self.expire(timestamp_s)
+
+    def expire(self, now_s: float) -> None:
+        """Drops values that are older than the window."""
+        cutoff_s = now_s - self.window_s
+        while self._values and self._values[0][0] < cutoff_s:
+            _, value, bin_index = self._values.popleft()
+            self._bins[bin_index] -= 1
+            self._sum -= value
+        while self._minimums and self._minimums[0][0] < cutoff_s:
+            self._minimums.popleft()
+        while self._maximums and self._maximums[0][0] < cutoff_s:
+            self._maximums.popleft()
+
+    @property
+    def mean(self) -> typing.Optional[float]:
+        return self._sum / len(self._values) if self._values else None
+
+    @property
+    def minimum(self) -> typing.Optional[float]:
+        return self._minimums[0][1] if self._minimums else None
+
+    @property
+    def maximum(self) -> typing.Optional[float]:
+        return self._maximums[0][1] if self._maximums else None
+
+    def percentile(self, fraction: float) -> typing.Optional[float]:
+        """Nearest rank percentile, to within the resolution."""
+        if not self._values:
+            return None
+        rank = max(1, math.ceil(fraction * len(self._values)))
+        seen = 0
+        for bin_index, count in enumerate(self._bins):
+            seen += count
+            if seen >= rank:
+                return self.low + bin_index * self.resolution
+        return None
+
+
+class PacketLoss:
+    """Estimates how many packets were missed in the last window_s seconds from gaps in the
+    payload's index, which goes up by one for each packet it sends. Packets that should have
+    arrived since the last one, going by how often the payload sends, are counted as missed too,
+    so that a payload that has gone quiet shows up as losing packets.
+    """
+
+    def __init__(self, window_s: float):
+        self.window_s = window_s
+        # Time of each packet received and how many were missed just before it
+        self._events: typing.Deque[typing.Tuple[float, int]] = collections.deque()
+        self.received = 0
+        # Missed according to gaps in the index
+        self.gaps = 0
+        # Missed since the last packet, as of the last expire()
+        self.overdue = 0
+        # Exponential moving average of the time between indexes
+        self.interval_s: typing.Optional[float] = None
+        self._last_index: typing.Optional[int] = None
+        self._last_s: typing.Optional[float] = None
+
+    @property
+    def missed(self) -> int:
+        return self.gaps + self.overdue
+
+    def add(self, timestamp_s: float, index: int) -> None:
+        missed = 0
+        # If the index went backwards, the payload probably restarted
+        if self._last_index is not None and self._last_s is not None and index > self._last_index:
+            missed = index - self._last_index - 1
+            interval_s = (timestamp_s - self._last_s) / (index - self._last_index)
+            if self.interval_s is None:
+                self.interval_s = interval_s
+            else:
+                self.interval_s = 0.9 * self.interval_s + 0.1 * interval_s
+        self._last_index = index
+        self._last_s = timestamp_s
+        self._events.append((timestamp_s, missed))
+        self.received += 1
+        self.gaps += missed
+        self.expire(timestamp_s)
+
+    def expire(self, now_s: float) -> None:
+        """Drops packets that are older than the window, and counts the ones that are overdue."""
+        cutoff_s = now_s - self.window_s
+        while self._events and self._events[0][0] < cutoff_s:
+            _, old_missed = self._events.popleft()
+            self.received -= 1
+            self.gaps -= old_missed
+        self.overdue = 0
+        if self._last_s is not None and self.interval_s is not None and self.interval_s > 0:
+            # Packets were due at _last_s + k * interval_s for k = 1, 2, ..., but only count the
+            # ones in the window. Allow half an interval for jitter.
+            first = max(1, math.ceil((cutoff_s - self._last_s) / self.interval_s))
+            last = math.floor((now_s - self._last_s) / self.interval_s - 0.5)
+            self.overdue = max(0, last - first + 1)
+
+    @property
+    def fraction(self) -> typing.Optional[float]:
+        total = self.received + self.missed
+        return self.missed / total if total > 0 else None
+
+
+class LinkQuality:
+    """SNR, RSSI, frequency error, and packet loss for one payload over each of WINDOWS_S."""
+
+    def __init__(self, windows_s: typing.Sequence[float] = WINDOWS_S):
+        self.windows_s = tuple(windows_s)
+        self.snr = {window_s: RollingStats(window_s, -30.0, 30.0, 0.25) for window_s in self.windows_s}
+        self.rssi = {window_s: RollingStats(window_s, -150.0, 0.0, 1.0) for window_s in self.windows_s}
+        self.ferr = {window_s: RollingStats(window_s, -10.0, 10.0, 0.1) for window_s in self.windows_s}
+        self.loss = {window_s: PacketLoss(window_s) for window_s in self.windows_s}
+
+    def add(self, timestamp_s: float, index: int, snr: float, rssi: float, ferr: float) -> None:
+        for window_s in self.windows_s:
+            self.snr[window_s].add(timestamp_s, snr)
+            self.rssi[window_s].add(timestamp_s, rssi)
+            self.ferr[window_s].add(timestamp_s, ferr)
+            self.loss[window_s].add(timestamp_s, index)
+
+    def expire(self, now_s: float) -> None:
+        """Drops everything older than each window, e.g. before showing the statistics."""
+        for window_s in self.windows_s:
+            for stats in (self.snr[window_s], self.rssi[window_s], self.ferr[window_s], self.loss[window_s]):
+                stats.expire(now_s)
+
+    def format_lines(self, window_s: float) -> typing.List[str]:
+        """Short summaries for the status window."""
+        lines = []
+        minutes = f"{window_s / 60:g}m"
+        for name, stats in (("Snr", self.snr[window_s]), ("Rssi", self.rssi[window_s])):
+            if len(stats) == 0:
+                lines.append(f"{name} {minutes}: -")
+                continue
+            lines.append(
+                f"{name} {minutes}: {stats.mean:.1f} avg, {stats.minimum:g} min, "
+                f"{stats.percentile(LOW_PERCENTILE):g} p{LOW_PERCENTILE * 100:.0f}"
+            )
+        return lines
+
+    def format_loss(self, window_s: float) -> str:
+        fraction = self.loss[window_s].fraction
+        if fraction is None:
+            return "-"
+        return f"{fraction * 100:.1f}% lost in {window_s / 60:g}m"
+
+    def csv_header(self) -> typing.List[str]:
+        header = []
+        for window_s in self.windows_s:
+            suffix = f"_{window_s:g}s"
+            low = f"p{LOW_PERCENTILE * 100:.0f}"
+            header.extend(
+                name + suffix for name in (
+                    "snr_mean", "snr_min", f"snr_{low}", "snr_median",
+                    "rssi_mean", "rssi_min", f"rssi_{low}", "rssi_median",
+                    "ferr_mean", "ferr_min", "ferr_max",
+                    "received", "missed",
+                )
+            )
+        return header
+
+    def csv_row(self) -> typing.List[typing.Any]:
+        row: typing.List[typing.Any] = []
+
+        def round_or_blank(value: typing.Optional[float]) -> typing.Any:
+            return "" if value is None else round(value, 2)
+
+        for window_s in self.windows_s:
+            for stats in (self.snr[window_s], self.rssi[window_s]):
+                row.extend(
+                    round_or_blank(value)
+                    for value in (stats.mean, stats.minimum, stats.percentile(LOW_PERCENTILE), stats.percentile(0.5))
+                )
+            ferr = self.ferr[window_s]
+            row.extend(round_or_blank(value) for value in (ferr.mean, ferr.minimum, ferr.maximum))
+            loss = self.loss[window_s]
+            row.extend((loss.received, loss.missed))
+        return row
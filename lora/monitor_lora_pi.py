@@ -1,31 +1,34 @@
 """Monitor data from the LoRa gateway Raspberry Pi."""
 
 import argparse
-import concurrent.futures
+import collections
 import curses
 import dataclasses
 import datetime
-import json
 import logging
-import math
-import socket
 import sys
 import threading
 import time
 import typing
 
+import archive
+import gateway
+import link_quality
+# gateway adds rtl-sdr to the path
+import track
+
 
 # Balloon status
-STATUS_LABELS_COUNT = 7
+STATUS_LABELS_COUNT = 12
 FT_PER_M = 3.2808399
 MPH_PER_MPS = 2.2369363
 MILES_PER_KM = 0.62137119
-CALLSIGN = "KE0FZV"
 
 logger = logging.getLogger(__file__)
 
 @dataclasses.dataclass
 class Windows:
+    screen: curses.window
     time: curses.window
     error: curses.window
     status: curses.window
@@ -36,29 +39,37 @@ class Windows:
 class Options:
     ip: str
     port: int
+    # If the gateway's IP was found by scanning, scan again if it stops answering, in case it
+    # got a new address from the hotspot
+    scan: bool = False
+    # Where to save everything the gateway sends
+    archive_file_name: typing.Optional[str] = "lora-archive.jsonl"
+    # How far back in the archive to go when restoring the track on startup
+    restore_s: float = 12 * 60 * 60
+    # Instead of connecting to the gateway, play back an archive, speed times faster than real time
+    replay_file_name: typing.Optional[str] = None
+    replay_speed: float = 10.0
 
 
-@dataclasses.dataclass
-class Status:
-    index: int
-    channel: int
-    payload: str
-    time: str  # e.g. "16:52:24"
-    latitude_d: float
-    longitude_d: float
-    altitude_m: float
-    snr: int
-    rssi: int
-    ferr: float
-    temperature_c: float
-    sentence: str  # e.g. "$$KE0FZV,328,16:52:24,39.99717,-105.22822,01543,0,0,0,18.9*8302"
+class SentenceRing:
+    """The most recently received sentences, only as many as the screen can show. The archive
+    keeps all of them.
+    """
 
+    def __init__(self, capacity: int):
+        self._sentences: typing.Deque[typing.Tuple[datetime.datetime, str]] = collections.deque(maxlen=capacity)
+        # The number of sentences ever received, so the screen knows when to redraw
+        self.total = 0
 
-@dataclasses.dataclass
-class Position:
-    latitude_d: float
-    longitude_d: float
-    altitude_m: float
+    def __len__(self) -> int:
+        return len(self._sentences)
+
+    def __getitem__(self, index: int) -> typing.Tuple[datetime.datetime, str]:
+        return self._sentences[index]
+
+    def append(self, timestamp: datetime.datetime, sentence: str) -> None:
+        self._sentences.append((timestamp, sentence))
+        self.total += 1
 
 
 class CursesHandler(logging.Handler):
@@ -77,6 +88,8 @@ class CursesHandler(logging.Handler):
 def initialize_screen(stdscr: curses.window) -> Windows:
     """Initializes the screen."""
     stdscr.nodelay(True)
+    # getch refreshes stdscr, so get that out of the way before drawing the other windows
+    stdscr.refresh()
     curses.curs_set(False)
     curses.init_pair(1, curses.COLOR_YELLOW, curses.COLOR_BLACK)
 
@@ -99,6 +112,7 @@ def initialize_screen(stdscr: curses.window) -> Windows:
     sentences_window.refresh()
 
     return Windows(
+        screen=stdscr,
         time=time_window,
         error=error_window,
         status=status_window,
@@ -116,6 +130,10 @@ def initialize_logger(windows: Windows) -> None:
     handler2.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(filename)s:%(lineno)s %(message)s"))
     handler2.setLevel(logging.DEBUG)
     logger.addHandler(handler2)
+    # The gateway client logs to its own logger
+    gateway.logger.setLevel(logging.DEBUG)
+    gateway.logger.addHandler(handler)
+    gateway.logger.addHandler(handler2)
 
 
 def update_time(window: curses.window) -> None:
@@ -156,18 +174,35 @@ def update_error(window: curses.window) -> None:
     window.noutrefresh()
 
 
-def update_status(window: curses.window, position: Status, time: datetime.datetime) -> None:
+def update_status(
+    window: curses.window,
+    payloads: gateway.PayloadTable,
+    link: typing.Tuple[str, str, bool],
+) -> None:
     if not hasattr(update_status, "recent_id"):
         setattr(update_status, "recent_id", None)
 
-    # If there's not a new message, then we only need to update the seconds ago and estimates
-    seconds_ago = (datetime.datetime.now() - time).total_seconds()
     _, max_x = window.getmaxyx()
-    window.move(4, 1)
+    state = payloads.selected_state
+    if state is None or state.status is None or state.last_seen is None:
+        window.clear()
+        window.border()
+        window.addnstr(1, 1, "Waiting for payloads", max_x - 2)
+        update_link(window, link)
+        window.noutrefresh()
+        return
+    position = state.status
+
+    # If there's not a new message, then we only need to update the seconds ago and estimates
+    seconds_ago = (datetime.datetime.now() - state.last_seen).total_seconds()
+    window.move(5, 1)
     window.clrtoeol()
     isecs = int(seconds_ago)
     ago = f"{isecs // 3600:02}:{(isecs // 60) % 60:02}:{isecs % 60:02}"
-    window.addnstr(4, 1, f"Last seen: {ago} ago", max_x - 2)
+    window.addnstr(5, 1, f"Last seen: {ago} ago", max_x - 2)
+    update_link(window, link)
+    # The statistics age even without new messages
+    update_link_quality(window, state)
     window.border()
 
     # If there's not a new message, then we only need to update the seconds ago and estimates
@@ -179,24 +214,48 @@ def update_status(window: curses.window, position: Status, time: datetime.dateti
 
     window.clear()
     window.border()
-    window.addnstr(1, 1, f"Latitude: {position.latitude_d:.4f}", max_x - 2)
-    window.addnstr(2, 1, f"Longitude: {position.longitude_d:.4f}", max_x - 2)
-    window.addnstr(3, 1, f"Altitude: {position.altitude_m:.1f} m, {position.altitude_m * FT_PER_M:.1f} ft", max_x - 2)
-    ago = f"{isecs // 3600:02}:{(isecs // 60) % 60:02}:{isecs % 60:02}"
-    window.addnstr(4, 1, f"Last seen: {ago} ago", max_x - 2)
-    window.addnstr(5, 1, f"Snr: {position.snr}", max_x - 2)
-    window.addnstr(6, 1, f"Rssi: {position.rssi}", max_x - 2)
-    # TODO Is this included in the message?
-    window.addnstr(7, 1, f"Temperature: {position.temperature_c}°C, {position.temperature_c * 1.8 + 32:.0f}°F", max_x - 2)
+    page = f" ({payloads.selected + 1}/{len(payloads)}, n/p to page)" if len(payloads) > 1 else ""
+    window.addnstr(1, 1, f"{state.name}{page}", max_x - 2, curses.A_BOLD)
+    window.addnstr(2, 1, f"Latitude: {position.latitude_d:.4f}", max_x - 2)
+    window.addnstr(3, 1, f"Longitude: {position.longitude_d:.4f}", max_x - 2)
+    window.addnstr(4, 1, f"Altitude: {position.altitude_m:.1f} m, {position.altitude_m * FT_PER_M:.1f} ft", max_x - 2)
+    window.addnstr(5, 1, f"Last seen: {ago} ago", max_x - 2)
+    window.addnstr(6, 1, f"Snr: {position.snr}, Rssi: {position.rssi}, Ferr: {position.ferr}", max_x - 2)
+    window.addnstr(9, 1, f"Temperature: {position.temperature_c}°C, {position.temperature_c * 1.8 + 32:.0f}°F", max_x - 2)
+    update_link_quality(window, state)
+    update_link(window, link)
 
     window.noutrefresh()
 
 
-def update_sentences(window: curses.window, sentences: typing.List[typing.Tuple[datetime.datetime, str]]) -> None:
+def update_link_quality(window: curses.window, state: gateway.PayloadState) -> None:
+    """Show the payload's link statistics, dropping anything that's aged out of the window."""
+    _, max_x = window.getmaxyx()
+    window_s = link_quality.WINDOWS_S[-1]
+    state.link.expire(time.time())
+    lines = state.link.format_lines(window_s) + [f"Packets: {state.packet_count}, {state.link.format_loss(window_s)}"]
+    for line, text in zip((7, 8, 10), lines):
+        window.move(line, 1)
+        window.clrtoeol()
+        window.addnstr(line, 1, text, max_x - 2)
+
+
+def update_link(window: curses.window, link: typing.Tuple[str, str, bool]) -> None:
+    """Show the gateway connection's state, highlighted if it isn't working."""
+    state, stats, healthy = link
+    _, max_x = window.getmaxyx()
+    attributes = 0 if healthy else curses.A_BOLD | curses.color_pair(1)
+    for line, text, text_attributes in ((11, state, attributes), (12, stats, 0)):
+        window.move(line, 1)
+        window.clrtoeol()
+        window.addnstr(line, 1, text, max_x - 2, text_attributes)
+
+
+def update_sentences(window: curses.window, sentences: SentenceRing) -> None:
     """Show recently received APRS packets."""
     if not hasattr(update_sentences, "previous_sentence_count"):
         setattr(update_sentences, "previous_sentence_count", 0)
-    if update_sentences.previous_sentence_count == len(sentences):  # type: ignore
+    if update_sentences.previous_sentence_count == sentences.total:  # type: ignore
         return
 
     window.clear()
@@ -212,266 +271,123 @@ def update_sentences(window: curses.window, sentences: typing.List[typing.Tuple[
         whole = f"{timestamp} {sentence}"
         window.addnstr(sentence_index + 1, 1, whole, max_x - 2, attributes)
 
-    setattr(update_sentences, "previous_sentence_count", len(sentences))
+    setattr(update_sentences, "previous_sentence_count", sentences.total)
     window.noutrefresh()
 
 
 def update_screen(
     windows: Windows,
-    recent_position: Status,
-    recent_position_time: datetime.datetime,
-    sentences: typing.List[typing.Tuple[datetime.datetime, str]],
+    payloads: gateway.PayloadTable,
+    sentences: SentenceRing,
+    link: typing.Tuple[str, str, bool],
 ) -> None:
     update_time(windows.time)
     update_error(windows.error)
-    update_status(windows.status, recent_position, recent_position_time)
+    update_status(windows.status, payloads, link)
     update_sentences(windows.sentences, sentences)
     curses.doupdate()
 
 
 def loop_forever(windows: Windows, options: Options) -> None:
 
-    recent_status: Status = Status(
-        index=0,
-        channel=0,
-        payload="",
-        time="00:00:00",
-        latitude_d=0.0,
-        longitude_d=0.0,
-        altitude_m=0.0,
-        snr=0,
-        rssi=0,
-        ferr=0,
-        temperature_c=0.0,
-        sentence="<none>",
-    )
-    recent_status_time: datetime.datetime = datetime.datetime.now() - datetime.timedelta(hours=24)
-    sentences: typing.List[typing.Tuple[datetime.datetime, str]] = []
-    positions: typing.List[Position] = []
-
-
-    class SocketListener(threading.Thread):
-        def __init__(self, sock: socket.socket):
-            self._sock = sock
-            self.stop = False
-            super().__init__()
-
-        @staticmethod
-        def parse_temperature(raw: str) -> float:
-            try:
-                return float(raw.split(",")[-1].split("*")[0])
-            except:
-                return 0.0
-        
-        def run(self):
-            nonlocal recent_status
-            nonlocal recent_status_time
-            nonlocal sentences
-            global CALLSIGN
-            while not self.stop:
-                try:
-                    # There might be more than one, so split by newline
-                    raw = self._sock.recv(4096)
-                    if len(raw) == 4096:
-                        # Ugh, we probably got too much data backed up and some got cut off. Just
-                        # drop it.
-                        continue
-
-                    splits = raw.decode().split("\n")
-                    for raw_sentence in splits:
-                        stripped = raw_sentence.strip()
-                        if len(stripped) == 0:
-                            continue
-
-                        logger.debug(stripped)
-                        sentences.append((datetime.datetime.now(), stripped))
-
-                        # Sample message:
-                        # {
-                        #   "class": "POSN",
-                        #   "index": 0,
-                        #   "channel": 0,
-                        #   "payload": "KE0FZV",
-                        #   "time": "16:52:24",
-                        #   "lat": 39.99717,
-                        #   "lon": -105.22822,
-                        #   "alt": 1543,
-                        #   "rate": 0.0,
-                        #   "snr": 11,
-                        #   "rssi": -68,
-                        #   "ferr": -1.1,
-                        #   "sentence": "$$KE0FZV,328,16:52:24,39.99717,-105.22822,01543,0,0,0,18.9*8302"
-                        # }
-                        parsed = json.loads(stripped.strip())
-                        if parsed.get("class") == "POSN" and CALLSIGN in parsed.get("payload"):
-                            sentence = parsed.get("sentence")
-                            recent_status = Status(
-                                index=parsed.get("index"),
-                                channel=parsed.get("channel"),
-                                payload=parsed.get("payload"),
-                                time=parsed.get("time"),
-                                latitude_d=parsed.get("lat"),
-                                longitude_d=parsed.get("lon"),
-                                altitude_m=parsed.get("alt"),
-                                snr=parsed.get("snr"),
-                                rssi=parsed.get("rssi"),
-                                ferr=parsed.get("ferr"),
-                                temperature_c=self.parse_temperature(sentence),
-                                sentence=sentence,
-                            )
-                            recent_status_time = datetime.datetime.now()
-                            positions.append(
-                                Position(
-                                    latitude_d=recent_status.latitude_d,
-                                    longitude_d=recent_status.longitude_d,
-                                    altitude_m=recent_status.altitude_m,
-                                )
-                            )
-
-                except socket.timeout:
-                    continue
-
-                except Exception as exc:
-                    logger.error(f"SocketListener exiting: {exc}", exc_info=exc)
-                    break
+    payloads = gateway.PayloadTable()
+    # Only keep as many sentences as the screen shows
+    sentences = SentenceRing(windows.sentences.getmaxyx()[0] - 2 if windows is not None else 100)
+    track_updated = threading.Event()
 
 
     class GoogleEarthWriter(threading.Thread):
+        """Rewrites the KML file when there are new points, at most every MIN_INTERVAL_S."""
+        MIN_INTERVAL_S = 5
+
         def __init__(self):
             self.stop = False
-            self._last_update = datetime.datetime.now() - datetime.timedelta(hours=4)
-            super().__init__()
-        
+            self._last_update = time.monotonic() - self.MIN_INTERVAL_S
+            super().__init__(daemon=True)
+
         def run(self):
             try:
                 while not self.stop:
-                    if (datetime.datetime.now() - self._last_update).seconds > 10:
-                        self._last_update = datetime.datetime.now()
-                        self._write_kml_file()
-                
-                    time.sleep(0.3)
+                    if not track_updated.wait(0.5):
+                        continue
+                    wait_s = self._last_update + self.MIN_INTERVAL_S - time.monotonic()
+                    if wait_s > 0:
+                        time.sleep(min(wait_s, 0.5))
+                        continue
+                    # Clear before writing so that points that come in while writing aren't missed
+                    track_updated.clear()
+                    self._last_update = time.monotonic()
+                    self._write_kml_file()
             except Exception as exc:
                 logger.error(f"GoogleEarthWriter exiting: {exc}", exc_info=exc)
 
         def _write_kml_file(self):
-            nonlocal positions
-            global CALLSIGN
-            with open("lora.kml", "w") as file:
-                file.write(f"""<?xml version="1.0" encoding="UTF-8"?>
-        <kml xmlns="http://www.opengis.net/kml/2.2">
-        <Document>
-            <name>Paths</name>
-            <Placemark>
-            <name>{CALLSIGN}</name>
-            <description>{CALLSIGN} weather balloon LoRa</description>
-            <Style>
-                <LineStyle>
-                <color>ff0000ff</color>
-                <width>4</width>
-                </LineStyle>
-                <PolyStyle>
-                <color>ff000000</color>
-                </PolyStyle>
-            </Style>
-            <LineString>
-                <extrude>1</extrude>
-                <tessellate>1</tessellate>
-                <altitudeMode>absolute</altitudeMode>
-                <coordinates>\n""")
-                if len(positions) > 0:
-                    previous = positions[0]
-                    for position in positions:
-                        # We get so many messages, let's filter out ones where we don't move much
-                        if distance_m(position, previous) > 10:
-                            file.write(f"{position.longitude_d},{position.latitude_d},{position.altitude_m}\n")
-                            previous = position
-                file.write("""        </coordinates>
-            </LineString>
-            </Placemark>
-        </Document>
-        </kml>""")
+            placemarks = "".join(
+                track.format_placemark(
+                    state.simplified_track,
+                    name=state.name,
+                    description=f"{state.payload} weather balloon LoRa, channel {state.channel}",
+                    line_color=state.color,
+                    poly_color="ff000000",
+                )
+                # Copy, because the listener might add a payload while this is writing
+                for state in list(payloads.ordered)
+            )
+            track.write_atomically("lora.kml", f"""<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2">
+  <Document>
+    <name>Paths</name>
+{placemarks}  </Document>
+</kml>""")
 
 
     logger.debug("Starting")
 
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-        sock.connect((options.ip, options.port))
-        sock.settimeout(0.5)
-        listener = SocketListener(sock)
-        listener.start()
-        google_earth_writer = GoogleEarthWriter()
-        google_earth_writer.start()
-        while listener.is_alive:
-            try:
-                update_screen(windows, recent_status, recent_status_time, sentences)
-                time.sleep(1)
-            except KeyboardInterrupt:
-                listener.stop = True
-                google_earth_writer.stop = True
-                logger.warning("Exiting...")
-                update_error(windows.error)
-                curses.doupdate()
-                sock.close()
-                time.sleep(1)
-                sys.exit(1)
-
-
-def find_lora_ip(port: int) -> typing.Optional[str]:
-    """Find the Lora gateway's IP address"""
-    def get_ip() -> typing.Optional[str]:
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-            sock.settimeout(0)
-            try:
-                # Doesn't even have to be reachable
-                sock.connect(("10.254.254.254", 1))
-                ip = sock.getsockname()[0]
-            except Exception:
-                ip = None
-        return ip
-
-    def connect(address):
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.settimeout(2)
-            try:
-                sock.connect((address, port))
-                sock.close()
-                return address
-            except:
-                return None
-    
-    def scan_range(partial_ip: str, low: int, high: int) -> typing.Optional[str]:
-        low = max(0, low)
-        high = min(255, high)
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            print(f"Scanning for LoRa on {partial_ip}.{low}-{high}")
-            addresses = (partial_ip + "." + str(octet) for octet in range(low, high))
-            futures = [executor.submit(connect, address) for address in addresses]
-            results = [f.result() for f in futures]
-            for result in results:
-                if result:
-                    return result
-        return None
-
-    my_ip = get_ip()
-    if my_ip is None:
-        return None
-
-    *parts, last_str = my_ip.split(".")
-    partial = ".".join(parts)
-    last_octet = int(last_str)
-
-    # Try close IP addresses first
-    result = scan_range(partial, last_octet - 10, last_octet + 10)
-    if result:
-        return result
-    # Try them all
-    step = 20
-    for low in range(0, 256, step):
-        result = scan_range(partial, low, low + step)
-        if result:
-            return result
-
-    return None
+    listener = gateway.GatewayClient(
+        options.ip,
+        options.port,
+        options.scan,
+        payloads,
+        on_status=lambda _: track_updated.set(),
+        on_line=lambda received, sentence, _: sentences.append(received, sentence),
+    )
+    if options.replay_file_name is not None:
+        listener.replay_file_name = options.replay_file_name
+        listener.replay_speed = options.replay_speed
+    elif options.archive_file_name is not None:
+        listener.restore(options.archive_file_name, time.time() - options.restore_s)
+        listener.archive = archive.PacketArchive(options.archive_file_name)
+    listener.start()
+    google_earth_writer = GoogleEarthWriter()
+    google_earth_writer.start()
+    last_update = 0.0
+    last_export = time.monotonic()
+    while listener.is_alive():
+        try:
+            key = windows.screen.getch()
+            if key in (ord("n"), curses.KEY_RIGHT, ord("\t")):
+                payloads.page(1)
+            elif key in (ord("p"), curses.KEY_LEFT, curses.KEY_BTAB):
+                payloads.page(-1)
+            # Redraw right away when paging, otherwise once a second
+            if key != -1 or time.monotonic() - last_update >= 1:
+                last_update = time.monotonic()
+                update_screen(windows, payloads, sentences, listener.format_link())
+            if time.monotonic() - last_export >= gateway.LINK_QUALITY_INTERVAL_S:
+                last_export = time.monotonic()
+                try:
+                    gateway.export_link_quality(gateway.LINK_QUALITY_FILE_NAME, payloads)
+                except OSError as exc:
+                    logger.error(f"Unable to write {gateway.LINK_QUALITY_FILE_NAME}: {exc}")
+            time.sleep(0.05)
+        except KeyboardInterrupt:
+            listener.stop = True
+            google_earth_writer.stop = True
+            logger.warning("Exiting...")
+            update_error(windows.error)
+            curses.doupdate()
+            time.sleep(1)
+            sys.exit(1)
 
 
 def main(stdscr: curses.window, options: Options) -> None:
@@ -480,24 +396,6 @@ def main(stdscr: curses.window, options: Options) -> None:
     loop_forever(windows, options)
 
 
-def distance_m(position1: Position, position2: Position) -> float:
-    """Great circle distance."""
-    lat1 = position1.latitude_d
-    lat2 = position2.latitude_d
-    long1 = position1.longitude_d
-    long2 = position2.longitude_d
-    radius_m = 6371 * 1000
-    lat_delta_r = math.radians(lat2 - lat1)
-    long_delta_r = math.radians(long2 - long1);
-    a = (
-        math.sin(lat_delta_r / 2) ** 2 +
-        math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) *
-        math.sin(long_delta_r / 2) * math.sin(long_delta_r / 2)
-    )
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return radius_m * c
-
-
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         prog="LoRa gateway Raspberry Pi monitor",
@@ -519,13 +417,70 @@ if __name__ == "__main__":
         default=6004,
         help="The port the LoRa gateway is serving from.",
     )
+    parser.add_argument(
+        "--test",
+        action="store_true",
+        default=False,
+        help="Connect to a fake local gateway instead of the real one, just for testing.",
+        dest="test",
+    )
+    parser.add_argument(
+        "--test-rate",
+        action="store",
+        type=float,
+        default=1.0,
+        help="How many messages per second the fake gateway sends. 0 sends them as fast as possible.",
+        dest="test_rate_hz",
+    )
+    parser.add_argument(
+        "--archive",
+        action="store",
+        type=str,
+        default=None,
+        help="Where to save everything the gateway sends, and restore the track from on startup. Defaults to lora-archive.jsonl, or lora-archive-test.jsonl with --test.",
+        dest="archive_file_name",
+    )
+    parser.add_argument(
+        "--restore-hours",
+        action="store",
+        type=float,
+        default=12.0,
+        help="How many hours of the archive to restore on startup. 0 doesn't restore anything.",
+        dest="restore_hours",
+    )
+    parser.add_argument(
+        "--replay",
+        action="store",
+        type=str,
+        default=None,
+        help="Play back an archive instead of connecting to the gateway.",
+        dest="replay_file_name",
+    )
+    parser.add_argument(
+        "--replay-speed",
+        action="store",
+        type=float,
+        default=10.0,
+        help="How many times faster than real time to replay. 0 replays as fast as possible.",
+        dest="replay_speed",
+    )
     parser_options = parser.parse_args()
 
-    if parser_options.ip is None:
+    if parser_options.archive_file_name is None:
+        parser_options.archive_file_name = "lora-archive-test.jsonl" if parser_options.test else "lora-archive.jsonl"
+
+    if parser_options.replay_file_name is not None:
+        # Not used
+        lora_ip = "127.0.0.1"
+    elif parser_options.test:
+        fake_gateway = gateway.FakeGateway(rate_hz=parser_options.test_rate_hz)
+        fake_gateway.start()
+        lora_ip = "127.0.0.1"
+        parser_options.port = fake_gateway.port
+    elif parser_options.ip is None:
         print("Scanning for LoRa gateway...")
-        lora_ip = find_lora_ip(parser_options.port)
+        lora_ip = gateway.find_lora_ip(parser_options.port)
         print(f"Found LoRa gateway running on {lora_ip}")
-        time.sleep(2)
     else:
         lora_ip = parser_options.ip
     if lora_ip is None:
@@ -536,6 +491,11 @@ if __name__ == "__main__":
     options = Options(
         ip=lora_ip,
         port=parser_options.port,
+        scan=parser_options.ip is None and not parser_options.test,
+        archive_file_name=parser_options.archive_file_name,
+        restore_s=parser_options.restore_hours * 60 * 60,
+        replay_file_name=parser_options.replay_file_name,
+        replay_speed=parser_options.replay_speed,
     )
     curses.wrapper(
         lambda stdscr: main(stdscr, options)
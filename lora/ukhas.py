@@ -0,0 +1,171 @@
+"""Parses and checks UKHAS telemetry sentences from the LoRa gateway.
+
+Sentences look like "$$KE0FZV,328,16:52:24,39.99717,-105.22822,01543,0,0,0,18.9*8302", where
+the 4 hex digits after the * are the CRC16-CCITT of everything between the $$ and the *.
+
+To compare the speed of parsing gateway lines with and without the fast path:
+
+    python ukhas.py --benchmark
+"""
+
+import argparse
+import binascii
+import dataclasses
+import json
+import time
+import typing
+
+
+def crc16_ccitt(data: bytes) -> int:
+    """CRC16-CCITT with an initial value of 0xFFFF, as used by UKHAS. binascii's CRC-CCITT is
+    table driven and written in C, so it's much faster than doing it in Python.
+    """
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def format_sentence(fields: typing.Sequence[str]) -> str:
+    """The reverse of parse_sentence, mostly for testing."""
+    body = ",".join(fields)
+    return f"$${body}*{crc16_ccitt(body.encode()):04X}"
+
+
+@dataclasses.dataclass
+class Sentence:
+    payload: str
+    index: int
+    time: str  # e.g. "16:52:24"
+    latitude_d: float
+    longitude_d: float
+    altitude_m: float
+    temperature_c: float
+
+
+def parse_sentence(sentence: str) -> Sentence:
+    """Parses a UKHAS sentence, raising ValueError if it's malformed or the checksum is wrong."""
+    if not sentence.startswith("$$"):
+        raise ValueError("Missing $$")
+    star = sentence.rfind("*")
+    if star == -1:
+        raise ValueError("Missing checksum")
+    body = sentence[2:star]
+    expected = int(sentence[star + 1:star + 5], 16)
+    actual = crc16_ccitt(body.encode())
+    if actual != expected:
+        raise ValueError(f"Bad checksum, expected {expected:04X}, calculated {actual:04X}")
+
+    fields = body.split(",")
+    if len(fields) < 6:
+        raise ValueError(f"Only {len(fields)} fields")
+    return Sentence(
+        payload=fields[0],
+        index=int(fields[1]),
+        time=fields[2],
+        latitude_d=float(fields[3]),
+        longitude_d=float(fields[4]),
+        altitude_m=float(fields[5]),
+        # The last field is the temperature, if there is one
+        temperature_c=float(fields[-1]) if len(fields) > 6 else 0.0,
+    )
+
+
+@dataclasses.dataclass
+class IngestStats:
+    lines: int = 0
+    # Not position messages, e.g. SSDV images
+    skipped: int = 0
+    # Position messages with bad checksums or that couldn't be parsed
+    rejected: int = 0
+    accepted: int = 0
+
+
+def is_position(line: str) -> bool:
+    """Cheap check for a POSN message, so that other messages don't have to be decoded at all."""
+    return '"POSN"' in line
+
+
+def parse_gateway_line(line: str, stats: IngestStats) -> typing.Optional[typing.Tuple[dict, Sentence]]:
+    """Returns the gateway's message and the parsed sentence for valid position messages."""
+    stats.lines += 1
+    if not is_position(line):
+        stats.skipped += 1
+        return None
+    try:
+        parsed = json.loads(line)
+        if not isinstance(parsed, dict):
+            raise ValueError("Not a JSON object")
+        if parsed.get("class") != "POSN":
+            stats.skipped += 1
+            return None
+        sentence_text = parsed.get("sentence")
+        if not isinstance(sentence_text, str):
+            raise ValueError("Missing sentence")
+        sentence = parse_sentence(sentence_text)
+    except ValueError:
+        stats.rejected += 1
+        return None
+    stats.accepted += 1
+    return parsed, sentence
+
+
+def benchmark(line_count: int) -> None:
+    lines = []
+    for index in range(line_count):
+        if index % 4 == 0:
+            sentence = format_sentence(
+                ("KE0FZV", str(index), "16:52:24", "39.99717", "-105.22822", "01543", "0", "0", "0", "18.9")
+            )
+            message = {
+                "class": "POSN", "index": index, "channel": 0, "payload": "KE0FZV", "time": "16:52:24",
+                "lat": 39.99717, "lon": -105.22822, "alt": 1543, "rate": 0.0, "snr": 11, "rssi": -68,
+                "ferr": -1.1, "sentence": sentence,
+            }
+        else:
+            message = {"class": "SSDV", "channel": 0, "index": index, "packet": "55" * 128}
+        lines.append(json.dumps(message))
+
+    def old_path() -> None:
+        for line in lines:
+            parsed = json.loads(line)
+            if parsed.get("class") == "POSN" and "KE0FZV" in parsed.get("payload"):
+                try:
+                    float(parsed.get("sentence").split(",")[-1].split("*")[0])
+                except:
+                    pass
+
+    def new_path() -> None:
+        stats = IngestStats()
+        for line in lines:
+            parse_gateway_line(line, stats)
+
+    for name, function in (("json.loads every line", old_path), ("fast path with CRC", new_path)):
+        start = time.perf_counter()
+        function()
+        elapsed_s = time.perf_counter() - start
+        print(f"{name}: {line_count / elapsed_s:.0f} lines/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="UKHAS parser",
+        description="Parses UKHAS sentences from the LoRa gateway",
+    )
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        default=False,
+        help="Compare the speed of parsing gateway lines with and without the fast path.",
+        dest="benchmark",
+    )
+    parser.add_argument(
+        "--lines",
+        action="store",
+        type=int,
+        default=100000,
+        help="The number of lines to use in the benchmark.",
+        dest="line_count",
+    )
+    parser_options = parser.parse_args()
+    if parser_options.benchmark:
+        benchmark(parser_options.line_count)
+    else:
+        parser.print_help()
@@ -1,155 +1,845 @@
+import argparse
+import collections
 import datetime
+import glob
+import io
+import json
+import logging
 import os
+import queue
+import re
 import serial
 import serial.tools.list_ports
+import subprocess
 import sys
-import logging
+import threading
+import time
 
+import nmea
+import sensor_log
+import serial_log
 import sup800f
 
 
 SUP800F_BAUDRATE = 115200
 TRACKSOAR_BAUDRATE = 9600
+BAUD_RATES = (SUP800F_BAUDRATE, TRACKSOAR_BAUDRATE)
+SUP800F = 'sup800f'
+TRACKSOAR = 'tracksoar'
+# Written by hand to skip detection
+SERIAL_CONFIG_FILE_NAME = 'serial-config.json'
+# What was detected last time, which is tried first
+SERIAL_PROFILE_FILE_NAME = 'serial-profile.json'
+# How long to listen at each baud rate. The SUP800F sends binary messages at
+# 10 Hz, and NMEA sentences come in bursts once a second, so this is enough to
+# see two bursts.
+SNIFF_S = 2.2
+IDENTIFY_INTERVAL_S = 0.1
+NMEA_SENTENCE_REGEX = re.compile(br'\$([A-Z][A-Z0-9]{1,5},[^$*\r\n]*)\*([0-9A-Fa-f]{2})')
+# At 115200 baud we get at most 11.5 kB/s, so the buffers can hold several
+# seconds of data if the SD card stalls
+BUFFER_SIZE = 16 * 1024
+BUFFER_COUNT = 8
+# How often captured data are handed off to be written
+HANDOFF_INTERVAL_S = 1.0
+# How often the log is fsynced, i.e. the most data a power loss can lose
+SYNC_INTERVAL_S = 5.0
+TIMESTAMP_INTERVAL_S = 60.0
+# Limits for each segment of the log, before it's compressed
+SEGMENT_BYTES = 16 * 1024 * 1024
+SEGMENT_S = 15 * 60
+# How long to wait for segments to finish being compressed when we stop
+COMPRESS_WAIT_S = 10.0
+# How many captured chunks can wait to be decoded before we start dropping
+# them, about a second each
+DECODE_QUEUE_SIZE = 30
+SUP800F_SENSOR_COLUMNS = (
+    ('time_s', 'd'),
+    ('acceleration_g_x', 'f'),
+    ('acceleration_g_y', 'f'),
+    ('acceleration_g_z', 'f'),
+    ('magnetic_flux_ut_x', 'f'),
+    ('magnetic_flux_ut_y', 'f'),
+    ('magnetic_flux_ut_z', 'f'),
+    ('pressure_p', 'I'),
+    ('temperature_c', 'f'),
+)
+NMEA_SENSOR_COLUMNS = (
+    ('time_s', 'd'),
+    ('latitude_d', 'd'),
+    ('longitude_d', 'd'),
+    ('altitude_m', 'f'),
+    ('satellites', 'B'),
+    ('hdop', 'f'),
+)
 
 
-def main(verbose):
+def main(options):
     """Main."""
     logger = logging.getLogger('serial')
     stdout_handler = logging.StreamHandler(sys.stdout)
-    # We'll be logging all of read messages to debug, and there might be a
-    # bunch, so let's just dump the message and not include time stamps or
-    # anything like that
+    # In verbose mode we log every write, and there might be a bunch, so
+    # let's just dump the message and not include time stamps or anything
+    # like that
     formatter = logging.Formatter('%(message)s')
     stdout_handler.setFormatter(formatter)
-    if verbose:
+    if options.verbose:
         stdout_handler.setLevel(logging.DEBUG)
     else:
         stdout_handler.setLevel(logging.INFO)
     logger.addHandler(stdout_handler)
 
+    logger.setLevel(logging.DEBUG)
+
     ports = serial.tools.list_ports.comports()
     if len(ports) == 0:
         raise ValueError('No serial ports found')
     # Prefer the USB port over others, because we enable the AMA port even if
     # nothing is connected, but the USB will only show up if it's plugged in
-    for port_name, _, _ in ports:
-        if 'USB' in port_name:
-            break
-    # If nothing was found, port_name will just be whatever is last
-    logger.setLevel(logging.DEBUG)
-    logger.info('Found %d ports, reading from %s', len(ports), port_name)
+    port_names = sorted(
+        (port_name for port_name, _, _ in ports),
+        key=lambda port_name: 'USB' not in port_name
+    )
+    logger.info('Found %d ports: %s', len(ports), ', '.join(port_names))
 
-    if os.path.exists('serial-config.json'):
-        with open('serial-config.json') as serial_config_file:
+    if os.path.exists(SERIAL_CONFIG_FILE_NAME):
+        # Configured by hand, so trust it
+        with open(SERIAL_CONFIG_FILE_NAME) as serial_config_file:
             serial_config = json.load(serial_config_file)
+        port_name = serial_config.get('port', port_names[0])
         baud_rate = serial_config['baud-rate']
-        logger.info('Setting baudrate to %d', baud_rate)
-        serial_ = serial.Serial(port_name, baudrate=baud_rate, timeout=60)
-        if serial_config.get('sup800f', False):
-            logger.info('Connected to SUP800F, switching it to binary mode')
-            sup800f.switch_to_binary_mode(serial_)
+        device = SUP800F if serial_config.get('sup800f', False) else TRACKSOAR
+        logger.info('Configured for %s at %d on %s', device, baud_rate, port_name)
+        serial_ = serial.Serial(port_name, baudrate=baud_rate, timeout=1)
+        binary = False
     else:
-        logger.warn('serial-config.json not found, falling back to error-prone manual detection')
-        serial_ = serial.Serial(port_name, baudrate=SUP800F_BAUDRATE, timeout=60)
-        if check_for_sup800f(serial_, logger):
-            logger.info('Setting baudrate to %d', SUP800F_BAUDRATE)
-            logger.info('Connected to SUP800F, switching it to binary mode')
-            sup800f.switch_to_binary_mode(serial_)
-            dump_serial(serial_, logger)
-        else:
-            # Well, must be TrackSoar then
-            logger.info('Setting baudrate to %d', TRACKSOAR_BAUDRATE)
-            serial_.baudrate = TRACKSOAR_BAUDRATE
-            dump_serial(serial_, logger)
-
-
-def dump_serial(serial_, logger):
-    """Dumps the serial port to a file."""
-    serial_path = 'serials'
-    if not os.path.isdir(serial_path):
-        os.mkdir(serial_path)
+        serial_, device, binary = detect_device(port_names, logger)
 
-    serial_file_name = serial_path + os.sep + datetime.datetime.strftime(
-        datetime.datetime.now(),
-        '%Y-%m-%d_%H:%M:%S.log'
+    # binary is None if we're not sure what's connected
+    if device == SUP800F and binary is False:
+        logger.info('Connected to SUP800F, switching it to binary mode')
+        serial_.timeout = 1
+        sup800f.switch_to_binary_mode(serial_, logger)
+    dump_serial(
+        serial_,
+        logger,
+        device,
+        options.sync_interval_s,
+        options.segment_bytes,
+        options.segment_s,
+        options.live_decode
     )
-    logger.info('Opening %s', serial_file_name)
 
-    last_timestamp = datetime.datetime.now()
 
-    with open(serial_file_name, 'wb') as serial_file:
-        bytes_read_count = 0
+def identify(data):
+    """Returns the device that data look like they came from, whether it's
+    sending SUP800F binary messages, and whether we're sure. Returns None for
+    the device if nothing recognizable is in data.
+    """
+    reader = sup800f.FrameReader(io.BytesIO(data))
+    try:
+        reader.read_frame()
+        return SUP800F, True, True
+    except (EOFError, ValueError):
+        pass
+
+    gga_count = 0
+    for match in NMEA_SENTENCE_REGEX.finditer(data):
+        body = match.group(1)
+        if nmea.checksum(body) != int(match.group(2), 16):
+            continue
+        # The SUP800F sends PSTIs in NMEA mode, and I don't think you can
+        # turn them off
+        if body.startswith(b'PSTI'):
+            return SUP800F, False, True
+        if body[2:5] == b'GGA':
+            gga_count += 1
+    if gga_count > 0:
+        # The PSTIs come in the same burst as the GGAs, so once we've seen two
+        # bursts without one, it's not a SUP800F
+        return TRACKSOAR, False, gga_count > 1
+    return None, False, False
+
+
+def sniff(serial_, window_s=SNIFF_S, stop=None):
+    """Reads for up to window_s, until we're sure what's sending, or until
+    stop is set, and returns what identify thinks it is.
+    """
+    serial_.reset_input_buffer()
+    serial_.timeout = IDENTIFY_INTERVAL_S
+    data = bytearray()
+    start = time.time()
+    last_identify = start
+    device = binary = None
+    while time.time() - start < window_s:
+        if stop is not None and stop.is_set():
+            return None, False
+        data += serial_.read(max(1, serial_.in_waiting))
+        if time.time() - last_identify >= IDENTIFY_INTERVAL_S:
+            device, binary, sure = identify(bytes(data))
+            if sure:
+                return device, binary
+            last_identify = time.time()
+    device, binary, _ = identify(bytes(data))
+    return device, binary
+
+
+def probe_port(port_name, baud_rates, logger, stop=None):
+    """Tries each baud rate on a port. Returns the open port, the device, and
+    whether it's in binary mode, or Nones if nothing was recognized or the
+    port failed. Gives up early if stop is set.
+    """
+    serial_ = None
+    try:
+        serial_ = serial.Serial(port_name, baudrate=baud_rates[0], timeout=IDENTIFY_INTERVAL_S)
+        for baud_rate in baud_rates:
+            if stop is not None and stop.is_set():
+                break
+            serial_.baudrate = baud_rate
+            device, binary = sniff(serial_, stop=stop)
+            if device is not None:
+                logger.info('%s at %d: %s', port_name, baud_rate, device)
+                if stop is not None:
+                    stop.set()
+                return serial_, device, binary
+            logger.info('%s at %d: nothing recognized', port_name, baud_rate)
+    except (serial.SerialException, OSError) as exc:
+        # e.g. it was unplugged, or it's not a real port
+        logger.info('Unable to probe %s: %s', port_name, exc)
+    if serial_ is not None:
+        try:
+            serial_.close()
+        except (serial.SerialException, OSError):
+            pass
+    return None, None, None
+
+
+def detect_device(port_names, logger):
+    """Finds the device, trying whatever was found last time first, and then
+    every port at once. Returns the open port, the device, and whether it's
+    in binary mode. If nothing is recognized, e.g. the GPS doesn't have power
+    yet, returns the port and device from last time, or the first port at the
+    Tracksoar's baud rate, with None for binary, so that whatever comes is
+    still captured.
+    """
+    start = time.time()
+    try:
+        with open(SERIAL_PROFILE_FILE_NAME) as profile_file:
+            profile = json.load(profile_file)
+    except (IOError, ValueError):
+        profile = None
+
+    result = (None, None, None)
+    if profile is not None and profile.get('port') in port_names:
+        result = probe_port(profile['port'], [profile['baud']], logger)
+    if result[0] is None:
+        # Each port can only listen at one baud rate at a time, but the ports
+        # can all be listened to at once. Stop once anything is found.
+        results = {}
+        stop = threading.Event()
+
+        def probe(port_name):  # pylint: disable=missing-docstring
+            results[port_name] = probe_port(port_name, BAUD_RATES, logger, stop)
+
+        threads = [
+            threading.Thread(target=probe, args=(port_name,))
+            for port_name in port_names
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for port_name in port_names:
+            serial_ = results.get(port_name, (None, None, None))[0]
+            if serial_ is None:
+                continue
+            if result[0] is None:
+                result = results[port_name]
+            else:
+                serial_.close()
+    if result[0] is None:
+        return open_fallback(port_names, profile, logger)
+
+    serial_, device, binary = result
+    logger.info(
+        'Found %s at %d on %s in %.1f s',
+        device,
+        serial_.baudrate,
+        serial_.port,
+        time.time() - start
+    )
+    try:
+        with open(SERIAL_PROFILE_FILE_NAME, 'w') as profile_file:
+            json.dump(
+                {'port': serial_.port, 'baud': serial_.baudrate, 'device': device},
+                profile_file
+            )
+    except (IOError, OSError) as exc:
+        logger.warning('Unable to save %s: %s', SERIAL_PROFILE_FILE_NAME, exc)
+    return result
+
 
+def open_fallback(port_names, profile, logger):
+    """Opens the port from last time's profile, or the first port at the
+    Tracksoar's baud rate, for when detection didn't recognize anything.
+    """
+    if profile is not None and profile.get('port') in port_names:
+        port_name = profile['port']
+        baud_rate = profile['baud']
+        device = profile.get('device', TRACKSOAR)
+    else:
+        port_name = port_names[0]
+        baud_rate = TRACKSOAR_BAUDRATE
+        device = TRACKSOAR
+    logger.warning(
+        'No SUP800F or Tracksoar recognized, capturing %s at %d as %s anyway',
+        port_name,
+        baud_rate,
+        device
+    )
+    try:
+        serial_ = serial.Serial(port_name, baudrate=baud_rate, timeout=1)
+    except (serial.SerialException, OSError) as exc:
+        raise EnvironmentError('Unable to open {}: {}'.format(port_name, exc))
+    return serial_, device, None
+
+
+class WriteBehind(object):
+    """Writes captured data to a file on a background thread, so that a slow
+    SD card write or fsync never stops us from reading the serial port.
+
+    Data are captured into a pool of preallocated buffers that are handed to
+    the thread and then reused. Data are fsynced within sync_interval_s of
+    being written, even if nothing else comes in, so a power loss only loses
+    that much data.
+    """
+
+    def __init__(
+            self,
+            file_,
+            logger,
+            sync_interval_s=SYNC_INTERVAL_S,
+            buffer_count=BUFFER_COUNT,
+            buffer_size=BUFFER_SIZE,
+    ):
+        self._file = file_
+        self._logger = logger
+        self._sync_interval_s = sync_interval_s
+        self._buffer_size = buffer_size
+        self._free = queue.Queue()
+        for _ in range(buffer_count):
+            self._free.put(bytearray(buffer_size))
+        self._full = queue.Queue()
+        self.buffer_count = buffer_count
+        # The fewest free buffers since the stats were reset
+        self.min_free = buffer_count
+        self.error = None
+        self._thread = threading.Thread(target=self._run, name='write-behind')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def get_buffer(self):
+        """Returns an empty buffer to capture into."""
+        try:
+            buffer = self._free.get_nowait()
+        except queue.Empty:
+            # The writer has fallen behind. If we wait for it, the serial port
+            # will overflow, so use more memory instead.
+            self._logger.warning('Out of capture buffers, allocating another')
+            self.buffer_count += 1
+            self.min_free = 0
+            return bytearray(self._buffer_size)
+        self.min_free = min(self.min_free, self._free.qsize())
+        return buffer
+
+    def put(self, buffer, length):
+        """Queues the first length bytes of buffer to be written."""
+        if self.error is not None:
+            raise self.error
+        self._full.put((buffer, length))
+
+    def format_headroom(self):
+        """Returns how close we've come to running out of buffers, and resets
+        it.
+        """
+        headroom = 'at least {} of {} buffers free'.format(
+            self.min_free,
+            self.buffer_count
+        )
+        self.min_free = self._free.qsize()
+        return headroom
+
+    def close(self):
+        """Writes everything that's queued, syncs, and stops the thread."""
+        self._full.put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _sync(self):
+        """Makes sure everything written so far is on the disk."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _run(self):
+        """Writes buffers until close is called."""
+        # When the oldest data that haven't been synced were written
+        unsynced_s = None
         while True:
-            data = serial_.read(256)
-            bytes_read_count += len(data)
-            if len(data) > 0:
-                logger.debug(data)
-            serial_file.write(data)
-
-            now = datetime.datetime.now()
-            if (now - last_timestamp).seconds > serial_.timeout:
-                # Grab the rest of the bytes so that we don't cut anything off
-                previous_timeout = serial_.timeout
-                # At 9600 baud, we should see... 1200 chars per second? so 0.01
-                # seconds should be enough to wait if there are data coming
-                # through
-                serial_.timeout = 0.01
-                data = b'1'
-                while len(data) > 0:
-                    data = serial_.read(256)
-                    bytes_read_count += len(data)
-                    if len(data) > 0:
-                        logger.debug(data)
-                    serial_file.write(data)
-                serial_.timeout = previous_timeout
-
-                time_stamp = datetime.datetime.strftime(now, '%Y-%m-%d %H:%M:%S')
-
-                serial_file.write('\n{}\n'.format(time_stamp).encode())
-                serial_file.flush()
-
-                logger.info('%s: read %d bytes', time_stamp, bytes_read_count)
-                last_timestamp = now
-                bytes_read_count = 0
+            # Only wait as long as the unsynced data can, in case the serial
+            # port has gone quiet
+            timeout = None
+            if unsynced_s is not None:
+                timeout = max(unsynced_s + self._sync_interval_s - time.time(), 0)
+            try:
+                item = self._full.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item:
+                buffer, length = item
+                try:
+                    self._file.write(memoryview(buffer)[:length])
+                    if unsynced_s is None:
+                        unsynced_s = time.time()
+                except (IOError, OSError) as exc:
+                    self.error = exc
+                self._free.put(buffer)
+                self._logger.debug('Wrote %d bytes', length)
+            if unsynced_s is not None and time.time() - unsynced_s >= self._sync_interval_s:
+                try:
+                    self._sync()
+                except (IOError, OSError) as exc:
+                    self.error = exc
+                unsynced_s = None
+        try:
+            self._sync()
+        except (IOError, OSError) as exc:
+            self.error = exc
 
 
-def check_for_sup800f(serial_, logger):
-    """Cheks for SUP800F connected to the serial port."""
-    logger.info('Checking for SUP800F')
-    # First, check if we're seeing PSTI messages. SUP800F loves dumping those
-    # in NMEA mode, and I don't think you can turn them off.
-    old_timeout_s = serial_.timeout
+class SegmentedLog(object):
+    """A serial log that's split into segments of at most segment_bytes or
+    segment_s seconds, each starting with a header that says what it is.
+    Closed segments are gzipped by a low priority process, so that the logs
+    don't fill up the SD card that the video is also recorded to. Segments
+    that earlier runs left uncompressed are gzipped when we start.
+    """
 
-    # These should be spewing out at least once per second, so 5 should be safe
-    serial_.timeout = 5
+    def __init__(
+            self,
+            base_name,
+            logger,
+            header_info,
+            segment_bytes=SEGMENT_BYTES,
+            segment_s=SEGMENT_S,
+    ):
+        self._base_name = base_name
+        self._logger = logger
+        self._header_info = header_info
+        self._segment_bytes = segment_bytes
+        self._segment_s = segment_s
+        self._segment = -1
+        self._file = None
+        self._opened_s = None
+        self._compressors = []
+        self.file_name = None
+        self._compress_leftovers()
+        self._open_next_segment()
 
-    def inner(serial_):
-        """Helper function to check for SUP800F. Defined as a convenience so
-        that I don't have a bunch of function return points where I need to
-        remember to reset the timeout.
+    def _compress_leftovers(self):
+        """Starts gzipping segments from earlier runs, i.e. their last
+        segments and any that were being compressed when the power went out.
         """
+        directory = os.path.dirname(self._base_name) or '.'
+        for file_name in sorted(glob.glob(os.path.join(directory, '*.log'))):
+            if serial_log.SEGMENT_REGEX.match(file_name) is not None:
+                self._compress(file_name)
+
+    def _open_next_segment(self):
+        """Closes the current segment, if any, and starts the next one."""
+        if self._file is not None:
+            self._close_segment()
+            self._compress(self.file_name)
+        self._segment += 1
+        self.file_name = '{}.{:03d}.log'.format(self._base_name, self._segment)
+        self._logger.info('Opening %s', self.file_name)
+        self._file = open(self.file_name, 'wb')
+        self._opened_s = time.time()
+        header_info = dict(self._header_info)
+        header_info.update(segment=self._segment, start_s=self._opened_s)
+        self._file.write(serial_log.format_header(header_info))
+
+    def _close_segment(self):
+        """Makes sure the current segment is on the disk and closes it."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+
+    def _compress(self, file_name):
+        """Starts gzipping a closed segment in the background."""
+        self._reap_compressors()
         try:
-            line = serial_.readline()
-            if line.startswith(b'$PSTI'):
-                return True
-        except TimeoutError:
+            # -f replaces a partial .gz from a compression that was cut off
+            process = subprocess.Popen(['nice', '-n', '19', 'gzip', '-f', file_name])
+        except OSError as exc:
+            self._logger.warning('Unable to compress %s: %s', file_name, exc)
+            return
+        self._compressors.append(process)
+
+    def _reap_compressors(self):
+        """Forgets about the compression processes that are done."""
+        self._compressors = [
+            process for process in self._compressors
+            if not self._check_compressor(process)
+        ]
+
+    def _check_compressor(self, process):
+        """Returns True if a compression process is done."""
+        if process.poll() is None:
             return False
+        if process.returncode != 0:
+            self._logger.warning(
+                'Compressing %s failed with %d',
+                process.args[-1],
+                process.returncode
+            )
+        return True
 
+    def write(self, data):
+        """Writes data, starting a new segment first if it's time."""
+        if (
+                self._file.tell() >= self._segment_bytes
+                or time.time() - self._opened_s >= self._segment_s
+        ):
+            self._open_next_segment()
+        self._file.write(data)
+
+    def flush(self):
+        """Flushes the current segment."""
+        self._file.flush()
+
+    def fileno(self):
+        """Returns the current segment's file descriptor."""
+        return self._file.fileno()
+
+    def close(self):
+        """Closes the current segment and waits up to COMPRESS_WAIT_S for
+        the others to be compressed. The current segment is left uncompressed,
+        because we're probably shutting down, so the next run compresses it.
+        """
+        if self._file is not None:
+            self._close_segment()
+        deadline = time.time() + COMPRESS_WAIT_S
+        self._reap_compressors()
+        while self._compressors and time.time() < deadline:
+            time.sleep(0.1)
+            self._reap_compressors()
+        for process in self._compressors:
+            self._logger.warning('Still compressing %s', process.args[-1])
+
+
+class LiveDecoder(object):
+    """Decodes data as they're captured and writes them to a sensor log. Runs
+    on its own thread and never makes the capture wait; if it falls behind,
+    data are dropped from decoding, but not from the raw log. Decodes SUP800F
+    binary messages, and NmeaDecoder decodes NMEA sentences instead.
+    """
+
+    columns = SUP800F_SENSOR_COLUMNS
+
+    def __init__(self, file_name, logger, sync_interval_s=SYNC_INTERVAL_S):
+        self._logger = logger
+        self._sync_interval_s = sync_interval_s
+        self._chunks = queue.Queue(maxsize=DECODE_QUEUE_SIZE)
+        self._sensor_log = sensor_log.SensorLogWriter(file_name, self.columns)
+        self._last_block = time.time()
+        # Offsets in the decoded stream and when they were received, for
+        # interpolating when each message was received
+        self._received_count = 0
+        self._anchors = collections.deque([(0, time.time())], maxlen=16)
+        self.dropped_bytes = 0
+        # Set if decoding stopped because of an error
+        self.failed = False
+        self._parser = self._make_parser()
+        self._thread = threading.Thread(target=self._run, name='live-decoder')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def feed(self, data, received_s):
+        """Queues data that were received by received_s to be decoded."""
+        # Nothing means we're done to the decoder
+        if not data:
+            return
+        if self.failed:
+            self.dropped_bytes += len(data)
+            return
         try:
-            sup800f.get_message(serial_, timeout_bytes=200)
-        except ValueError:
-            logger.info('No SUP800F found')
-            return False
+            self._chunks.put_nowait((data, received_s))
+        except queue.Full:
+            self.dropped_bytes += len(data)
 
-        logger.info('Found SUP800F')
-        return True
+    def read(self, _size=None):
+        """Returns the next chunk, or nothing when we're done."""
+        item = self._chunks.get()
+        if item is None:
+            return b''
+        data, received_s = item
+        self._received_count += len(data)
+        self._anchors.append((self._received_count, received_s))
+        return data
+
+    def format_stats(self):
+        """Returns the counts, for logging."""
+        return '{} rows decoded, {} bytes dropped, {}'.format(
+            self._sensor_log.row_count,
+            self.dropped_bytes,
+            self._parser.format_stats()
+        )
 
-    found = inner(serial_)
-    serial_.timeout = old_timeout_s
-    return found
+    def close(self):
+        """Decodes everything that's queued, writes it, and stops the thread."""
+        # If the thread died, nothing will make room in the queue
+        while self._thread.is_alive():
+            try:
+                self._chunks.put(None, timeout=1.0)
+                break
+            except queue.Full:
+                continue
+        self._thread.join()
+
+    def _time_at(self, offset):
+        """Returns when offset in the stream was received."""
+        offsets, times = zip(*self._anchors)
+        times = serial_log.interpolate_times(offsets, times, (offset,))
+        return self._anchors[-1][1] if times is None else times[0]
+
+    def _append(self, row):
+        """Adds a row to the sensor log, writing a block if it's time."""
+        self._sensor_log.append(row)
+        now = time.time()
+        if now - self._last_block >= self._sync_interval_s:
+            self._sensor_log.write_block()
+            self._last_block = now
+
+    def _make_parser(self):
+        """Returns what finds messages in the chunks from read()."""
+        return sup800f.FrameReader(self)
+
+    def _decode(self):
+        """Decodes chunks from read() until it returns nothing."""
+        for frame in self._parser:
+            if len(frame) != sup800f.BINARY_MESSAGE_LENGTH or frame[4] != 0xCF:
+                continue
+            message = sup800f.parse_binary(frame)
+            self._append(
+                (self._time_at(self._parser.frame_offset),) + tuple(message)
+            )
+
+    def _run(self):
+        """Decodes until close is called."""
+        try:
+            self._decode()
+            self._sensor_log.close()
+        except Exception:  # pylint: disable=broad-except
+            # The raw log is what really matters, so keep capturing
+            self.failed = True
+            self._logger.exception('Live decoding failed')
+
+
+class NmeaDecoder(LiveDecoder):
+    """Decodes GGA fixes from NMEA sentences, e.g. from the Tracksoar."""
+
+    columns = NMEA_SENSOR_COLUMNS
+
+    def _make_parser(self):
+        return nmea.NmeaParser()
+
+    def _decode(self):
+        data = self.read()
+        while data:
+            for offset, record in self._parser.feed(data):
+                if not isinstance(record, nmea.Gga) or not record.fix_quality:
+                    continue
+                self._append((
+                    self._time_at(offset),
+                    record.latitude_d,
+                    record.longitude_d,
+                    # Missing values can't be stored in arrays
+                    float('nan') if record.altitude_m is None else record.altitude_m,
+                    record.satellites or 0,
+                    float('nan') if record.hdop is None else record.hdop,
+                ))
+            data = self.read()
+
+
+def dump_serial(
+        serial_,
+        logger,
+        device,
+        sync_interval_s=SYNC_INTERVAL_S,
+        segment_bytes=SEGMENT_BYTES,
+        segment_s=SEGMENT_S,
+        live_decode=False,
+):
+    """Dumps the serial port to segmented log files."""
+    serial_path = 'serials'
+    if not os.path.isdir(serial_path):
+        os.mkdir(serial_path)
+
+    base_name = serial_path + os.sep + datetime.datetime.strftime(
+        datetime.datetime.now(),
+        '%Y-%m-%d_%H:%M:%S'
+    )
+    header_info = {
+        'baud': serial_.baudrate,
+        'device': device,
+        'port': serial_.port,
+    }
+    serial_file = SegmentedLog(
+        base_name,
+        logger,
+        header_info,
+        segment_bytes,
+        segment_s
+    )
+    decoder = None
+    if live_decode:
+        decoder_class = LiveDecoder if device == SUP800F else NmeaDecoder
+        decoder = decoder_class(
+            base_name + sensor_log.EXTENSION,
+            logger,
+            sync_interval_s
+        )
+    try:
+        # Detecting the SUP800F might have read past the last message it
+        # needed, so save those bytes first
+        buffered = sup800f.take_buffered(serial_)
+        serial_file.write(buffered)
+        if decoder is not None:
+            decoder.feed(buffered, time.time())
+        writer = WriteBehind(serial_file, logger, sync_interval_s)
+        try:
+            capture(serial_, writer, logger, decoder)
+        finally:
+            writer.close()
+    finally:
+        serial_file.close()
+        if decoder is not None:
+            decoder.close()
+
+
+def capture(serial_, writer, logger, decoder=None):
+    """Reads from the serial port into the writer's buffers, adding a
+    timestamp every TIMESTAMP_INTERVAL_S. Copies of the data, without the
+    timestamps, are fed to the decoder if there is one.
+    """
+    # Don't block for long, so that data are handed off and timestamped on
+    # time even if nothing is coming in
+    serial_.timeout = HANDOFF_INTERVAL_S
+    buffer = writer.get_buffer()
+    view = memoryview(buffer)
+    used = 0
+    # Where the data that haven't been fed to the decoder start
+    decode_start = 0
+    last_handoff = last_timestamp = time.time()
+    bytes_read_count = 0
+
+    try:
+        while True:
+            # Only ask for what's already there, or 1 byte to wait for more
+            count = max(1, min(serial_.in_waiting, len(buffer) - used))
+            read_count = serial_.readinto(view[used:used + count])
+            used += read_count
+            bytes_read_count += read_count
+
+            now = time.time()
+            if now - last_timestamp >= TIMESTAMP_INTERVAL_S:
+                time_stamp = datetime.datetime.fromtimestamp(now).strftime(
+                    '%Y-%m-%d %H:%M:%S'
+                )
+                marker = '\n{}\n'.format(time_stamp).encode()
+                if decoder is not None:
+                    decoder.feed(bytes(view[decode_start:used]), now)
+                if used + len(marker) > len(buffer):
+                    writer.put(buffer, used)
+                    buffer = writer.get_buffer()
+                    view = memoryview(buffer)
+                    used = 0
+                view[used:used + len(marker)] = marker
+                used += len(marker)
+                decode_start = used
+
+                logger.info(
+                    '%s: read %d bytes, %.0f bytes/s, %s',
+                    time_stamp,
+                    bytes_read_count,
+                    bytes_read_count / (now - last_timestamp),
+                    writer.format_headroom()
+                )
+                if decoder is not None:
+                    logger.info('Live decoding: %s', decoder.format_stats())
+                last_timestamp = now
+                bytes_read_count = 0
+
+            if used == len(buffer) or (used > 0 and now - last_handoff >= HANDOFF_INTERVAL_S):
+                if decoder is not None:
+                    decoder.feed(bytes(view[decode_start:used]), now)
+                writer.put(buffer, used)
+                buffer = writer.get_buffer()
+                view = memoryview(buffer)
+                used = 0
+                decode_start = 0
+                last_handoff = now
+    finally:
+        # Don't lose the last partial buffer, e.g. on Ctrl-C
+        if decoder is not None:
+            decoder.feed(bytes(view[decode_start:used]), time.time())
+        if used > 0:
+            writer.put(buffer, used)
 
 
 if __name__ == '__main__':
-    verbose = ('-v' in sys.argv or '--verbose' in sys.argv)
-    main(verbose)
+    parser = argparse.ArgumentParser(description='Dumps the serial port to a file')
+    parser.add_argument(
+        '-v',
+        '--verbose',
+        action='store_true',
+        default=False,
+        help='Log every write.',
+        dest='verbose',
+    )
+    parser.add_argument(
+        '--sync-interval',
+        type=float,
+        default=SYNC_INTERVAL_S,
+        help='Seconds between fsyncs of the log, about the most data a power loss can lose.',
+        dest='sync_interval_s',
+    )
+    parser.add_argument(
+        '--segment-size',
+        type=float,
+        default=SEGMENT_BYTES / 1024 / 1024,
+        help='Start a new segment of the log after this many MB.',
+        dest='segment_mb',
+    )
+    parser.add_argument(
+        '--segment-minutes',
+        type=float,
+        default=SEGMENT_S / 60,
+        help='Start a new segment of the log after this many minutes.',
+        dest='segment_minutes',
+    )
+    parser.add_argument(
+        '--live-decode',
+        action='store_true',
+        default=False,
+        help='Also decode the data as they arrive and save them to a .sensors file.',
+        dest='live_decode',
+    )
+    options = parser.parse_args()
+    options.segment_bytes = int(options.segment_mb * 1024 * 1024)
+    options.segment_s = options.segment_minutes * 60
+    main(options)
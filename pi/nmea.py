@@ -0,0 +1,241 @@
+"""Parses NMEA sentences from the Tracksoar, or from the SUP800F in NMEA mode.
+
+Only GGA (fix), RMC (recommended minimum), and the SUP800F's proprietary PSTI
+sentences are parsed, from any talker, e.g. $GPGGA and $GNGGA. Sentences with
+bad checksums are dropped.
+
+To parse a whole log:
+
+    python nmea.py serials/2024-04-08_17:00:00.*.log* [--csv]
+"""
+import collections
+import functools
+import operator
+import re
+import sys
+import time
+
+import serial_log
+
+
+# NMEA says 82, but leave some room for proprietary sentences
+MAX_SENTENCE_LENGTH = 256
+# Matches the sentences we parse anywhere in a log, so that the others are
+# skipped without looking at them in Python
+SENTENCE_REGEX = re.compile(
+    br'\$(?:[A-Z]{2}(?:GGA|RMC)|PSTI),[^$\r\n]*'
+)
+KNOTS_TO_M_S = 1852.0 / 3600.0
+
+Gga = collections.namedtuple(  # pylint: disable=invalid-name
+    'Gga',
+    ' '.join((
+        'time',  # hhmmss.ss, UTC
+        'latitude_d', 'longitude_d',
+        'fix_quality',  # 0 = no fix
+        'satellites',
+        'hdop',
+        'altitude_m',
+    ))
+)
+Rmc = collections.namedtuple(  # pylint: disable=invalid-name
+    'Rmc',
+    ' '.join((
+        'time',  # hhmmss.ss, UTC
+        'valid',
+        'latitude_d', 'longitude_d',
+        'speed_m_s',
+        'course_d',
+        'date',  # ddmmyy
+    ))
+)
+Psti = collections.namedtuple(  # pylint: disable=invalid-name
+    'Psti',
+    ' '.join((
+        'message_id',  # e.g. '030'
+        'fields',
+    ))
+)
+
+
+def checksum(body):
+    """The NMEA checksum, all of the bytes between the $ and * XORed."""
+    return functools.reduce(operator.xor, body, 0)
+
+
+def _float(field):
+    """Returns a field as a float, or None if it's empty."""
+    return float(field) if field else None
+
+
+def _int(field):
+    """Returns a field as an int, or None if it's empty."""
+    return int(field) if field else None
+
+
+def _degrees(field, hemisphere, degree_digits):
+    """Converts e.g. 3959.8302,N to decimal degrees."""
+    if not field:
+        return None
+    degrees = int(field[:degree_digits]) + float(field[degree_digits:]) / 60.0
+    return -degrees if hemisphere in ('S', 'W') else degrees
+
+
+def parse_sentence(sentence):
+    """Parses a sentence (bytes, from the $ up to but not including the line
+    ending) into a Gga, Rmc, or Psti. Returns None for other sentences, and
+    raises ValueError if it's malformed or the checksum is wrong.
+    """
+    star = sentence.rfind(b'*')
+    if not sentence.startswith(b'$') or star == -1:
+        raise ValueError('Not an NMEA sentence')
+    body = sentence[1:star]
+    try:
+        expected = int(sentence[star + 1:star + 3], 16)
+    except ValueError:
+        raise ValueError('Malformed checksum')
+    if checksum(body) != expected:
+        raise ValueError('Bad checksum')
+
+    fields = body.decode('ascii').split(',')
+    kind = fields[0]
+    if kind == 'PSTI':
+        return Psti(fields[1] if len(fields) > 1 else '', tuple(fields[2:]))
+    kind = kind[2:]
+    if kind == 'GGA':
+        if len(fields) < 10:
+            raise ValueError('Only {} fields'.format(len(fields)))
+        return Gga(
+            fields[1],
+            _degrees(fields[2], fields[3], 2),
+            _degrees(fields[4], fields[5], 3),
+            _int(fields[6]),
+            _int(fields[7]),
+            _float(fields[8]),
+            _float(fields[9]),
+        )
+    if kind == 'RMC':
+        if len(fields) < 10:
+            raise ValueError('Only {} fields'.format(len(fields)))
+        speed_knots = _float(fields[7])
+        return Rmc(
+            fields[1],
+            fields[2] == 'A',
+            _degrees(fields[3], fields[4], 2),
+            _degrees(fields[5], fields[6], 3),
+            None if speed_knots is None else speed_knots * KNOTS_TO_M_S,
+            _float(fields[8]),
+            fields[9],
+        )
+    return None
+
+
+class NmeaParser(object):
+    """Parses sentences from data as they arrive, keeping partial lines
+    until the rest comes in.
+    """
+
+    def __init__(self):
+        self._partial = b''
+        # Where _partial starts in everything that's been fed
+        self._offset = 0
+        self.good_sentences = 0
+        self.bad_sentences = 0
+
+    def format_stats(self):
+        """Returns the counts, for logging."""
+        return '{} good sentences, {} bad sentences'.format(
+            self.good_sentences,
+            self.bad_sentences
+        )
+
+    def parse(self, sentence):
+        """Parses a sentence, counting it as good or bad."""
+        try:
+            record = parse_sentence(sentence)
+        except (ValueError, UnicodeDecodeError):
+            self.bad_sentences += 1
+            return None
+        self.good_sentences += 1
+        return record
+
+    def feed(self, data):
+        """Returns the (offset, record) of each complete sentence we parse,
+        where offset is where the sentence starts in everything that's been
+        fed.
+        """
+        data = self._partial + bytes(data)
+        records = []
+        end = data.rfind(b'\n') + 1
+        for match in SENTENCE_REGEX.finditer(data, 0, end):
+            record = self.parse(match.group().rstrip(b'\r'))
+            if record is not None:
+                records.append((self._offset + match.start(), record))
+        self._partial = data[end:]
+        self._offset += end
+        # Don't let binary data without line endings pile up
+        if len(self._partial) > MAX_SENTENCE_LENGTH:
+            self._offset += len(self._partial) - MAX_SENTENCE_LENGTH
+            self._partial = self._partial[-MAX_SENTENCE_LENGTH:]
+        return records
+
+
+def parse_log(file_names):
+    """Parses all of the sentences in one or more segments of a log at once.
+    Returns the parser, with its counts, and lists of the time each sentence
+    was received and the sentence's record.
+    """
+    pieces, index = serial_log.read_without_timestamps(file_names)
+    parser = NmeaParser()
+    offsets = []
+    records = []
+    # Sentences split by a timestamp marker or a new segment are put back
+    # together by the parser
+    for piece in pieces:
+        for offset, record in parser.feed(piece):
+            offsets.append(offset)
+            records.append(record)
+    for offset, record in parser.feed(b'\n'):
+        offsets.append(offset)
+        records.append(record)
+    return parser, index.times_at(offsets), records
+
+
+def main(file_names, csv):
+    """Main."""
+    start = time.time()
+    parser, times, records = parse_log(file_names)
+    fixes = [
+        (time_s, record) for time_s, record in zip(times or [None] * len(records), records)
+        if isinstance(record, Gga) and record.fix_quality
+    ]
+    if csv:
+        print('time_s,time,latitude_d,longitude_d,altitude_m,satellites,hdop')
+        for time_s, fix in fixes:
+            print(','.join(
+                '' if value is None else str(value)
+                for value in (
+                    time_s, fix.time, fix.latitude_d, fix.longitude_d,
+                    fix.altitude_m, fix.satellites, fix.hdop,
+                )
+            ))
+        return
+    print('Parsed in {:.2f} s'.format(time.time() - start))
+    print(parser.format_stats())
+    counts = collections.Counter(type(record).__name__ for record in records)
+    print(', '.join('{} {}'.format(count, name) for name, count in sorted(counts.items())))
+    print('{} GGA fixes'.format(len(fixes)))
+    if fixes:
+        highest = max(fixes, key=lambda time_fix: time_fix[1].altitude_m or 0.0)
+        print('Highest: {}'.format(highest[1]))
+
+
+if __name__ == '__main__':
+    # Poverty command line argument parsing
+    if '-h' in sys.argv or len(sys.argv) < 2:
+        print('Usage: {} <file or segments> [--csv]'.format(sys.argv[0]))
+        sys.exit(0)
+    main(
+        [argument for argument in sys.argv[1:] if not argument.startswith('--')],
+        '--csv' in sys.argv
+    )
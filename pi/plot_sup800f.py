@@ -1,101 +1,111 @@
-import datetime
-import re
 import sys
+import time
 
+import sensor_log
+import serial_log
 import sup800f
 
 
-class ReadWrapper(object):
-    def __init__(self, file_name):
-        # TODO: This won't work if processing data from the previous year
-        self._timestamp_regex = re.compile(
-                r'\n{year}-\d{{2}}-\d{{2}} \d{{2}}:\d{{2}}:\d{{2}}\n'.format(
-                    year=datetime.datetime.now().year
-                ).encode()
-        )
-        print(self._timestamp_regex)
-        self._file = open(file_name, 'rb')
-        # Skip to the first message. All messages have a 1 byte checksum
-        # followed by 0x0D0A
-        self._buffer = self._file.read(1024)
-        index = 0
-        while index < len(self._buffer):
-            if self._buffer[index] != 0x0D:
-                index += 1
-                continue
-            index += 1
-            if self._buffer[index] != 0x0A:
-                index += 1
-                continue
-            break
-
-        self._buffer = self._buffer[index + 1:]
-        print('Skipped {} bytes to first message'.format(index))
-
-        skipped_gps_messages_count = 0
-        while len(self._buffer) < 1024:
-            part = self._file.read(1024)
-            self._buffer += part
-            # We might have accidentally picked up some GPS messages before
-            # switching modes; ignore them
-            while self._buffer.startswith(b'$'):
-                skipped_gps_messages_count += 1
-                index = self._buffer.find(b'\n')
-                if index != -1:
-                    self._buffer = self._buffer[index + 1:]
-            if len(part) == 0:
-                break
-        if skipped_gps_messages_count > 0:
-            print('Skipped {} GPS messages'.format(skipped_gps_messages_count))
-
-    def read(self, count=None):
-        """Reads some bytes."""
-        if count is None:
-            count = 1
-        if len(self._buffer) < 1024:
-            read_bytes = self._file.read(1024)
-            subbed = self._timestamp_regex.sub(b'', read_bytes)
-            self._buffer += subbed
-        if len(self._buffer) == 0:
-            self._file.close()
-            raise EOFError('Nothing more to read')
-
-        slice_ = self._buffer[:count]
-        self._buffer = self._buffer[count:]
-        print(slice_)
-        return slice_
-
-
-def main(serial_file_name, gui=True):
-    """Main."""
-    if sys.version_info.major <= 2:
-        print('Use Python 3')
-        return
-
+def load_messages(serial_file_names):
+    """Decodes the binary messages in a log one at a time. Slow, but doesn't
+    need numpy.
+    """
     data = []
-    serial_file = ReadWrapper(serial_file_name)
+    offsets = []
     count = 0
-    while True:
-        try:
-            message_bytes = sup800f.get_message(serial_file)
-        except EOFError:
-            break
-        count += 1
-        if count % 100 == 0 and count < 501:
-            print(message_bytes)
-        # The SUP800F dumps some other type of message that's 66 bytes long.
-        # We only care about the binary stuff, which is always 41.
-        if len(message_bytes) != 41:
-            continue
-
-        message = sup800f.parse_binary(message_bytes)
-        if message is not None:
-            data.append(message)
+    with serial_log.ReadWrapper(serial_file_names) as serial_file:
+        reader = sup800f.FrameReader(serial_file)
+        for message_bytes in reader:
+            count += 1
+            # The SUP800F dumps some other type of message that's 66 bytes
+            # long. We only care about the binary stuff, which is always 41.
+            if len(message_bytes) != sup800f.BINARY_MESSAGE_LENGTH:
+                continue
+
+            message = sup800f.parse_binary(message_bytes)
+            if message is not None:
+                data.append(message)
+                offsets.append(reader.frame_offset)
 
     print('Received {} messages'.format(count))
     print('Received {} binary messages'.format(len(data)))
+    print(reader.format_stats())
+    columns = {
+        attribute: [getattr(d, attribute) for d in data]
+        for attribute in sup800f.BinaryMessage._fields
+    }
+    columns['time_s'] = serial_file.index.times_at(offsets)
+    return columns
+
+
+def load_columns(serial_file_names):
+    """Decodes the binary messages in a log, all at once if numpy is
+    installed. Sensor logs that dump_serial decoded while capturing are
+    already decoded, so they're just read.
+    """
+    if all(name.endswith(sensor_log.EXTENSION) for name in serial_file_names):
+        columns = {}
+        for file_name in serial_file_names:
+            for name, values in sensor_log.read_sensor_log(file_name).items():
+                columns.setdefault(name, []).extend(values)
+        print('Read {} decoded messages'.format(len(columns.get('time_s', []))))
+        for name in ('time_s',) + sup800f.BinaryMessage._fields:
+            columns.setdefault(name, [])
+        return columns
+    pieces, index = serial_log.read_without_timestamps(serial_file_names)
+    try:
+        decoded = sup800f.decode_binary_messages(pieces)
+    except ImportError:
+        print('numpy not installed, decoding one message at a time')
+        return load_messages(serial_file_names)
+
+    print('Received {} binary messages'.format(len(decoded.offsets)))
+    print('{} bad checksums'.format(decoded.bad_checksums))
+    if len(decoded.discarded) > 0:
+        lengths = decoded.discarded[:, 1]
+        largest = lengths.argmax()
+        print(
+            'Discarded {} bytes in {} regions, the largest is {} bytes at data offset {}'.format(
+                lengths.sum(),
+                len(lengths),
+                lengths[largest],
+                decoded.discarded[largest, 0],
+            )
+        )
+    columns = decoded.columns
+    columns['time_s'] = index.times_at(decoded.offsets.tolist())
+    return columns
+
+
+def benchmark(serial_file_names):
+    """Compares decoding a message at a time with decoding all at once."""
+    for name, function in (
+            ('one at a time', load_messages),
+            ('all at once', load_columns),
+    ):
+        start = time.time()
+        function(serial_file_names)
+        print('{}: {:.2f} s'.format(name, time.time() - start))
+
 
-    seconds = [i * 0.1 for i in range(len(data))]
+def main(serial_file_names, gui=True):
+    """Main."""
+    if sys.version_info.major <= 2:
+        print('Use Python 3')
+        return
+
+    columns = load_columns(serial_file_names)
+    if columns['time_s'] is None:
+        print('Not enough timestamps in the log, assuming 10 messages per second')
+        count = len(columns['temperature_c'])
+        seconds = [i * 0.1 for i in range(count)]
+    else:
+        seconds = [time_s - columns['time_s'][0] for time_s in columns['time_s']]
+        if seconds:
+            print('Messages from {} to {}'.format(
+                time.ctime(columns['time_s'][0]),
+                time.ctime(columns['time_s'][-1]),
+            ))
     hours = [sec / 3600. for sec in seconds]
 
     try:
@@ -115,7 +125,7 @@ def main(serial_file_name, gui=True):
             'temperature_c',
     ):
         if gui:
-            plot_data = [getattr(d, attribute) for d in data]
+            plot_data = columns[attribute]
 
             pyplot.plot(hours, plot_data)
             pyplot.xlabel('time (hours)')
@@ -126,14 +136,18 @@ def main(serial_file_name, gui=True):
         else:
             # Just print them
             print('***** {} ******'.format(attribute))
-            for d in data:
-                print(getattr(d, attribute))
+            for value in columns[attribute]:
+                print(value)
             print('')
 
 
 if __name__ == '__main__':
     # Poverty command line argument parsing
     if '-h' in sys.argv or len(sys.argv) < 2:
-        print('Usage: {} <file> [--no-gui]'.format(sys.argv[0]))
+        print('Usage: {} <file or segments> [--no-gui] [--benchmark]'.format(sys.argv[0]))
+        sys.exit(0)
+    file_names = [argument for argument in sys.argv[1:] if not argument.startswith('--')]
+    if '--benchmark' in sys.argv:
+        benchmark(file_names)
         sys.exit(0)
-    main(sys.argv[1], '--no-gui' not in sys.argv)
+    main(file_names, '--no-gui' not in sys.argv)
@@ -0,0 +1,90 @@
+"""Columnar files of decoded sensor data, e.g. serials/2024-04-08_17:00:00.sensors.
+
+dump_serial writes these while it's capturing, so analysis can start from
+decoded data instead of the raw log. The file is a series of blocks, each a
+header line like
+
+    #block {"byteorder": "little", "columns": [["time_s", "d"], ...], "count": 100}
+
+followed by each column's values, one column after another, as packed arrays
+with the given typecodes. If the power goes out while writing a block, that
+block is ignored.
+"""
+import array
+import json
+import os
+import sys
+
+
+BLOCK_PREFIX = b'#block '
+EXTENSION = '.sensors'
+
+
+class SensorLogWriter(object):
+    """Collects rows of sensor data and writes them as blocks of columns."""
+
+    def __init__(self, file_name, columns):
+        # (name, array typecode) of each column
+        self.columns = list(columns)
+        self._file = open(file_name, 'ab')
+        self._values = [array.array(typecode) for _, typecode in self.columns]
+        self.row_count = 0
+
+    def append(self, row):
+        """Adds a row, with a value for each column."""
+        for values, value in zip(self._values, row):
+            values.append(value)
+
+    def write_block(self):
+        """Writes everything appended since the last block to the disk."""
+        count = len(self._values[0])
+        if count == 0:
+            return
+        header = {
+            'byteorder': sys.byteorder,
+            'columns': self.columns,
+            'count': count,
+        }
+        self._file.write(
+            BLOCK_PREFIX + json.dumps(header, sort_keys=True).encode() + b'\n'
+        )
+        for values in self._values:
+            self._file.write(values.tobytes())
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.row_count += count
+        self._values = [array.array(typecode) for _, typecode in self.columns]
+
+    def close(self):
+        """Writes the last block and closes the file."""
+        self.write_block()
+        self._file.close()
+
+
+def read_sensor_log(file_name):
+    """Returns a dict of column name to array.array of values."""
+    with open(file_name, 'rb') as file_:
+        data = file_.read()
+    columns = {}
+    position = 0
+    while data.startswith(BLOCK_PREFIX, position):
+        end = data.find(b'\n', position)
+        if end == -1:
+            break
+        header = json.loads(data[position + len(BLOCK_PREFIX):end].decode())
+        position = end + 1
+        block = []
+        for name, typecode in header['columns']:
+            values = array.array(typecode)
+            length = header['count'] * values.itemsize
+            if position + length > len(data):
+                # Partially written
+                return columns
+            values.frombytes(data[position:position + length])
+            if header['byteorder'] != sys.byteorder:
+                values.byteswap()
+            block.append((name, values))
+            position += length
+        for name, values in block:
+            columns.setdefault(name, array.array(values.typecode)).extend(values)
+    return columns
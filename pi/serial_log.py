@@ -0,0 +1,482 @@
+"""Reads the serial logs that dump_serial.py writes.
+
+Every so often, dump_serial writes a timestamp marker like
+'\n2024-04-08 17:38:11\n' into the log, wherever it happens to be in the
+stream, even in the middle of a message. The readers here find all of the
+markers once and then step over them, so the data can be read as if they
+weren't there.
+
+The markers also say when the data was received, so they're indexed and the
+index is saved next to the log, e.g. serials/2024-04-08_17:00:00.log.index, so
+that it doesn't need to be rebuilt every time the log is analyzed.
+
+Logs are split into segments, e.g. serials/2024-04-08_17:00:00.003.log, which
+are gzipped once they're closed. Each segment starts with a header line like
+
+    #serial-log {"baud": 115200, "device": "sup800f", "segment": 3, ...}
+
+The readers skip the headers and decompress segments as needed, so a list of
+segments can be read like one log. Older logs without headers work too.
+"""
+import bisect
+import contextlib
+import datetime
+import gzip
+import json
+import mmap
+import os
+import re
+import time
+
+import sensor_log
+
+
+TIMESTAMP_REGEX = re.compile(
+    br'\n\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\n'
+)
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+TIMESTAMP_LENGTH = len('\n2024-04-08 17:38:11\n')
+INDEX_EXTENSION = '.index'
+# Saved indexes from other versions are rebuilt
+INDEX_VERSION = 2
+HEADER_PREFIX = b'#serial-log '
+MAX_HEADER_LENGTH = 1024
+SEGMENT_REGEX = re.compile(r'^(.*)\.(\d+)\.log(\.gz)?$')
+
+
+def parse_timestamp(marker):
+    """Returns the time of a timestamp marker in seconds since the epoch."""
+    parsed = datetime.datetime.strptime(marker.strip().decode(), TIMESTAMP_FORMAT)
+    # dump_serial writes local times, truncated to the second, so use the
+    # middle of the second
+    return time.mktime(parsed.timetuple()) + 0.5
+
+
+def format_header(info):
+    """Returns a segment header line."""
+    return HEADER_PREFIX + json.dumps(info, sort_keys=True).encode() + b'\n'
+
+
+def parse_header(data):
+    """Returns a segment's header info and the header's length, or None and 0
+    if it doesn't have a complete header.
+    """
+    if data[:len(HEADER_PREFIX)] != HEADER_PREFIX:
+        return None, 0
+    end = data.find(b'\n', 0, MAX_HEADER_LENGTH)
+    if end == -1:
+        return None, 0
+    try:
+        return json.loads(bytes(data[len(HEADER_PREFIX):end]).decode()), end + 1
+    except ValueError:
+        return None, 0
+
+
+def interpolate_times(anchor_offsets, anchor_times, offsets):
+    """Returns the time of each offset, interpolated between the anchors and
+    extrapolated before the first and after the last. Returns None if there
+    aren't enough anchors to tell.
+    """
+    # Markers are only accurate to a second, so one right after a segment
+    # starts can be before the time in the segment's header. Time doesn't go
+    # backwards, so ignore it.
+    monotonic_offsets = []
+    monotonic_times = []
+    for offset, time_s in zip(anchor_offsets, anchor_times):
+        if not monotonic_times or time_s >= monotonic_times[-1]:
+            monotonic_offsets.append(offset)
+            monotonic_times.append(time_s)
+    anchor_offsets = monotonic_offsets
+    anchor_times = monotonic_times
+    if len(anchor_offsets) < 2:
+        return None
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    if numpy is not None:
+        return _interpolate_times_numpy(numpy, anchor_offsets, anchor_times, offsets)
+    last = len(anchor_offsets) - 1
+    times = []
+    for offset in offsets:
+        index = min(max(bisect.bisect_right(anchor_offsets, offset), 1), last)
+        offset_1 = anchor_offsets[index - 1]
+        offset_2 = anchor_offsets[index]
+        time_1 = anchor_times[index - 1]
+        time_2 = anchor_times[index]
+        if offset_2 == offset_1:
+            times.append(time_2)
+        else:
+            times.append(
+                time_1 + (offset - offset_1) * (time_2 - time_1) / (offset_2 - offset_1)
+            )
+    return times
+
+
+def _interpolate_times_numpy(numpy, anchor_offsets, anchor_times, offsets):
+    """interpolate_times for every offset at once. numpy.interp doesn't
+    extrapolate, so the offsets outside the anchors are done separately, the
+    same way as interpolate_times does them.
+    """
+    offsets = numpy.asarray(offsets, dtype=float)
+    anchor_offsets = numpy.asarray(anchor_offsets, dtype=float)
+    anchor_times = numpy.asarray(anchor_times, dtype=float)
+    times = numpy.interp(offsets, anchor_offsets, anchor_times)
+    for (index_1, index_2), outside in (
+            ((0, 1), offsets < anchor_offsets[0]),
+            ((-2, -1), offsets > anchor_offsets[-1]),
+    ):
+        offset_1, offset_2 = anchor_offsets[index_1], anchor_offsets[index_2]
+        time_1, time_2 = anchor_times[index_1], anchor_times[index_2]
+        if offset_2 == offset_1:
+            times[outside] = time_2
+        else:
+            times[outside] = (
+                time_1 + (offsets[outside] - offset_1) * (time_2 - time_1) / (offset_2 - offset_1)
+            )
+    return times.tolist()
+
+
+class TimestampIndex(object):
+    """Where every timestamp marker in a log is and what time it says.
+
+    dump_serial writes each marker right after writing everything that it
+    read up until then, so the data before a marker's offset were received by
+    the marker's time. Times for data in between markers are interpolated,
+    assuming the data came in at a steady rate.
+    """
+
+    def __init__(self, markers=None, size=0, mtime=0, header=None, header_length=0):
+        # (start, end, seconds since the epoch) of each marker
+        self.markers = markers or []
+        # The size and modification time of the log when it was indexed
+        self.size = size
+        self.mtime = mtime
+        # The segment header, if there is one
+        self.header = header
+        self.header_length = header_length
+        self._anchors = None
+
+    @property
+    def spans(self):
+        """The (start, end) of the header and each marker, i.e. everything
+        that isn't data.
+        """
+        spans = [(start, end) for start, end, _ in self.markers]
+        if self.header_length > 0:
+            spans.insert(0, (0, self.header_length))
+        return spans
+
+    @property
+    def data_length(self):
+        """How much data is in the log, not counting the header and markers."""
+        return self.size - sum(end - start for start, end in self.spans)
+
+    def add(self, data, start=0):
+        """Indexes the markers in data from start on."""
+        if start == 0:
+            self.header, self.header_length = parse_header(data)
+        last_end = self.markers[-1][1] if self.markers else self.header_length
+        for match in TIMESTAMP_REGEX.finditer(data, max(start, self.header_length)):
+            if match.start() < last_end:
+                continue
+            try:
+                timestamp_s = parse_timestamp(match.group())
+            except ValueError:
+                # Binary data that happened to look like a marker
+                continue
+            self.markers.append(match.span() + (timestamp_s,))
+        self.size = len(data)
+        self._anchors = None
+
+    def anchors(self):
+        """Returns the offset of each marker in the data with the header and
+        markers removed, and the marker's time. A segment's data start at the
+        time in its header.
+        """
+        if self._anchors is None:
+            offsets = []
+            times = []
+            if self.header is not None and 'start_s' in self.header:
+                offsets.append(0)
+                times.append(self.header['start_s'])
+            removed = self.header_length
+            for start, end, timestamp_s in self.markers:
+                offsets.append(start - removed)
+                times.append(timestamp_s)
+                removed += end - start
+            self._anchors = (offsets, times)
+        return self._anchors
+
+    def times_at(self, offsets):
+        """Returns the time each offset in the data (with the header and
+        markers removed) was received, or None if there aren't enough markers
+        to tell.
+        """
+        anchor_offsets, anchor_times = self.anchors()
+        return interpolate_times(anchor_offsets, anchor_times, offsets)
+
+    def save(self, file_name):
+        """Saves the index, without leaving a partial file if we're killed."""
+        temporary_file_name = file_name + '.tmp'
+        with open(temporary_file_name, 'w') as file_:
+            json.dump(
+                {
+                    'version': INDEX_VERSION,
+                    'size': self.size,
+                    'mtime': self.mtime,
+                    'header': self.header,
+                    'header_length': self.header_length,
+                    'markers': self.markers,
+                },
+                file_
+            )
+        os.replace(temporary_file_name, file_name)
+
+    @classmethod
+    def load(cls, file_name):
+        """Loads a saved index."""
+        with open(file_name) as file_:
+            saved = json.load(file_)
+        if saved.get('version') != INDEX_VERSION:
+            raise ValueError('Index is from another version')
+        return cls(
+            [tuple(marker) for marker in saved['markers']],
+            saved['size'],
+            saved['mtime'],
+            saved.get('header'),
+            saved.get('header_length', 0),
+        )
+
+
+def load_index(file_name, data):
+    """Returns the index for a log whose contents are data, from the saved
+    index if it's still good. Logs that are still being written only have
+    their new data indexed.
+    """
+    index_file_name = file_name + INDEX_EXTENSION
+    stat = os.stat(file_name)
+    try:
+        index = TimestampIndex.load(index_file_name)
+    except (IOError, ValueError, KeyError, TypeError):
+        index = None
+    if index is not None and index.size == len(data) and index.mtime == stat.st_mtime:
+        return index
+    if (
+            index is None
+            or index.size > len(data)
+            # The header was partially written when it was indexed
+            or (index.header_length == 0 and data[:len(HEADER_PREFIX)] == HEADER_PREFIX)
+    ):
+        index = TimestampIndex()
+        start = 0
+    else:
+        # Catch a marker that was partially written when it was indexed
+        start = max(index.size - TIMESTAMP_LENGTH, 0)
+    index.add(data, start)
+    index.mtime = stat.st_mtime
+    try:
+        index.save(index_file_name)
+    except (IOError, OSError):
+        # e.g. the logs are on a read only file system
+        pass
+    return index
+
+
+class RunIndex(object):
+    """Times for a log that's split into segments, as if the segments were
+    one log with the headers and markers removed.
+    """
+
+    def __init__(self):
+        self._offsets = []
+        self._times = []
+        self.data_length = 0
+        self.headers = []
+
+    def append(self, index):
+        """Adds the next segment's index."""
+        offsets, times = index.anchors()
+        self._offsets.extend(offset + self.data_length for offset in offsets)
+        self._times.extend(times)
+        self.data_length += index.data_length
+        self.headers.append(index.header)
+
+    def times_at(self, offsets):
+        """Like TimestampIndex.times_at, for the whole run."""
+        return interpolate_times(self._offsets, self._times, offsets)
+
+
+def segment_sort_key(file_name):
+    """Sorts segments by log, then by segment number."""
+    match = SEGMENT_REGEX.match(file_name)
+    if match is None:
+        return (file_name, -1)
+    return (match.group(1), int(match.group(2)))
+
+
+def segment_file_names(file_names):
+    """Puts segments in order and leaves out index and sensor log files, so
+    that a glob of a log's directory can be passed in. If a segment was being
+    compressed when the power went out, there will be a partial .gz next to
+    the complete log, so the log is used instead.
+    """
+    by_log_name = {}
+    for file_name in file_names:
+        if file_name.endswith((INDEX_EXTENSION, '.tmp', sensor_log.EXTENSION)):
+            continue
+        log_name = file_name[:-len('.gz')] if file_name.endswith('.gz') else file_name
+        if log_name not in by_log_name or not file_name.endswith('.gz'):
+            by_log_name[log_name] = file_name
+    return sorted(by_log_name.values(), key=segment_sort_key)
+
+
+def map_file(file_):
+    """Memory maps a file for reading. Empty files can't be mapped, so they
+    get an empty bytes instead.
+    """
+    if os.fstat(file_.fileno()).st_size == 0:
+        return b''
+    return mmap.mmap(file_.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def open_data(file_name):
+    """Returns the contents of a log segment, mapped if it isn't compressed."""
+    if not file_name.endswith('.gz'):
+        with open(file_name, 'rb') as file_:
+            return map_file(file_)
+    parts = []
+    with gzip.open(file_name, 'rb') as file_:
+        try:
+            for part in iter(lambda: file_.read(1024 * 1024), b''):
+                parts.append(part)
+        except EOFError:
+            # Truncated, keep what we could decompress
+            pass
+    return b''.join(parts)
+
+
+def close_data(data):
+    """Unmaps data from open_data. If the caller is still holding on to
+    something that was read, it's unmapped once they let go of it instead.
+    """
+    with contextlib.suppress(AttributeError, BufferError):
+        data.close()
+
+
+class ReadWrapper(object):
+    """Reads one or more segments of a serial log like a file or serial port,
+    but without the headers and timestamp markers. Reads return memoryviews of
+    the mapped log, so nothing is copied until the caller wants it to be.
+    """
+
+    def __init__(self, file_names):
+        if isinstance(file_names, str):
+            file_names = [file_names]
+        self._file_names = segment_file_names(file_names)
+        self._next_segment = 0
+        # Updated as each segment is opened
+        self.index = RunIndex()
+        self._data = None
+        self._view = None
+        self._spans = []
+        self._span_starts = []
+        self._position = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _close_segment(self):
+        """Unmaps the current segment."""
+        if self._data is not None:
+            self._view.release()
+            close_data(self._data)
+            self._data = None
+            self._view = None
+
+    def _open_next_segment(self):
+        """Opens the next segment, returning False if there aren't any more."""
+        self._close_segment()
+        if self._next_segment >= len(self._file_names):
+            return False
+        file_name = self._file_names[self._next_segment]
+        self._next_segment += 1
+        self._data = open_data(file_name)
+        self._view = memoryview(self._data)
+        index = load_index(file_name, self._data)
+        self.index.append(index)
+        self._spans = index.spans
+        self._span_starts = [start for start, _ in self._spans]
+        self._position = 0
+        return True
+
+    def close(self):
+        """Unmaps the log."""
+        self._close_segment()
+        self._next_segment = len(self._file_names)
+
+    def _skip_spans(self):
+        """Moves past any header or markers at the current position. Returns
+        the index of the next span.
+        """
+        position = self._position
+        # The last span that doesn't start after position
+        index = bisect.bisect_right(self._span_starts, position) - 1
+        if index >= 0 and self._spans[index][1] > position:
+            position = self._spans[index][1]
+        index += 1
+        # Markers can be right next to each other if nothing was received
+        while index < len(self._spans) and self._spans[index][0] == position:
+            position = self._spans[index][1]
+            index += 1
+        self._position = position
+        return index
+
+    def read(self, count=None):
+        """Reads up to count bytes, stopping early at timestamp markers and
+        the ends of segments.
+        """
+        if count is None:
+            count = 1
+        while True:
+            if self._data is not None:
+                index = self._skip_spans()
+                if self._position < len(self._view):
+                    break
+            if not self._open_next_segment():
+                self.close()
+                raise EOFError('Nothing more to read')
+
+        position = self._position
+        end = min(position + count, len(self._view))
+        if index < len(self._spans):
+            end = min(end, self._spans[index][0])
+        self._position = end
+        return self._view[position:end]
+
+
+def read_without_timestamps(file_names):
+    """Returns memoryviews of everything in one or more segments of a log
+    except for the headers and timestamp markers, in order, and a RunIndex for
+    them. Nothing is copied: the segments stay mapped, or decompressed once,
+    until the views are let go of. Offsets in the RunIndex are as if the views
+    were joined together.
+    """
+    if isinstance(file_names, str):
+        file_names = [file_names]
+    run_index = RunIndex()
+    pieces = []
+    for file_name in segment_file_names(file_names):
+        data = open_data(file_name)
+        index = load_index(file_name, data)
+        run_index.append(index)
+        view = memoryview(data)
+        position = 0
+        for start, end in index.spans + [(len(view), len(view))]:
+            if start > position:
+                pieces.append(view[position:start])
+            position = end
+    return pieces, run_index
@@ -1,7 +1,9 @@
 """Functions for communicating with the SUP800F GPS module."""
 import collections
 import functools
+import operator
 import struct
+import weakref
 
 
 HEADER_FORMAT = ''.join((
@@ -44,49 +46,209 @@ BinaryMessage = collections.namedtuple(  # pylint: disable=invalid-name
         'temperature_c',
     ))
 )
+BINARY_MESSAGE_LENGTH = struct.calcsize(BINARY_FORMAT)
+# The same layout as BINARY_FORMAT, as a numpy structured dtype
+BINARY_DTYPE_FIELDS = (
+    ('header', 'V4'),
+    ('message_id', 'u1'),
+    ('message_sub_id', 'u1'),
+    ('acceleration_g_x', '>f4'),
+    ('acceleration_g_y', '>f4'),
+    ('acceleration_g_z', '>f4'),
+    ('magnetic_flux_ut_x', '>f4'),
+    ('magnetic_flux_ut_y', '>f4'),
+    ('magnetic_flux_ut_z', '>f4'),
+    ('pressure_p', '>u4'),
+    ('temperature_c', '>f4'),
+    ('tail', 'V3'),
+)
+DecodedLog = collections.namedtuple(  # pylint: disable=invalid-name
+    'DecodedLog',
+    ' '.join((
+        'offsets',  # where each message starts in the log
+        'columns',  # dict of BinaryMessage field name to array
+        'discarded',  # (offset, length) of each region that wasn't decoded
+        'bad_checksums',
+    ))
+)
+# decode_binary_messages joins pieces of a log this many bytes at a time
+DECODE_CHUNK_SIZE = 4 * 1024 * 1024
+HEADER = b'\xA0\xA1'
+TRAILER = b'\r\n'
+# Longer than any message the SUP800F sends, so a corrupted length can't make
+# us wait for (and throw away) thousands of bytes of good frames
+MAX_PAYLOAD_LENGTH = 512
+READ_SIZE = 4096
+# About a third of a second at 115200 baud
+RESPONSE_TIMEOUT_BYTES = 4096
+RESPONSE_TIMEOUT_S = 0.5
 
 
 
+def checksum(payload):
+    """The SUP800F's checksum, all of the payload's bytes XORed together."""
+    return functools.reduce(operator.xor, payload, 0)
+
+
 def format_message(payload):
     """Formats a message for the SUP800F."""
-    checksum = functools.reduce(lambda a, b: a ^ b, payload, 0)
+    checksum_ = checksum(payload)
     return (
         struct.pack(HEADER_FORMAT, 0xA0, 0xA1, len(payload))
         + payload
-        + struct.pack(TAIL_FORMAT, checksum, 0x0D, 0x0A)
+        + struct.pack(TAIL_FORMAT, checksum_, 0x0D, 0x0A)
     )
 
 
-def get_message(ser, timeout_bytes=None):
-    """Returns a single message."""
-    # Keep consuming bytes until we see the header message
-    if timeout_bytes is None:
-        timeout_bytes = 10000000
-    skipped_bytes = 0
-    while True:
-        if skipped_bytes > timeout_bytes:
-            raise ValueError('No binary header found')
-
-        part = ser.read(1)
-        skipped_bytes += 1
-        if part != b'\xA0':
-            continue
+class FrameReader(object):
+    """Finds binary frames in a stream from the SUP800F.
+
+    Reads in big chunks into a reusable buffer instead of one byte at a time,
+    and if a frame's length, trailer, or checksum is wrong, resynchronizes by
+    searching for the next header. Works with serial.Serial and with anything
+    else that has read(), like files, pipes, and ReadWrapper.
+
+    Keeps count of good frames, frames with bad checksums, and how many times
+    it lost sync and had to skip bytes to find the next frame.
+    """
+
+    def __init__(self, source, read_size=READ_SIZE):
+        self._source = source
+        self._read_size = read_size
+        self._buffer = bytearray()
+        # Bytes before this have already been returned or skipped
+        self._start = 0
+        # How many bytes from the source were dropped from the buffer
+        self._dropped = 0
+        # Where the last frame started in the data read from the source
+        self.frame_offset = None
+        self.good_frames = 0
+        self.bad_checksums = 0
+        self.resyncs = 0
+        self.skipped_bytes = 0
+
+    def format_stats(self):
+        """Returns the counts, for logging."""
+        return '{} good frames, {} bad checksums, {} resyncs, {} bytes skipped'.format(
+            self.good_frames,
+            self.bad_checksums,
+            self.resyncs,
+            self.skipped_bytes,
+        )
+
+    def __iter__(self):
+        """Yields frames until the source runs out."""
+        while True:
+            try:
+                yield self.read_frame()
+            except EOFError:
+                return
+
+    def _fill(self):
+        """Reads more data, raising EOFError if there isn't any."""
+        size = self._read_size
+        in_waiting = getattr(self._source, 'in_waiting', None)
+        if in_waiting is not None:
+            # Serial ports block until all of the requested bytes arrive, so
+            # only ask for what's already there, or 1 byte to wait for more
+            size = max(1, min(in_waiting, size))
+        data = self._source.read(size)
+        if not data:
+            raise EOFError('Nothing more to read')
+        # Drop what's been processed once it's most of the buffer, so the
+        # buffer stays small without moving data around on every frame
+        if self._start > len(self._buffer) // 2:
+            del self._buffer[:self._start]
+            self._dropped += self._start
+            self._start = 0
+        self._buffer += data
+
+    def take_buffered(self):
+        """Returns the bytes that were read from the source but haven't been
+        returned as frames yet, and forgets them.
+        """
+        data = bytes(self._buffer[self._start:])
+        self._dropped += len(self._buffer)
+        self._buffer = bytearray()
+        self._start = 0
+        return data
+
+    def read_frame(self, timeout_bytes=None):
+        """Returns the next frame, including the header and trailer. Raises
+        ValueError if more than timeout_bytes are skipped looking for one, and
+        EOFError if the source runs out.
+        """
+        skipped = 0
+        try:
+            while True:
+                buffer = self._buffer
+                header = buffer.find(HEADER, self._start)
+                if header == -1:
+                    # Keep a trailing A0 in case the A1 is in the next read
+                    end = len(buffer) - 1 if buffer.endswith(HEADER[:1]) else len(buffer)
+                    skipped += max(end - self._start, 0)
+                    self._start = max(end, self._start)
+                else:
+                    skipped += header - self._start
+                    self._start = header
+                    if len(buffer) - header >= 4:
+                        payload_length = (buffer[header + 2] << 8) | buffer[header + 3]
+                        end = header + 4 + payload_length + 3
+                        if payload_length > MAX_PAYLOAD_LENGTH:
+                            # Not really a header, look for the next one
+                            self._start = header + 1
+                            skipped += 1
+                            continue
+                        if len(buffer) >= end:
+                            if buffer[end - 2:end] == TRAILER:
+                                if checksum(buffer[header + 4:end - 3]) == buffer[end - 3]:
+                                    self._start = end
+                                    self.frame_offset = self._dropped + header
+                                    self.good_frames += 1
+                                    if skipped > 0:
+                                        self.resyncs += 1
+                                    return bytes(buffer[header:end])
+                                self.bad_checksums += 1
+                            self._start = header + 1
+                            skipped += 1
+                            continue
+
+                if timeout_bytes is not None and skipped > timeout_bytes:
+                    raise ValueError('No binary header found')
+                self._fill()
+        finally:
+            self.skipped_bytes += skipped
+
+
+# Frame readers for each source, so that bytes that were read past the end of
+# one frame are still there for the next call to get_message
+_frame_readers = weakref.WeakKeyDictionary()
 
-        part = ser.read(1)
-        skipped_bytes += 1
-        if part != b'\xA1':
-            continue
 
-        part = ser.read(2)
-        skipped_bytes += 2
+def get_frame_reader(ser):
+    """Returns the FrameReader for a serial port or file."""
+    reader = _frame_readers.get(ser)
+    if reader is None:
+        reader = FrameReader(ser)
+        _frame_readers[ser] = reader
+    return reader
 
-        payload_length = struct.unpack('!H', part)[0]
-        rest = ser.read(payload_length + 3)
-        skipped_bytes += payload_length + 3
 
-        if rest[-2:] != b'\r\n':
-            print(r"Message didn't end in \r\n")
-        return b'\xA0\xA1' + struct.pack('!H', payload_length) + rest
+def take_buffered(ser):
+    """Returns bytes that get_message read from ser but didn't use, e.g. so
+    that they can be logged before reading from ser directly again.
+    """
+    reader = _frame_readers.pop(ser, None)
+    if reader is None:
+        return b''
+    return reader.take_buffered()
+
+
+def get_message(ser, timeout_bytes=None):
+    """Returns a single message."""
+    if timeout_bytes is None:
+        timeout_bytes = 10000000
+    return get_frame_reader(ser).read_frame(timeout_bytes)
 
 
 def parse_binary(binary_message):
@@ -102,27 +264,147 @@ def parse_binary(binary_message):
     return BinaryMessage(*struct.unpack(BINARY_FORMAT, binary_message))
 
 
-def switch_to_nmea_mode(ser):
+def decode_binary_messages(data):
+    """Finds and decodes every binary (0xCF) message in data in one pass,
+    instead of a message at a time. Messages with the wrong length, trailer,
+    or checksum are discarded along with everything else between messages,
+    e.g. timestamps and navigation messages.
+
+    data can also be a list of pieces, like serial_log.read_without_timestamps
+    returns, which are decoded as if they were joined together. Only
+    DECODE_CHUNK_SIZE bytes of them are joined at a time, so the whole log is
+    never copied.
+    """
+    import numpy
+
+    if not isinstance(data, (list, tuple)):
+        data = [data]
+    length = BINARY_MESSAGE_LENGTH
+    all_starts = [numpy.zeros(0, dtype=numpy.intp)]
+    all_rows = [numpy.zeros((0, length), dtype=numpy.uint8)]
+    bad_checksums = 0
+    # The end of the last chunk, which could be the start of a message that
+    # continues in the next one
+    carry = b''
+    # Where carry starts in the joined data
+    offset = 0
+    for parts in _join_in_chunks(data, DECODE_CHUNK_SIZE):
+        chunk = b''.join([carry] + parts)
+        starts, rows, chunk_bad_checksums = _find_binary_messages(numpy, chunk)
+        all_starts.append(starts + offset)
+        all_rows.append(rows)
+        bad_checksums += chunk_bad_checksums
+        # Messages are only found if they're complete, so none of them start
+        # in the last length - 1 bytes
+        carry = chunk[-(length - 1):]
+        offset += len(chunk) - len(carry)
+    data_length = offset + len(carry)
+    starts = numpy.concatenate(all_starts)
+    rows = numpy.concatenate(all_rows)
+
+    # Something in a message could look like the start of another one
+    if numpy.any(numpy.diff(starts) < length):
+        keep = numpy.zeros(len(starts), dtype=bool)
+        end = 0
+        for index, start in enumerate(starts.tolist()):
+            if start >= end:
+                keep[index] = True
+                end = start + length
+        starts = starts[keep]
+        rows = rows[keep]
+
+    dtype = numpy.dtype(list(BINARY_DTYPE_FIELDS))
+    messages = numpy.ascontiguousarray(rows).reshape(-1).view(dtype)
+    columns = {
+        name: messages[name].astype(dtype[name].newbyteorder('='))
+        for name in BinaryMessage._fields
+    }
+
+    gap_starts = numpy.concatenate(([0], starts + length))
+    gap_ends = numpy.concatenate((starts, [data_length]))
+    gaps = gap_ends > gap_starts
+    discarded = numpy.column_stack(
+        (gap_starts[gaps], gap_ends[gaps] - gap_starts[gaps])
+    )
+    return DecodedLog(starts, columns, discarded, bad_checksums)
+
+
+def _join_in_chunks(pieces, size):
+    """Groups pieces into lists of about size bytes. Pieces bigger than that
+    are split, which doesn't copy memoryviews.
+    """
+    parts = []
+    parts_length = 0
+    for piece in pieces:
+        piece = memoryview(piece)
+        for start in range(0, len(piece), size):
+            part = piece[start:start + size]
+            parts.append(part)
+            parts_length += len(part)
+            if parts_length >= size:
+                yield parts
+                parts = []
+                parts_length = 0
+    if parts:
+        yield parts
+
+
+def _find_binary_messages(numpy, data):
+    """Returns where each binary message with a good checksum starts in data,
+    the messages' bytes, and how many had bad checksums. Messages can overlap.
+    """
+    length = BINARY_MESSAGE_LENGTH
+    bytes_ = numpy.frombuffer(data, dtype=numpy.uint8)
+    starts = numpy.flatnonzero(bytes_[:max(len(bytes_) - length + 1, 0)] == HEADER[0])
+    # Narrow down the candidates one byte at a time, so that only the first
+    # check has to look at the whole log
+    for offset, value in (
+            (1, HEADER[1]),
+            (2, (length - 7) >> 8),
+            (3, (length - 7) & 0xFF),
+            (4, 0xCF),
+            (length - 2, TRAILER[0]),
+            (length - 1, TRAILER[1]),
+    ):
+        starts = starts[bytes_[starts + offset] == value]
+    rows = bytes_[starts[:, numpy.newaxis] + numpy.arange(length)]
+    good = numpy.bitwise_xor.reduce(rows[:, 4:length - 3], axis=1) == rows[:, length - 3]
+    bad_checksums = int(len(good) - numpy.count_nonzero(good))
+    return starts[good], rows[good], bad_checksums
+
+
+def switch_to_nmea_mode(ser, logger):
     """Switches to the NMEA message mode."""
-    _change_mode(ser, 1)
+    _change_mode(ser, 1, logger)
 
 
-def switch_to_binary_mode(ser):
+def switch_to_binary_mode(ser, logger):
     """Switches to the binary message mode."""
-    _change_mode(ser, 2)
+    _change_mode(ser, 2, logger)
 
 
-def _change_mode(ser, mode):
+def _change_mode(ser, mode, logger):
     """Change reporting mode between NMEA messages or binary (temperature,
     accelerometer and magnetometer) mode.
     """
-    for _ in range(3):
-        mode_message = struct.pack(MODE_FORMAT, 9, mode, 0)
-        ser.write(format_message(mode_message))
-        ser.flush()
-        if check_response(ser, limit=10):
-            return
-        self._logger.warn('No response to mode change seen, trying again')
+    # The response comes right away, so if the port goes quiet for longer
+    # than this, there isn't going to be one
+    old_timeout_s = ser.timeout
+    ser.timeout = RESPONSE_TIMEOUT_S
+    try:
+        for _ in range(3):
+            mode_message = struct.pack(MODE_FORMAT, 9, mode, 0)
+            ser.write(format_message(mode_message))
+            ser.flush()
+            try:
+                if check_response(ser, limit=10):
+                    return
+            except (EnvironmentError, EOFError, ValueError):
+                # No response at all, or the port went quiet
+                pass
+            logger.warning('No response to mode change seen, trying again')
+    finally:
+        ser.timeout = old_timeout_s
     raise EnvironmentError('Mode change to {} denied'.format(mode))
 
 
@@ -138,15 +420,11 @@ def check_response(ser, limit=None):
     ))
 
     count = 0
-    def check():  # pylint: disable=missing-docstring
-        if limit is None:
-            return True
-        else:
-            count += 1
-            return count <= limit
-
-    while check():
-        data = get_message(ser)
+    while limit is None or count < limit:
+        count += 1
+        # In NMEA mode there might not be any other binary messages, so don't
+        # wait forever for one
+        data = get_message(ser, timeout_bytes=RESPONSE_TIMEOUT_BYTES)
         try:
             length, message_id, _ack_id = ( # pylint: disable=unused-variable
                 struct.unpack(response_format, data)
@@ -0,0 +1,788 @@
+"""One ground station for everything: APRS and the RS41 from the RTL-SDR dongles, the RS41 from
+radiosonde_auto_rx, and the LoRa gateway, on one screen and in one Google Earth file.
+
+Each source runs in its own thread and puts fixes on a queue, and only the main thread updates
+the shared state. The balloon's best known position is from whichever source heard it most
+recently. Google Earth can load the KML from the file, or from http://localhost:8080/balloon.kml.
+
+To try it out without any radios:
+
+    python ground_station.py --test
+"""
+
+import argparse
+import collections
+import curses
+import dataclasses
+import datetime
+import glob
+import http.server
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+import typing
+import xml.sax.saxutils
+
+import monitor_aprs
+import track
+
+# Shared with the LoRa monitor
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lora"))
+import archive
+import gateway
+
+
+STATUS_LABELS_COUNT = 6
+FT_PER_M = 3.2808399
+MILES_PER_KM = 0.62137119
+APRS_FREQUENCY = 144390000
+RS41_FREQUENCY = 432560000
+# Sources that haven't heard the balloon in this long are highlighted
+STALE_S = 120
+KML_FILE_NAME = "ground-station.kml"
+KML_INTERVAL_S = 5
+LORA_LINK_QUALITY_FILE_NAME = "ground-station-lora-link-quality.csv"
+# KML colors (aabbggrr) for each source's track, in the order the sources are added
+SOURCE_COLORS = ("ff00ffff", "ff0000ff", "ffff0000", "ff00ff00", "ffff00ff", "ffffff00")
+
+logger = logging.getLogger(__file__)
+
+
+@dataclasses.dataclass
+class Fix:
+    source: str
+    name: str  # Call sign, LoRa payload, or RS41 serial number
+    timestamp: datetime.datetime
+    latitude_d: float
+    longitude_d: float
+    altitude_m: float
+    # The raw message, for the messages window
+    detail: str = ""
+    # False for other stations that happen to be on APRS
+    ours: bool = True
+
+
+@dataclasses.dataclass
+class SourceState:
+    name: str
+    color: str
+    # Set by the source's thread, e.g. "up" or "connecting"
+    link: str = "starting"
+    fix_count: int = 0
+    last_fix: typing.Optional[Fix] = None
+    simplified_track: track.TrackSimplifier = dataclasses.field(default_factory=track.TrackSimplifier)
+
+
+class GroundStation:
+    """Everything heard from every source. Sources put fixes on the queue from their own threads,
+    and process_fixes is only called from the main thread, so nothing else needs locking.
+    """
+
+    def __init__(self, call_sign: str):
+        self.call_sign = call_sign
+        self.fixes: "queue.Queue[Fix]" = queue.Queue()
+        self.sources: typing.Dict[str, SourceState] = {}
+        self.recent: typing.Deque[Fix] = collections.deque(maxlen=100)
+        # Assume that the first fix is the launch site, like monitor_aprs does
+        self.launch_site: typing.Optional[Fix] = None
+        # Whether there's anything new since the KML was last made
+        self.updated = False
+
+    def add_source(self, name: str) -> SourceState:
+        state = SourceState(name=name, color=SOURCE_COLORS[len(self.sources) % len(SOURCE_COLORS)])
+        self.sources[name] = state
+        return state
+
+    def process_fixes(self) -> int:
+        count = 0
+        while True:
+            try:
+                fix = self.fixes.get_nowait()
+            except queue.Empty:
+                return count
+            count += 1
+            self.recent.append(fix)
+            if not fix.ours:
+                continue
+            source = self.sources[fix.source]
+            source.fix_count += 1
+            source.last_fix = fix
+            source.simplified_track.add((fix.longitude_d, fix.latitude_d, fix.altitude_m))
+            if self.launch_site is None:
+                self.launch_site = fix
+            self.updated = True
+
+    def best(self) -> typing.Optional[Fix]:
+        """The most recent fix from any source."""
+        fixes = [source.last_fix for source in self.sources.values() if source.last_fix is not None]
+        return max(fixes, key=lambda fix: fix.timestamp, default=None)
+
+    def format_kml(self) -> str:
+        escape = xml.sax.saxutils.escape
+        placemarks = "".join(
+            track.format_placemark(
+                source.simplified_track,
+                name=escape(f"{self.call_sign} {source.name}"),
+                description=escape(f"{self.call_sign} weather balloon {source.name}"),
+                line_color=source.color,
+                poly_color="7f000000",
+            )
+            for source in self.sources.values()
+        )
+        best = self.best()
+        if best is not None:
+            received = datetime.datetime.strftime(best.timestamp, "%H:%M:%S")
+            placemarks += f"""    <Placemark>
+      <name>{escape(self.call_sign)}</name>
+      <description>{escape(f"Best known position, from {best.source} at {received}")}</description>
+      <Point>
+        <altitudeMode>absolute</altitudeMode>
+        <coordinates>{track.format_coordinate((best.longitude_d, best.latitude_d, best.altitude_m))}</coordinates>
+      </Point>
+    </Placemark>
+"""
+        return f"""<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2">
+  <Document>
+    <name>Paths</name>
+{placemarks}  </Document>
+</kml>"""
+
+    def format_status_json(self) -> str:
+        def fix_to_dict(fix: typing.Optional[Fix]) -> typing.Optional[dict]:
+            if fix is None:
+                return None
+            result = dataclasses.asdict(fix)
+            result["timestamp"] = fix.timestamp.isoformat()
+            return result
+
+        return json.dumps({
+            "best": fix_to_dict(self.best()),
+            "sources": [
+                {
+                    "name": source.name,
+                    "link": source.link,
+                    "fix_count": source.fix_count,
+                    "last_fix": fix_to_dict(source.last_fix),
+                }
+                for source in self.sources.values()
+            ],
+        })
+
+
+class AprsSource(threading.Thread):
+    """Runs one of monitor_aprs's receivers on its own dongle, restarting it if it quits."""
+
+    def __init__(
+        self,
+        station: GroundStation,
+        name: str,
+        receiver_class,
+        frequency_hz: int,
+        device_index: int,
+    ):
+        super().__init__(daemon=True)
+        self.station = station
+        self.name = name
+        self.receiver_class = receiver_class
+        self.frequency_hz = frequency_hz
+        self.device_index = device_index
+        self.state = station.add_source(name)
+        self.stop = False
+
+    def run(self) -> None:
+        while not self.stop:
+            parent_pipe, child_pipe = multiprocessing.Pipe()
+            logger.info("Monitoring %d on dongle %d", self.frequency_hz, self.device_index)
+            receiver = self.receiver_class(self.frequency_hz, child_pipe, self.device_index)
+            receiver.start()
+            self.state.link = "up"
+            try:
+                while not self.stop and receiver.is_alive():
+                    if not parent_pipe.poll(0.5):
+                        continue
+                    timestamp, aprs_message = parent_pipe.recv()
+                    aprs_message = aprs_message.strip()
+                    if aprs_message:
+                        self.handle_message(timestamp, aprs_message)
+            except Exception as exc:
+                logger.error(f"{self.name} failed: {exc}", exc_info=exc)
+            finally:
+                try:
+                    parent_pipe.send("die")
+                except OSError:
+                    pass
+                receiver.join()
+            if not self.stop:
+                logger.error("Receiver for %d quit unexpectedly", self.frequency_hz)
+                self.state.link = "restarting"
+                # Let's give it half a second so it's not just continually restarting
+                time.sleep(0.5)
+
+    def handle_message(self, timestamp: datetime.datetime, aprs_message: str) -> None:
+        logger.debug("Received APRS message %s", aprs_message)
+        message = monitor_aprs.format_aprs_message(timestamp, self.frequency_hz, aprs_message)
+        if not message:
+            return
+        has_position = message.latitude_d != 0.0 or message.longitude_d != 0.0
+        self.station.fixes.put(Fix(
+            source=self.name,
+            name=message.call_sign,
+            timestamp=timestamp,
+            latitude_d=message.latitude_d,
+            longitude_d=message.longitude_d,
+            altitude_m=message.altitude_m,
+            detail=aprs_message,
+            ours=has_position and self.station.call_sign in message.call_sign,
+        ))
+
+
+class LoraSource(gateway.GatewayClient):
+    """The LoRa monitor's gateway client, with each position message also put on the station's
+    queue. Its PayloadTable keeps the link statistics, which are exported like the monitor does.
+    """
+
+    def __init__(self, station: GroundStation, ip: typing.Optional[str], port: int, name: str = "LoRa"):
+        self.station = station
+        self.state = station.add_source(name)
+        super().__init__(ip, port, ip is None, gateway.PayloadTable(), on_status=self.handle_status)
+        self.name = name
+
+    @property
+    def link_state(self) -> str:
+        return self.state.link
+
+    @link_state.setter
+    def link_state(self, value: str) -> None:
+        self.state.link = value
+
+    def handle_status(self, state: gateway.PayloadState) -> None:
+        status = state.status
+        if status is None or state.last_seen is None:
+            return
+        self.station.fixes.put(Fix(
+            source=self.name,
+            name=state.name,
+            timestamp=state.last_seen,
+            latitude_d=status.latitude_d,
+            longitude_d=status.longitude_d,
+            altitude_m=status.altitude_m,
+            detail=status.sentence or "",
+            ours=self.station.call_sign in status.payload,
+        ))
+
+
+def parse_autorx_line(line: str) -> typing.Optional[typing.Tuple[datetime.datetime, str, float, float, float]]:
+    """Parses a line of radiosonde_auto_rx's CSV log into the time (local), serial number,
+    latitude, longitude, and altitude. The columns are:
+    timestamp,serial,frame,lat,lon,alt,vel_v,vel_h,heading,temp,humidity,pressure,type,...
+    """
+    fields = [field.strip() for field in line.split(",")]
+    if len(fields) < 6:
+        return None
+    try:
+        # fromisoformat doesn't accept the trailing Z before Python 3.11
+        utc = datetime.datetime.fromisoformat(fields[0].replace("Z", "+00:00"))
+        timestamp = utc.astimezone().replace(tzinfo=None)
+        return timestamp, fields[1], float(fields[3]), float(fields[4]), float(fields[5])
+    except ValueError:
+        # The header, or a partial line
+        return None
+
+
+class AutoRxSource(threading.Thread):
+    """Follows the newest radiosonde_auto_rx log in a directory, like tail-autorx.sh does. The
+    whole log is read when it's first opened, so restarting doesn't lose the track.
+    """
+
+    def __init__(self, station: GroundStation, directory: str, serial: typing.Optional[str], name: str = "RS41"):
+        super().__init__(daemon=True)
+        self.station = station
+        self.name = name
+        self.directory = directory
+        # Only this RS41's fixes are ours. If not set, the first one heard is, so that another
+        # sonde in range, e.g. the weather service's, isn't mistaken for it.
+        self.serial = serial
+        self.state = station.add_source(name)
+        self.stop = False
+
+    def newest_log(self) -> typing.Optional[str]:
+        paths = glob.glob(os.path.join(self.directory, "*.log"))
+        return max(paths, key=os.path.getmtime, default=None)
+
+    def run(self) -> None:
+        path: typing.Optional[str] = None
+        file: typing.Optional[typing.TextIO] = None
+        partial = ""
+        last_check = 0.0
+        try:
+            while not self.stop:
+                if time.monotonic() - last_check > 5:
+                    last_check = time.monotonic()
+                    newest = self.newest_log()
+                    if newest is not None and newest != path:
+                        if file is not None:
+                            file.close()
+                        logger.info(f"Reading auto_rx log {newest}")
+                        path = newest
+                        file = open(newest)
+                        partial = ""
+                        self.state.link = "up"
+                if file is None:
+                    self.state.link = "no log"
+                    time.sleep(1)
+                    continue
+                data = file.read()
+                if not data:
+                    time.sleep(0.5)
+                    continue
+                lines = (partial + data).split("\n")
+                # The last one isn't finished yet
+                partial = lines.pop()
+                for line in lines:
+                    self.handle_line(line)
+        finally:
+            if file is not None:
+                file.close()
+
+    def handle_line(self, line: str) -> None:
+        parsed = parse_autorx_line(line)
+        if parsed is None:
+            return
+        timestamp, serial, latitude_d, longitude_d, altitude_m = parsed
+        if self.serial is None:
+            logger.warning(f"Tracking RS41 {serial}, use --rs41-serial to pick a different one")
+            self.serial = serial
+        self.station.fixes.put(Fix(
+            source=self.name,
+            name=serial,
+            timestamp=timestamp,
+            latitude_d=latitude_d,
+            longitude_d=longitude_d,
+            altitude_m=altitude_m,
+            detail=line,
+            ours=self.serial == serial,
+        ))
+
+
+class FakeAutoRx(threading.Thread):
+    """Writes made up auto_rx log lines, for testing."""
+
+    def __init__(self, directory: str, interval_s: float = 1.0):
+        super().__init__(daemon=True)
+        self.path = os.path.join(directory, "fake_S1234567_RS41_sonde.log")
+        self.interval_s = interval_s
+        self.stop = False
+
+    def run(self) -> None:
+        with open(self.path, "w") as file:
+            file.write("timestamp,serial,frame,lat,lon,alt,vel_v,vel_h,heading,temp,humidity,pressure,type,freq_mhz,snr,f_error_hz,sats,batt_v,burst_timer,aux_data\n")
+            frame = 0
+            while not self.stop:
+                utc = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+                file.write(
+                    f"{utc},S1234567,{frame},{40.0 + frame * 0.00002:.5f},{-105.1 + frame * 0.00002:.5f},"
+                    f"{1600 + frame * 5:.1f},5.0,3.0,45.0,10.0,50.0,850.0,RS41-SGP,432.560,12.0,100,9,2.9,-1,-1\n"
+                )
+                file.flush()
+                frame += 1
+                time.sleep(self.interval_s)
+
+
+class KmlServer(threading.Thread):
+    """Serves the latest KML and status over HTTP, so Google Earth can use a network link
+    without being allowed to read local files.
+    """
+
+    def __init__(self, port: int):
+        super().__init__(daemon=True)
+        self.kml = b""
+        self.status = b"{}"
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path in ("/", "/balloon.kml"):
+                    self._send(server.kml, "application/vnd.google-earth.kml+xml")
+                elif self.path == "/status.json":
+                    self._send(server.status, "application/json")
+                else:
+                    self.send_error(404)
+
+            def _send(self, body: bytes, content_type: str) -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                # The default writes to stderr, which would mess up the screen
+                logger.debug(format, *args)
+
+        self._server = http.server.ThreadingHTTPServer(("", port), Handler)
+        self.port: int = self._server.server_address[1]
+
+    def run(self) -> None:
+        self._server.serve_forever()
+
+
+@dataclasses.dataclass
+class Windows:
+    time: curses.window
+    error: curses.window
+    status: curses.window
+    sources: curses.window
+    messages: curses.window
+
+
+def initialize_screen(stdscr: curses.window) -> Windows:
+    """Initializes the screen."""
+    stdscr.nodelay(True)
+    curses.curs_set(False)
+    curses.init_pair(1, curses.COLOR_YELLOW, curses.COLOR_BLACK)
+
+    time_window = curses.newwin(3, 10, 0, 0)
+    time_window_x = time_window.getmaxyx()[1]
+    error_window = curses.newwin(3, curses.COLS - time_window_x, 0, time_window_x)
+    status_window_length = 40
+    status_window = curses.newwin(STATUS_LABELS_COUNT + 2, status_window_length, 3, 0)
+    sources_window = curses.newwin(STATUS_LABELS_COUNT + 2, curses.COLS - status_window_length, 3, status_window_length)
+    lines = curses.LINES - status_window.getmaxyx()[0] - time_window.getmaxyx()[0]
+    messages_window = curses.newwin(lines, curses.COLS, STATUS_LABELS_COUNT + 5, 0)
+
+    for window in (time_window, error_window, status_window, sources_window, messages_window):
+        window.border()
+        window.refresh()
+
+    return Windows(
+        time=time_window,
+        error=error_window,
+        status=status_window,
+        sources=sources_window,
+        messages=messages_window,
+    )
+
+
+def initialize_logger(windows: Windows) -> None:
+    logger.setLevel(logging.DEBUG)
+    handler = monitor_aprs.CursesHandler(windows.error)
+    handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
+    handler.setLevel(logging.WARN)
+    logger.addHandler(handler)
+    handler2 = logging.FileHandler("ground-station-debug.log")
+    handler2.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(filename)s:%(lineno)s %(message)s"))
+    handler2.setLevel(logging.DEBUG)
+    logger.addHandler(handler2)
+    # The receivers log to monitor_aprs's logger, and the LoRa source to gateway's
+    for other_logger in (monitor_aprs.logger, gateway.logger):
+        other_logger.setLevel(logging.DEBUG)
+        other_logger.addHandler(handler)
+        other_logger.addHandler(handler2)
+
+
+def format_ago(timestamp: datetime.datetime, now: datetime.datetime) -> str:
+    seconds = max(int((now - timestamp).total_seconds()), 0)
+    return f"{seconds // 3600:02}:{(seconds // 60) % 60:02}:{seconds % 60:02}"
+
+
+def update_status(window: curses.window, station: GroundStation, now: datetime.datetime) -> None:
+    """Show the best known position."""
+    _, max_x = window.getmaxyx()
+    window.erase()
+    window.border()
+    best = station.best()
+    if best is None:
+        window.addnstr(1, 1, f"Waiting for {station.call_sign}", max_x - 2)
+        window.noutrefresh()
+        return
+
+    window.addnstr(1, 1, f"Best: {best.source}, {best.name}", max_x - 2, curses.A_BOLD)
+    window.addnstr(2, 1, f"Latitude: {best.latitude_d:.4f}", max_x - 2)
+    window.addnstr(3, 1, f"Longitude: {best.longitude_d:.4f}", max_x - 2)
+    window.addnstr(4, 1, f"Altitude: {best.altitude_m:.1f} m, {best.altitude_m * FT_PER_M:.1f} ft", max_x - 2)
+    window.addnstr(5, 1, f"Last seen: {format_ago(best.timestamp, now)} ago", max_x - 2)
+    launch_site = station.launch_site
+    if launch_site is not None:
+        distance_km = track.distance_m(best.latitude_d, best.longitude_d, launch_site.latitude_d, launch_site.longitude_d) / 1000
+        window.addnstr(6, 1, f"Distance: {distance_km:.2f} km, {distance_km * MILES_PER_KM:.2f} mi", max_x - 2)
+    window.noutrefresh()
+
+
+def update_sources(window: curses.window, station: GroundStation, now: datetime.datetime) -> None:
+    """Show how recently each source heard the balloon, highlighting the ones that haven't."""
+    max_y, max_x = window.getmaxyx()
+    window.erase()
+    window.border()
+    window.addnstr(1, 1, f"{'Source':10} {'Link':20} {'Fixes':>6} {'Last fix':>9} {'Altitude':>9}", max_x - 2, curses.A_BOLD)
+    for line, source in enumerate(station.sources.values(), start=2):
+        if line >= max_y - 1:
+            break
+        fix = source.last_fix
+        if fix is None:
+            ago = "never"
+            altitude = ""
+            stale = True
+        else:
+            ago = format_ago(fix.timestamp, now)
+            altitude = f"{fix.altitude_m:.0f} m"
+            stale = (now - fix.timestamp).total_seconds() > STALE_S
+        attributes = curses.A_BOLD | curses.color_pair(1) if stale else 0
+        info = f"{source.name:10} {source.link[:20]:20} {source.fix_count:6} {ago:>9} {altitude:>9}"
+        window.addnstr(line, 1, info, max_x - 2, attributes)
+    window.noutrefresh()
+
+
+def update_messages(window: curses.window, station: GroundStation) -> None:
+    """Show recently received messages from every source."""
+    if not hasattr(update_messages, "previous_fix"):
+        setattr(update_messages, "previous_fix", None)
+    newest = station.recent[-1] if station.recent else None
+    if update_messages.previous_fix is newest:  # type: ignore
+        return
+    setattr(update_messages, "previous_fix", newest)
+
+    window.erase()
+    window.border()
+    max_y, max_x = window.getmaxyx()
+    for line, fix in enumerate(reversed(station.recent), start=1):
+        if line >= max_y - 1:
+            break
+        timestamp = datetime.datetime.strftime(fix.timestamp, "%H:%M:%S")
+        attributes = curses.A_BOLD if fix.ours else 0
+        window.addnstr(line, 1, f"{timestamp} {fix.source:9} {fix.detail}", max_x - 2, attributes)
+    window.noutrefresh()
+
+
+def update_screen(windows: Windows, station: GroundStation) -> None:
+    now = datetime.datetime.now()
+    update_status(windows.status, station, now)
+    update_sources(windows.sources, station, now)
+    update_messages(windows.messages, station)
+    monitor_aprs.update_error(windows.error)
+    monitor_aprs.update_time(windows.time)
+    curses.doupdate()
+
+
+def loop_forever(
+    windows: Windows,
+    station: GroundStation,
+    sources: typing.Sequence[threading.Thread],
+    server: typing.Optional[KmlServer],
+) -> None:
+    logger.debug("Starting")
+    for source in sources:
+        source.start()
+    if server is not None:
+        server.start()
+        logger.info(f"Serving KML on http://localhost:{server.port}/balloon.kml")
+
+    last_kml = time.monotonic() - KML_INTERVAL_S
+    last_export = time.monotonic()
+    lora_sources = [source for source in sources if isinstance(source, LoraSource)]
+    while True:
+        station.process_fixes()
+        if lora_sources and time.monotonic() - last_export >= gateway.LINK_QUALITY_INTERVAL_S:
+            last_export = time.monotonic()
+            for source in lora_sources:
+                try:
+                    gateway.export_link_quality(LORA_LINK_QUALITY_FILE_NAME, source.payloads)
+                except OSError as exc:
+                    logger.error(f"Unable to write {LORA_LINK_QUALITY_FILE_NAME}: {exc}")
+        if station.updated and time.monotonic() - last_kml >= KML_INTERVAL_S:
+            station.updated = False
+            last_kml = time.monotonic()
+            kml = station.format_kml()
+            try:
+                track.write_atomically(KML_FILE_NAME, kml)
+            except OSError as exc:
+                logger.error(f"Unable to write {KML_FILE_NAME}: {exc}")
+            if server is not None:
+                server.kml = kml.encode()
+        if server is not None:
+            server.status = station.format_status_json().encode()
+        update_screen(windows, station)
+        time.sleep(0.5)
+
+
+def main(
+    stdscr: curses.window,
+    station: GroundStation,
+    sources: typing.Sequence[threading.Thread],
+    server: typing.Optional[KmlServer],
+) -> None:
+    windows = initialize_screen(stdscr)
+    initialize_logger(windows)
+    loop_forever(windows, station, sources, server)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Ground station",
+        description="Tracks the balloon using APRS, the RS41, and LoRa at the same time",
+    )
+    parser.add_argument(
+        "--call-sign",
+        action="store",
+        type=str,
+        dest="call_sign",
+        default="KE0FZV",
+        help="Your callsign. Also matches the LoRa payload name.",
+    )
+    parser.add_argument(
+        "--frequency",
+        action="append",
+        type=int,
+        dest="frequencies_hz",
+        default=None,
+        help=f"APRS frequencies to listen to, one dongle each. Can be repeated. Defaults to {APRS_FREQUENCY} and {RS41_FREQUENCY}.",
+    )
+    parser.add_argument(
+        "--dongles",
+        action="store",
+        type=int,
+        dest="dongle_count",
+        default=None,
+        help="The number of RTL-SDR dongles to use. If not set, they're detected automatically.",
+    )
+    decoder_group = parser.add_mutually_exclusive_group()
+    decoder_group.add_argument(
+        "--kiss",
+        action="store_true",
+        default=False,
+        help="Read packets from direwolf's KISS TCP port instead of its printed output.",
+        dest="kiss",
+    )
+    decoder_group.add_argument(
+        "--afsk",
+        action="store_true",
+        default=False,
+        help="Decode the audio in process using NumPy instead of using direwolf.",
+        dest="afsk",
+    )
+    parser.add_argument(
+        "--lora",
+        action="store_true",
+        default=False,
+        help="Also read from the LoRa gateway.",
+        dest="lora",
+    )
+    parser.add_argument(
+        "--lora-ip",
+        action="store",
+        type=str,
+        default=None,
+        help="The IP address of the LoRa gateway. If not provided, will scan for it.",
+        dest="lora_ip",
+    )
+    parser.add_argument(
+        "--lora-port",
+        action="store",
+        type=int,
+        default=6004,
+        help="The port the LoRa gateway is serving from.",
+        dest="lora_port",
+    )
+    parser.add_argument(
+        "--lora-archive",
+        action="store",
+        type=str,
+        default="ground-station-lora.jsonl",
+        help="Where to save everything the LoRa gateway sends, and restore its track from on startup. An empty string turns it off.",
+        dest="lora_archive_file_name",
+    )
+    parser.add_argument(
+        "--restore-hours",
+        action="store",
+        type=float,
+        default=12,
+        help="How many hours of the LoRa archive to restore on startup. 0 doesn't restore anything.",
+        dest="restore_hours",
+    )
+    parser.add_argument(
+        "--autorx",
+        action="store",
+        type=str,
+        default=None,
+        help="Also follow the newest radiosonde_auto_rx log in this directory.",
+        dest="autorx_directory",
+    )
+    parser.add_argument(
+        "--rs41-serial",
+        action="store",
+        type=str,
+        default=None,
+        help="Only track this RS41 from auto_rx, e.g. S1234567. If not set, the first one heard is tracked.",
+        dest="rs41_serial",
+    )
+    parser.add_argument(
+        "--http-port",
+        action="store",
+        type=int,
+        default=8080,
+        help="Serve the KML on this port. 0 turns it off.",
+        dest="http_port",
+    )
+    parser.add_argument(
+        "--test",
+        action="store_true",
+        default=False,
+        help="Use fake sources instead of the radios, just for testing.",
+        dest="test",
+    )
+    parser_options = parser.parse_args()
+
+    station = GroundStation(parser_options.call_sign)
+    sources: typing.List[threading.Thread] = []
+
+    frequencies_hz = parser_options.frequencies_hz or [APRS_FREQUENCY, RS41_FREQUENCY]
+    if parser_options.test:
+        receiver_class = monitor_aprs.TestReceiver
+    elif parser_options.kiss:
+        receiver_class = monitor_aprs.KissReceiver
+    elif parser_options.afsk:
+        receiver_class = monitor_aprs.AfskReceiver
+    else:
+        receiver_class = monitor_aprs.AprsReceiver
+    if parser_options.dongle_count is not None:
+        dongle_count = parser_options.dongle_count
+    elif parser_options.test:
+        dongle_count = len(frequencies_hz)
+    else:
+        dongle_count = monitor_aprs.count_rtl_sdr_devices()
+    if dongle_count < len(frequencies_hz):
+        print(f"Only {dongle_count} dongles for {len(frequencies_hz)} frequencies, skipping {frequencies_hz[dongle_count:]}")
+        print("Use monitor_aprs.py to switch between frequencies on one dongle")
+    source_names = {APRS_FREQUENCY: "APRS", RS41_FREQUENCY: "RS41 APRS"}
+    for device_index, frequency_hz in enumerate(frequencies_hz[:dongle_count]):
+        name = source_names.get(frequency_hz, f"{frequency_hz / 1e6:.3f} MHz")
+        sources.append(AprsSource(station, name, receiver_class, frequency_hz, device_index))
+
+    if parser_options.test:
+        fake_gateway = gateway.FakeGateway(rate_hz=0.5, payloads=((parser_options.call_sign, 0),))
+        fake_gateway.start()
+        sources.append(LoraSource(station, "127.0.0.1", fake_gateway.port))
+        fake_autorx = FakeAutoRx(tempfile.mkdtemp(prefix="autorx-"))
+        fake_autorx.start()
+        sources.append(AutoRxSource(station, os.path.dirname(fake_autorx.path), None))
+    else:
+        if parser_options.lora or parser_options.lora_ip is not None:
+            lora_source = LoraSource(station, parser_options.lora_ip, parser_options.lora_port)
+            if parser_options.lora_archive_file_name:
+                lora_source.restore(parser_options.lora_archive_file_name, time.time() - parser_options.restore_hours * 60 * 60)
+                lora_source.archive = archive.PacketArchive(parser_options.lora_archive_file_name)
+            sources.append(lora_source)
+        if parser_options.autorx_directory is not None:
+            sources.append(AutoRxSource(station, parser_options.autorx_directory, parser_options.rs41_serial))
+
+    server = KmlServer(parser_options.http_port) if parser_options.http_port != 0 else None
+
+    curses.wrapper(
+        lambda stdscr: main(stdscr, station, sources, server),
+    )
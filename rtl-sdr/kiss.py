@@ -0,0 +1,304 @@
+"""Reads APRS packets from direwolf's KISS TCP port.
+
+To check the client against a fake server:
+
+    python kiss.py --self-test
+"""
+
+import argparse
+import logging
+import socket
+import sys
+import threading
+import time
+import typing
+
+
+FEND = 0xC0
+FESC = 0xDB
+TFEND = 0xDC
+TFESC = 0xDD
+# AX.25 UI frame
+CONTROL_UI = 0x03
+PID_NO_LAYER_3 = 0xF0
+
+logger = logging.getLogger(__file__)
+
+
+class KissDecoder:
+    """Turns a stream of bytes into KISS data frames, keeping partial frames between reads."""
+
+    def __init__(self):
+        self._frame = bytearray()
+        self._escaped = False
+        self._in_frame = False
+
+    def feed(self, data: bytes) -> typing.List[bytes]:
+        """Returns the AX.25 frames that were completed by these bytes."""
+        frames: typing.List[bytes] = []
+        for byte in data:
+            if byte == FEND:
+                if self._in_frame and len(self._frame) > 1:
+                    # The low nibble of the first byte is the command, 0 is a data frame
+                    if self._frame[0] & 0x0F == 0:
+                        frames.append(bytes(self._frame[1:]))
+                self._frame.clear()
+                self._escaped = False
+                self._in_frame = True
+                continue
+            if not self._in_frame:
+                continue
+            if self._escaped:
+                self._escaped = False
+                if byte == TFEND:
+                    byte = FEND
+                elif byte == TFESC:
+                    byte = FESC
+            elif byte == FESC:
+                self._escaped = True
+                continue
+            self._frame.append(byte)
+        return frames
+
+
+def encode_kiss(frame: bytes, port: int = 0) -> bytes:
+    """Wraps an AX.25 frame in a KISS data frame."""
+    escaped = frame.replace(bytes((FESC,)), bytes((FESC, TFESC))).replace(bytes((FEND,)), bytes((FESC, TFEND)))
+    return bytes((FEND, (port & 0x0F) << 4)) + escaped + bytes((FEND,))
+
+
+def _decode_address(raw: bytes) -> typing.Tuple[str, bool, bool]:
+    """Returns the call sign, whether it has been repeated, and whether it's the last address."""
+    call_sign = bytes(b >> 1 for b in raw[:6]).decode("ascii", errors="replace").strip()
+    ssid = (raw[6] >> 1) & 0x0F
+    if ssid != 0:
+        call_sign = f"{call_sign}-{ssid}"
+    return call_sign, bool(raw[6] & 0x80), bool(raw[6] & 0x01)
+
+
+def decode_ax25(frame: bytes) -> typing.Optional[str]:
+    """Converts an AX.25 UI frame into the TNC2 text format that aprslib parses, e.g.
+    "KE0FZV-11>APRS,WIDE1-1*:/222200h4000.00N/10500.00WO000/000/A=005280".
+    """
+    addresses: typing.List[typing.Tuple[str, bool]] = []
+    offset = 0
+    while True:
+        if offset + 7 > len(frame) or len(addresses) > 10:
+            return None
+        call_sign, repeated, last = _decode_address(frame[offset:offset + 7])
+        addresses.append((call_sign, repeated))
+        offset += 7
+        if last:
+            break
+    if len(addresses) < 2 or offset + 2 > len(frame):
+        return None
+    if frame[offset] != CONTROL_UI or frame[offset + 1] != PID_NO_LAYER_3:
+        return None
+
+    (destination, _), (source, _), *digipeaters = addresses
+    # Only the last digipeater that has repeated the packet gets a *, the ones before it are implied
+    last_repeated = max((index for index, (_, repeated) in enumerate(digipeaters) if repeated), default=-1)
+    path = [destination] + [
+        call_sign + ("*" if index == last_repeated else "") for index, (call_sign, _) in enumerate(digipeaters)
+    ]
+    # Mic-E and friends use arbitrary bytes, so keep them 1:1
+    info = frame[offset + 2:].decode("latin-1")
+    return f"{source}>{','.join(path)}:{info}"
+
+
+def _encode_address(call_sign: str, repeated: bool, last: bool) -> bytes:
+    call_sign = call_sign.rstrip("*")
+    if "-" in call_sign:
+        call_sign, ssid_str = call_sign.split("-", 1)
+        ssid = int(ssid_str)
+    else:
+        ssid = 0
+    encoded = bytes(ord(c) << 1 for c in f"{call_sign:6}"[:6])
+    ssid_byte = 0x60 | (ssid << 1) | (0x80 if repeated else 0) | (0x01 if last else 0)
+    return encoded + bytes((ssid_byte,))
+
+
+def encode_ax25(tnc2: str) -> bytes:
+    """The reverse of decode_ax25."""
+    header, info = tnc2.split(":", 1)
+    source, path = header.split(">", 1)
+    destination, *digipeaters = path.split(",")
+    # Every digipeater up to the one with the * has repeated it
+    last_repeated = max((index for index, call_sign in enumerate(digipeaters) if call_sign.endswith("*")), default=-1)
+    addresses = [(destination, False), (source, False)] + [
+        (call_sign, index <= last_repeated) for index, call_sign in enumerate(digipeaters)
+    ]
+    encoded = b"".join(
+        _encode_address(address, repeated, index == len(addresses) - 1)
+        for index, (address, repeated) in enumerate(addresses)
+    )
+    return encoded + bytes((CONTROL_UI, PID_NO_LAYER_3)) + info.encode("latin-1")
+
+
+class KissClient:
+    """Connects to a KISS TCP server and returns packets as soon as they're decoded. Reconnects
+    with exponential backoff if the connection drops, e.g. if direwolf is still starting up.
+    """
+
+    def __init__(self, host: str, port: int, min_backoff_s: float = 0.25, max_backoff_s: float = 8.0):
+        self.host = host
+        self.port = port
+        self.min_backoff_s = min_backoff_s
+        self.max_backoff_s = max_backoff_s
+        self._sock: typing.Optional[socket.socket] = None
+        self._decoder = KissDecoder()
+        self._backoff_s = min_backoff_s
+        self._next_attempt = 0.0
+
+    def close(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _connect(self) -> bool:
+        if time.monotonic() < self._next_attempt:
+            return False
+        try:
+            self._sock = socket.create_connection((self.host, self.port), timeout=1)
+        except OSError as exc:
+            logger.debug("Unable to connect to KISS port %s:%d: %s", self.host, self.port, exc)
+            self._next_attempt = time.monotonic() + self._backoff_s
+            self._backoff_s = min(self._backoff_s * 2, self.max_backoff_s)
+            return False
+        logger.info("Connected to KISS port %s:%d", self.host, self.port)
+        self._backoff_s = self.min_backoff_s
+        self._decoder = KissDecoder()
+        return True
+
+    def read_packets(self, timeout_s: float) -> typing.List[str]:
+        """Waits up to timeout_s for packets and returns them in TNC2 format."""
+        if self._sock is None and not self._connect():
+            time.sleep(min(timeout_s, max(0.0, self._next_attempt - time.monotonic())))
+            return []
+        assert self._sock is not None
+
+        self._sock.settimeout(timeout_s)
+        try:
+            data = self._sock.recv(4096)
+        except socket.timeout:
+            return []
+        except OSError as exc:
+            logger.warning("KISS connection error: %s", exc)
+            self.close()
+            return []
+        if len(data) == 0:
+            logger.warning("KISS server closed the connection")
+            self.close()
+            return []
+
+        packets = []
+        for frame in self._decoder.feed(data):
+            packet = decode_ax25(frame)
+            if packet is None:
+                logger.debug("Skipping non-APRS frame %s", frame.hex())
+                continue
+            packets.append(packet)
+        return packets
+
+
+class FakeKissServer(threading.Thread):
+    """Serves canned packets over KISS TCP, standing in for direwolf when testing."""
+
+    def __init__(self, packets: typing.Iterable[str], port: int = 0, interval_s: float = 0.0):
+        super().__init__(daemon=True)
+        self._server = socket.create_server(("127.0.0.1", port))
+        self.port: int = self._server.getsockname()[1]
+        self.packets = list(packets)
+        self.interval_s = interval_s
+        self.stop = False
+
+    def run(self) -> None:
+        self._server.settimeout(0.1)
+        with self._server:
+            while not self.stop:
+                try:
+                    connection, _ = self._server.accept()
+                except socket.timeout:
+                    continue
+                with connection:
+                    try:
+                        for packet in self.packets:
+                            if self.stop:
+                                break
+                            connection.sendall(encode_kiss(encode_ax25(packet)))
+                            time.sleep(self.interval_s)
+                    except OSError:
+                        continue
+
+
+def self_test() -> bool:
+    """Round trips packets through FakeKissServer and KissClient, including a reconnect after the
+    server drops the connection. Returns whether everything came through intact.
+    """
+    packets = [
+        "KE0FZV-11>APRS:/222200h4000.00N/10500.00WO000/000/A=005280 Tracksoar",
+        "W7JPJ-9>SYSXSV,K5RHD-10,WIDE1*:`pH1l#%j/`\"G=}_%\x0d",
+        "N2XGL-9>S9UYQU,WIDE1-1,WIDE2-1:`q)up7@>/`\"E{}_1\x0d",
+        # Needs escaping
+        "KE0FZV-11>APRS:\xc0\xdb",
+    ]
+    for packet in packets:
+        decoded = decode_ax25(encode_ax25(packet))
+        if decoded != packet:
+            print(f"Encoding changed {packet!r} to {decoded!r}")
+            return False
+
+    server = FakeKissServer(packets)
+    server.start()
+    # The server closes the connection after sending everything, so getting everything twice
+    # means the client reconnected
+    client = KissClient("127.0.0.1", server.port, min_backoff_s=0.05)
+    received: typing.List[str] = []
+    deadline = time.monotonic() + 10
+    while len(received) < 2 * len(packets) and time.monotonic() < deadline:
+        received.extend(client.read_packets(0.1))
+    client.close()
+    server.stop = True
+    server.join()
+
+    if received != 2 * packets:
+        print(f"Expected {2 * packets!r}, received {received!r}")
+        return False
+    print(f"Received {len(received)} packets across a reconnect")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="KISS client",
+        description="Prints APRS packets from a KISS TCP server, e.g. direwolf",
+    )
+    parser.add_argument(
+        "--host",
+        action="store",
+        default="127.0.0.1",
+        help="The KISS server's host.",
+        dest="host",
+    )
+    parser.add_argument(
+        "--port",
+        action="store",
+        type=int,
+        default=8001,
+        help="The KISS server's TCP port.",
+        dest="port",
+    )
+    parser.add_argument(
+        "--self-test",
+        action="store_true",
+        default=False,
+        help="Check the client against a fake server and exit.",
+        dest="self_test",
+    )
+    parser_options = parser.parse_args()
+    if parser_options.self_test:
+        sys.exit(0 if self_test() else 1)
+    kiss_client = KissClient(parser_options.host, parser_options.port)
+    while True:
+        for kiss_packet in kiss_client.read_packets(1.0):
+            print(kiss_packet, flush=True)
@@ -10,17 +10,23 @@ import curses
 import dataclasses
 import datetime
 import fcntl
+import functools
 import io
+import kiss
 import logging
-import math
 import multiprocessing
 import multiprocessing.connection
 import os
 import random
 import re
+import recording
+import select
 import subprocess
+import sys
+import tempfile
 import threading
 import time
+import track
 import typing
 
 
@@ -69,12 +75,16 @@ DUMMY_APRS_MESSAGE = AprsMessage(
 class Status:
     my_call_sign: str
     frequency_hz: int = 144390000
+    # Set when every frequency has its own dongle and we're listening to all of them at once
+    frequencies_hz: typing.Tuple[int, ...] = ()
     messages: typing.List[AprsMessage] = dataclasses.field(default_factory=list)
     last_call_sign_timestamp: typing.Optional[datetime.datetime] = None
     monitor_start: datetime.datetime = dataclasses.field(default_factory=lambda: datetime.datetime.now())
     overall_start: datetime.datetime = dataclasses.field(default_factory=lambda: datetime.datetime.now())
     falling: bool = False
     test: bool = False
+    # Simplified copy of my call sign's positions, for Google Earth
+    simplified_track: track.TrackSimplifier = dataclasses.field(default_factory=track.TrackSimplifier)
 
 
 @dataclasses.dataclass
@@ -84,6 +94,7 @@ class Options:
     aprs_only: bool
     rs41_only: bool
     test: bool
+    dongle_count: typing.Optional[int] = None
 
 
 @dataclasses.dataclass
@@ -159,7 +170,7 @@ def update_status(window: curses.window, status: Status) -> None:
     window.addnstr(10, 1, f"Last seen: {ago} ago", max_x - 2)
     window.move(14, 1)
     window.clrtoeol()
-    window.addnstr(14, 1, f"Monitoring: {status.frequency_hz} hz", max_x - 2)
+    window.addnstr(14, 1, f"Monitoring: {format_monitoring(status)} hz", max_x - 2)
     window.border()
 
     # If there's not a new message, then we only need to update the seconds ago and estimates
@@ -169,8 +180,8 @@ def update_status(window: curses.window, status: Status) -> None:
 
     update_status.recent_id = id(recent)  # type: ignore
 
-    distance_km = distance_m(recent.latitude_d, recent.longitude_d, launch_site.latitude_d, launch_site.longitude_d) / 1000
-    horizontal_delta_m = distance_m(recent.latitude_d, recent.longitude_d, recent2.latitude_d, recent2.longitude_d)
+    distance_km = track.distance_m(recent.latitude_d, recent.longitude_d, launch_site.latitude_d, launch_site.longitude_d) / 1000
+    horizontal_delta_m = track.distance_m(recent.latitude_d, recent.longitude_d, recent2.latitude_d, recent2.longitude_d)
     horizontal_ms = horizontal_delta_m / seconds
     reported_horizontal_ms = recent.horizontal_speed_mps * 1000 / 3600
     match = re.search(r"S(\d+)T(\d+)V(\d+)", recent_rs41.comment)
@@ -205,11 +216,17 @@ def update_status(window: curses.window, status: Status) -> None:
     window.addnstr(11, 1, f"Satellites: {satellite_count}", max_x - 2)
     window.addnstr(12, 1, f"Voltage: {battery_v:.3f} V", max_x - 2)
     window.addnstr(13, 1, f"Temperature: {temperature_c}°C, {temperature_c * 1.8 + 32:.0f}°F", max_x - 2)
-    window.addnstr(14, 1, f"Monitoring: {status.frequency_hz} hz", max_x - 2)
+    window.addnstr(14, 1, f"Monitoring: {format_monitoring(status)} hz", max_x - 2)
 
     window.noutrefresh()
 
 
+def format_monitoring(status: Status) -> str:
+    if status.frequencies_hz:
+        return ", ".join(str(frequency_hz) for frequency_hz in status.frequencies_hz)
+    return str(status.frequency_hz)
+
+
 def update_messages(window: curses.window, status: Status) -> None:
     """Show recently received APRS packets."""
     if not hasattr(update_messages, "previous_message_count"):
@@ -266,7 +283,7 @@ def update_stations(window: curses.window, status: Status) -> None:
 
     launch_site = get_launch_site(status)
     for count, msg in enumerate(recents):
-        distance_km = distance_m(launch_site.latitude_d, launch_site.longitude_d, msg.latitude_d, msg.longitude_d) / 1000
+        distance_km = track.distance_m(launch_site.latitude_d, launch_site.longitude_d, msg.latitude_d, msg.longitude_d) / 1000
         seconds = int((now - msg.timestamp).total_seconds())
         ago = f"{seconds // 3600:02}:{(seconds // 60) % 60:02}:{seconds % 60:02}"
         unicode_symbol = aprs_symbols.get_symbol(msg.symbol_table, msg.symbol)
@@ -326,38 +343,27 @@ def update_screen(windows: Windows, status: Status) -> None:
 
 
 def report_to_google_earth(status: Status) -> None:
-    with open("aprs.kml", "w") as file:
-        file.write(f"""<?xml version="1.0" encoding="UTF-8"?>
+    placemarks = track.format_placemark(
+        status.simplified_track,
+        name=f"{status.my_call_sign} APRS",
+        description=f"{status.my_call_sign} weather balloon APRS",
+        line_color="7f00ffff",
+        poly_color="7f00ff00",
+    )
+    track.write_atomically("aprs.kml", f"""<?xml version="1.0" encoding="UTF-8"?>
 <kml xmlns="http://www.opengis.net/kml/2.2">
   <Document>
     <name>Paths</name>
-    <Placemark>
-      <name>{status.my_call_sign} APRS</name>
-      <description>{status.my_call_sign} weather balloon APRS</description>
-      <Style>
-        <LineStyle>
-          <color>7f00ffff</color>
-          <width>4</width>
-        </LineStyle>
-        <PolyStyle>
-          <color>7f00ff00</color>
-        </PolyStyle>
-      </Style>
-      <LineString>
-        <extrude>1</extrude>
-        <tessellate>1</tessellate>
-        <altitudeMode>absolute</altitudeMode>
-        <coordinates>\n""")
-        for message in status.messages:
-            if status.my_call_sign in message.call_sign:
-                file.write(f"{message.longitude_d},{message.latitude_d},{message.altitude_m}\n")
-        file.write("""        </coordinates>
-      </LineString>
-    </Placemark>
-  </Document>
+{placemarks}  </Document>
 </kml>""")
 
 
+def add_message(status: Status, message: AprsMessage) -> None:
+    status.messages.append(message)
+    if status.my_call_sign in message.call_sign:
+        status.simplified_track.add((message.longitude_d, message.latitude_d, message.altitude_m))
+
+
 def get_launch_site(status: Status) -> AprsMessage:
     """Return the assumed launch site."""
     if hasattr(get_launch_site, "launch_site"):
@@ -370,12 +376,13 @@ def get_launch_site(status: Status) -> AprsMessage:
     return DUMMY_APRS_MESSAGE
 
 
-def format_aprs_message(now: datetime.datetime, frequency_hz: int, raw_message: str) -> AprsMessage:
+def format_aprs_message(now: datetime.datetime, frequency_hz: int, raw_message: str) -> typing.Optional[AprsMessage]:
+    """Returns None if the message can't be parsed."""
     try:
         parsed = aprslib.parse(raw_message)
     except aprslib.exceptions.ParseError as exc:
         logger.error("Parsing failed: %s", raw_message, exc_info=exc)
-        return ""
+        return None
 
     # I guess if speed is 0, aprslib just won't put in the key for it? Ugh
     def get(key: str, type_):
@@ -404,13 +411,19 @@ def format_aprs_message(now: datetime.datetime, frequency_hz: int, raw_message:
     )
 
 
-def parse_and_save_message(aprs_message: str, frequency_hz: int, status: Status) -> str:
-    """Parse and save a message, and return the call sign and SSID."""
+def parse_and_save_message(
+    aprs_message: str,
+    frequency_hz: int,
+    status: Status,
+    now: typing.Optional[datetime.datetime] = None,
+) -> str:
+    """Parse and save a message, and return the call sign and SSID, or an empty string if it
+    can't be parsed. Every message is saved, even ones that can't be parsed, so that they can be
+    looked at later.
+    """
     logger.info("Received APRS message %s", aprs_message)
-    now = datetime.datetime.now()
-
-    formatted = format_aprs_message(now, frequency_hz, aprs_message)
-    status.messages.append(formatted)
+    if now is None:
+        now = datetime.datetime.now()
 
     # Don't save test mode messages
     if not status.test:
@@ -418,9 +431,41 @@ def parse_and_save_message(aprs_message: str, frequency_hz: int, status: Status)
             writer = csv.writer(file)
             writer.writerow([int(now.timestamp()), frequency_hz, aprs_message])
 
+    formatted = format_aprs_message(now, frequency_hz, aprs_message)
+    if formatted is None:
+        return ""
+    add_message(status, formatted)
     return formatted.call_sign
 
 
+def self_test() -> bool:
+    """Feeds an unparseable packet and then a good one through parse_and_save_message, and checks
+    that both are saved and only the good one is shown. Returns whether it passed.
+    """
+    previous_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            status = Status(my_call_sign="KE0FZV")
+            bad_ssid = parse_and_save_message("garbage", 144390000, status)
+            good_ssid = parse_and_save_message(
+                "KE0FZV-11>APRS:/222200h4000.00N/10500.00WO000/000/A=005280 Tracksoar", 144390000, status
+            )
+            with open("messages.csv") as file:
+                rows = list(csv.reader(file))
+        finally:
+            os.chdir(previous_directory)
+    checks = (
+        ("unparseable packet returns no call sign", bad_ssid == ""),
+        ("good packet returns its call sign", good_ssid == "KE0FZV-11"),
+        ("both packets are saved", [row[2] for row in rows] == ["garbage", "KE0FZV-11>APRS:/222200h4000.00N/10500.00WO000/000/A=005280 Tracksoar"]),
+        ("only the good packet is shown", len(status.messages) == 1),
+    )
+    for name, ok in checks:
+        print(f"{name}: {'ok' if ok else 'FAILED'}")
+    return all(ok for _, ok in checks)
+
+
 def main(stdscr: curses.window, receiver_class, options: Options) -> None:
     windows = initialize_screen(stdscr)
     initialize_logger(windows)
@@ -501,7 +546,7 @@ def load_stations_from_file(status: Status) -> None:
             unix_timestamp, frequency_hz_str, raw_message = row
             time = datetime.datetime.fromtimestamp(int(unix_timestamp))
             formatted = format_aprs_message(time, int(frequency_hz_str), raw_message)
-            status.messages.append(formatted)
+            add_message(status, formatted)
             count += 1
         logger.debug("Parsed and added %d old messages from the messages file", count)
 
@@ -531,6 +576,18 @@ def loop_forever(windows: Windows, receiver_class, options: Options) -> None:
         #frequencies_hz = (RS41_FREQUENCY, APRS_FREQUENCY)
         frequencies_hz = (APRS_FREQUENCY, RS41_FREQUENCY)
 
+    if options.dongle_count is not None:
+        dongle_count = options.dongle_count
+    elif options.test:
+        # Pretend that we have enough so that the concurrent mode can be tested
+        dongle_count = len(frequencies_hz)
+    else:
+        dongle_count = count_rtl_sdr_devices()
+    logger.info("Found %d RTL-SDR dongles for %d frequencies", dongle_count, len(frequencies_hz))
+    if len(frequencies_hz) > 1 and dongle_count >= len(frequencies_hz):
+        loop_concurrently(windows, receiver_class, status, frequencies_hz)
+        return
+
     frequency_index = 0
     next_expected_rs41_time: typing.Optional[datetime.datetime] = datetime.datetime(2024, 4, 8, 17, 38, 11)
     timeout_s = 60 * 5
@@ -548,7 +605,7 @@ def loop_forever(windows: Windows, receiver_class, options: Options) -> None:
         status.frequency_hz = frequency_hz
         parent_pipe, child_pipe = multiprocessing.Pipe()
         logger.info("Monitoring %d", frequency_hz)
-        receiver = receiver_class(frequency_hz, child_pipe)
+        receiver = receiver_class(frequency_hz, child_pipe, 0)
         receiver.start()
 
         # We want to stay on 144.390 MHz as much as possible, because it's fun to see other people
@@ -578,10 +635,11 @@ def loop_forever(windows: Windows, receiver_class, options: Options) -> None:
 
                 data_waiting = parent_pipe.poll(0.5)
                 if data_waiting:
-                    aprs_message = parent_pipe.recv().strip()
+                    timestamp, aprs_message = parent_pipe.recv()
+                    aprs_message = aprs_message.strip()
                     if not aprs_message:
                         continue
-                    ssid = parse_and_save_message(aprs_message, frequency_hz, status)
+                    ssid = parse_and_save_message(aprs_message, frequency_hz, status, timestamp)
                     if status.my_call_sign in ssid:
                         # Report to Google Earth
                         try:
@@ -628,26 +686,217 @@ def loop_forever(windows: Windows, receiver_class, options: Options) -> None:
         frequency_index = (frequency_index + 1) % len(frequencies_hz)
 
 
-class AprsReceiver(multiprocessing.Process):
-    def __init__(self, frequency_hz: int, pipe: multiprocessing.connection.Connection):
+def loop_concurrently(
+    windows: Windows,
+    receiver_class,
+    status: Status,
+    frequencies_hz: typing.Sequence[int],
+) -> None:
+    """Listen to every frequency at once, with one dongle per frequency."""
+    status.frequencies_hz = tuple(frequencies_hz)
+    status.monitor_start = datetime.datetime.now()
+
+    receivers: typing.Dict[int, multiprocessing.Process] = dict()
+    pipes: typing.Dict[int, multiprocessing.connection.Connection] = dict()
+
+    def start_receiver(device_index: int) -> None:
+        frequency_hz = frequencies_hz[device_index]
+        parent_pipe, child_pipe = multiprocessing.Pipe()
+        logger.info("Monitoring %d on dongle %d", frequency_hz, device_index)
+        receiver = receiver_class(frequency_hz, child_pipe, device_index)
+        receiver.start()
+        receivers[device_index] = receiver
+        pipes[device_index] = parent_pipe
+
+    def stop_receiver(device_index: int) -> None:
+        receiver = receivers[device_index]
+        if receiver.is_alive():
+            try:
+                pipes[device_index].send("die")
+            except OSError as exc:
+                # It died after we checked, so there's nobody to tell
+                logger.debug("Couldn't tell receiver to die", exc_info=exc)
+        receiver.join(timeout=10)
+        if receiver.is_alive():
+            logger.warning("Receiver for %d didn't quit, terminating it", frequencies_hz[device_index])
+            receiver.terminate()
+            receiver.join()
+        pipes[device_index].close()
+
+    for device_index in range(len(frequencies_hz)):
+        start_receiver(device_index)
+
+    try:
+        while True:
+            try:
+                update_screen(windows, status)
+
+                for device_index, receiver in list(receivers.items()):
+                    if not receiver.is_alive():
+                        logger.error("Receiver for %d quit unexpectedly", frequencies_hz[device_index])
+                        stop_receiver(device_index)
+                        # Let's give it half a second so it's not just continually restarting
+                        time.sleep(0.5)
+                        start_receiver(device_index)
+
+                # Merge everything that's waiting so that messages are saved in the order they were
+                # decoded, regardless of which dongle heard them. This only orders messages that
+                # arrive in the same half second; one that's delivered later is saved later, even if
+                # it was decoded first.
+                pending: typing.List[typing.Tuple[datetime.datetime, int, str]] = []
+                ready = multiprocessing.connection.wait(list(pipes.values()), timeout=0.5)
+                for device_index, pipe in pipes.items():
+                    if pipe not in ready:
+                        continue
+                    while pipe.poll():
+                        timestamp, aprs_message = pipe.recv()
+                        aprs_message = aprs_message.strip()
+                        if aprs_message:
+                            pending.append((timestamp, frequencies_hz[device_index], aprs_message))
+                pending.sort(key=lambda p: p[0])
+
+                for timestamp, frequency_hz, aprs_message in pending:
+                    ssid = parse_and_save_message(aprs_message, frequency_hz, status, timestamp)
+                    if status.my_call_sign in ssid:
+                        try:
+                            report_to_google_earth(status)
+                        except Exception as exc:
+                            logger.debug("Couldn't write to Google Earth file", exc_info=exc)
+
+            except Exception as exc:
+                logger.error(str(exc), exc_info=exc)
+                time.sleep(0.5)
+    finally:
+        logger.debug("Killing monitors")
+        # Keep going if one fails, so that no rtl_fm is left holding a dongle
+        for device_index in receivers:
+            try:
+                stop_receiver(device_index)
+            except Exception as exc:
+                logger.error("Couldn't stop receiver for %d", frequencies_hz[device_index], exc_info=exc)
+
+
+def count_rtl_sdr_devices() -> int:
+    """Returns the number of connected RTL-SDR dongles."""
+    try:
+        # rtl_test lists the devices before it starts testing, and -t makes it exit right after
+        result = subprocess.run(
+            ("rtl_test", "-t"),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            encoding="utf-8",
+            timeout=5,
+        )
+        output = result.stderr
+    except subprocess.TimeoutExpired as exc:
+        output = exc.stderr.decode() if isinstance(exc.stderr, bytes) else (exc.stderr or "")
+    except OSError as exc:
+        logger.warning("Unable to run rtl_test, assuming 1 dongle: %s", exc)
+        return 1
+
+    match = re.search(r"Found (\d+) device", output)
+    if match is None:
+        logger.warning("Unable to count RTL-SDR dongles, assuming 1")
+        return 1
+    return int(match.groups()[0])
+
+
+class RtlFmReceiver(multiprocessing.Process):
+    """Runs rtl_fm on one dongle and sends the packets decoded from its audio through the pipe.
+    Subclasses decode the audio in receive(), and this takes care of starting and stopping
+    rtl_fm, direwolf if they use it, and recording the audio if capture_directory is set.
+    """
+
+    def __init__(
+        self,
+        frequency_hz: int,
+        pipe: multiprocessing.connection.Connection,
+        device_index: int = 0,
+        capture_directory: typing.Optional[str] = None,
+    ):
         super().__init__()
         self.frequency_hz: int = frequency_hz
         self.pipe: multiprocessing.connection.Connection = pipe
+        self.device_index: int = device_index
+        # If set, rtl_fm's audio is also recorded here so that it can be replayed later
+        self.capture_directory: typing.Optional[str] = capture_directory
+        # Set by start_direwolf, and stopped after rtl_fm
+        self._direwolf: typing.Optional[subprocess.Popen] = None
+        self._tee_thread: typing.Optional[threading.Thread] = None
 
     def run(self) -> None:
-        file_name = "aprs.log"
-        command = " ".join(("rtl_fm", "-f", str(self.frequency_hz), "-p", "0", "-"))
-        logger.debug(f"Running {command}")
+        rtl_fm_command = ("rtl_fm", "-d", str(self.device_index), "-f", str(self.frequency_hz), "-p", "0", "-")
+        logger.debug(f"Running {' '.join(rtl_fm_command)}")
         rtl_fm = subprocess.Popen(
-            ("rtl_fm", "-f", str(self.frequency_hz), "-p", "0", "-"),
+            rtl_fm_command,
             stdout=subprocess.PIPE,
             stderr=subprocess.DEVNULL,
         )
+        try:
+            self.receive(rtl_fm)
+        finally:
+            logger.debug("Calling terminate and wait")
+            rtl_fm.terminate()
+            if self._tee_thread is not None:
+                # Let it finish reading rtl_fm's output and close the recording
+                self._tee_thread.join()
+            rtl_fm.wait()
+            if self._direwolf is not None:
+                self._direwolf.terminate()
+                # Not communicate(), which can't read the non-blocking output that AprsReceiver uses
+                self._direwolf.wait()
+            logger.debug("Done calling terminate and wait")
+
+    def receive(self, rtl_fm: subprocess.Popen) -> None:
+        """Decodes rtl_fm's audio until the other end of the pipe says to stop, or something quits."""
+        raise NotImplementedError
+
+    def open_recorder(self) -> typing.Optional[recording.AudioRecorder]:
+        """Returns somewhere to record rtl_fm's audio, if it's being captured."""
+        if self.capture_directory is None:
+            return None
+        return recording.AudioRecorder(self.capture_directory, self.frequency_hz)
+
+    def start_direwolf(self, rtl_fm: subprocess.Popen, arguments: typing.Sequence[str], **kwargs) -> subprocess.Popen:
+        """Starts direwolf reading rtl_fm's audio. If it's being captured, the audio is copied to
+        direwolf by a thread instead, so that it can be recorded on the way.
+        """
+        recorder = self.open_recorder()
         direwolf = subprocess.Popen(
-            ("direwolf", "-c", "sdr.conf", "-r", "24000", "-D", "1", "-t", "0", "-L", file_name, "-"),
-            stdin=rtl_fm.stdout,
-            stdout=subprocess.PIPE,
+            ("direwolf", "-r", "24000", "-D", "1", "-t", "0") + tuple(arguments) + ("-",),
+            stdin=rtl_fm.stdout if recorder is None else subprocess.PIPE,
             stderr=subprocess.DEVNULL,
+            **kwargs,
+        )
+        self._direwolf = direwolf
+        if recorder is not None:
+            assert rtl_fm.stdout is not None and direwolf.stdin is not None
+            # direwolf's stdin might be in text mode, so write to the underlying binary stream
+            destination = getattr(direwolf.stdin, "buffer", direwolf.stdin)
+            self._tee_thread = recording.tee(rtl_fm.stdout, destination, recorder)
+        return direwolf
+
+    def quit_unexpectedly(self, rtl_fm: subprocess.Popen) -> bool:
+        """Returns whether rtl_fm or direwolf has quit, logging which one."""
+        if rtl_fm.poll() is not None:
+            logger.error("rtl_fm quit unexpectedly")
+            return True
+        if self._direwolf is not None and self._direwolf.poll() is not None:
+            logger.error("direwolf quit unexpectedly")
+            return True
+        return False
+
+
+class AprsReceiver(RtlFmReceiver):
+    """Parses the packets from direwolf's printed output."""
+
+    def receive(self, rtl_fm: subprocess.Popen) -> None:
+        # Each direwolf needs its own log when running concurrently
+        file_name = "aprs.log" if self.device_index == 0 else f"aprs-{self.device_index}.log"
+        direwolf = self.start_direwolf(
+            rtl_fm,
+            ("-c", "sdr.conf", "-L", file_name),
+            stdout=subprocess.PIPE,
             encoding="utf-8",
         )
 
@@ -658,20 +907,10 @@ class AprsReceiver(multiprocessing.Process):
 
         while True:
             # The other thread will notify us if it's time to shut down
-            anything = self.pipe.poll(0.1)
-            if anything:
-                logger.debug("Calling terminate and wait")
-                rtl_fm.terminate()
-                rtl_fm.communicate()
-                rtl_fm.wait()
-                direwolf.terminate()
-                direwolf.communicate()
-                direwolf.wait()
-                logger.debug("Done calling terminate and wait")
+            if self.pipe.poll(0.1):
                 return
 
-            if rtl_fm.poll():
-                logger.error("rtl_fm quit unexpectedly")
+            if self.quit_unexpectedly(rtl_fm):
                 return
 
             try:
@@ -679,14 +918,100 @@ class AprsReceiver(multiprocessing.Process):
                 for line in lines:
                     if re.match(r"\[\d", line):
                         aprs_message = " ".join(line.split(" ")[1:])
-                        self.pipe.send(aprs_message)
+                        self.pipe.send((datetime.datetime.now(), aprs_message))
             except IOError:
                 continue
 
 
+class KissReceiver(RtlFmReceiver):
+    """Like AprsReceiver, but reads frames from direwolf's KISS TCP port instead of parsing its
+    printed output, so packets show up as soon as they're decoded.
+    """
+    KISS_BASE_PORT = 8001
+
+    def write_config(self, kiss_port: int) -> str:
+        """direwolf can only set the KISS port in the config file, so write one for each dongle."""
+        config_file_name = f"sdr-kiss-{self.device_index}.conf"
+        with open("sdr.conf") as file:
+            lines = [line for line in file if not line.startswith(("KISSPORT", "AGWPORT"))]
+        with open(config_file_name, "w") as file:
+            file.writelines(lines)
+            file.write(f"\nKISSPORT {kiss_port}\n")
+            # Every direwolf needs its own AGW port too, or the second one will fail to start
+            file.write(f"AGWPORT {kiss_port + 1000}\n")
+        return config_file_name
+
+    def receive(self, rtl_fm: subprocess.Popen) -> None:
+        kiss_port = self.KISS_BASE_PORT + self.device_index
+        config_file_name = self.write_config(kiss_port)
+        self.start_direwolf(
+            rtl_fm,
+            ("-c", config_file_name, "-q", "hd", "-L", f"aprs-kiss-{self.device_index}.log"),
+            stdout=subprocess.DEVNULL,
+        )
+        client = kiss.KissClient("127.0.0.1", kiss_port)
+
+        try:
+            while True:
+                # The other thread will notify us if it's time to shut down
+                if self.pipe.poll():
+                    return
+
+                if self.quit_unexpectedly(rtl_fm):
+                    return
+
+                for aprs_message in client.read_packets(0.1):
+                    self.pipe.send((datetime.datetime.now(), aprs_message))
+        finally:
+            client.close()
+
+
+class AfskReceiver(RtlFmReceiver):
+    """Like AprsReceiver, but demodulates rtl_fm's audio in process instead of using direwolf."""
+
+    def receive(self, rtl_fm: subprocess.Popen) -> None:
+        # Only import this here so that NumPy is only needed if this receiver is used
+        import afsk
+        import numpy
+
+        assert rtl_fm.stdout is not None
+        descriptor = rtl_fm.stdout.fileno()
+        demodulator = afsk.AfskDemodulator()
+        recorder = self.open_recorder()
+        # Samples are 2 bytes, so keep any odd byte around for the next read
+        leftover = b""
+
+        try:
+            while True:
+                # The other thread will notify us if it's time to shut down
+                if self.pipe.poll():
+                    return
+
+                if self.quit_unexpectedly(rtl_fm):
+                    return
+
+                readable, _, _ = select.select((descriptor,), (), (), 0.1)
+                if not readable:
+                    continue
+                data = os.read(descriptor, afsk.SAMPLE_RATE_HZ // 10 * 2)
+                if recorder is not None:
+                    recorder.write(data)
+                data = leftover + data
+                usable = len(data) // 2 * 2
+                leftover = data[usable:]
+                samples = numpy.frombuffer(data[:usable], dtype="<i2")
+                for frame in demodulator.feed(samples):
+                    aprs_message = kiss.decode_ax25(frame)
+                    if aprs_message is not None:
+                        self.pipe.send((datetime.datetime.now(), aprs_message))
+        finally:
+            if recorder is not None:
+                recorder.close()
+
+
 test_receiver_start_time = datetime.datetime.now()
 class TestReceiver(multiprocessing.Process):
-    def __init__(self, _: int, pipe: multiprocessing.connection.Connection):
+    def __init__(self, _: int, pipe: multiprocessing.connection.Connection, device_index: int = 0):
         super().__init__()
         self.pipe: multiprocessing.connection.Connection = pipe
 
@@ -724,21 +1049,7 @@ class TestReceiver(multiprocessing.Process):
                 message = re.sub(r"A=\d+", f"A={int(altitude):06}", message)
                 longitude_d = 105 - diff.total_seconds() / 20000
                 message = re.sub(r"10500.00", long_to_d_m_fm(longitude_d), message)
-                self.pipe.send(message)
-
-
-def distance_m(lat1: float, long1: float, lat2: float, long2: float) -> float:
-    """Great circle distance."""
-    radius_m = 6371 * 1000
-    lat_delta_r = math.radians(lat2 - lat1)
-    long_delta_r = math.radians(long2 - long1);
-    a = (
-        math.sin(lat_delta_r / 2) ** 2 +
-        math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) *
-        math.sin(long_delta_r / 2) * math.sin(long_delta_r / 2)
-    )
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return radius_m * c
+                self.pipe.send((datetime.datetime.now(), message))
 
 
 def long_to_d_m_fm(degrees: float) -> str:
@@ -797,9 +1108,60 @@ to pick up other people.""",
         help="Use fake messages instead of using the RTL-SDR, just for testing the display",
         dest="test",
     )
+    parser.add_argument(
+        "--dongles",
+        action="store",
+        type=int,
+        help="""The number of RTL-SDR dongles to use. If there's one for each frequency, all of the
+frequencies are monitored at the same time instead of switching between them. If not set, the
+dongles are detected automatically.""",
+        dest="dongle_count",
+        default=None,
+    )
+    decoder_group = parser.add_mutually_exclusive_group()
+    decoder_group.add_argument(
+        "--kiss",
+        action="store_true",
+        default=False,
+        help="Read packets from direwolf's KISS TCP port instead of its printed output.",
+        dest="kiss",
+    )
+    decoder_group.add_argument(
+        "--afsk",
+        action="store_true",
+        default=False,
+        help="Decode the audio in process using NumPy instead of using direwolf. It needs about 5 dB SNR, so it misses weak packets that direwolf decodes; use direwolf for flights.",
+        dest="afsk",
+    )
+    parser.add_argument(
+        "--capture",
+        action="store",
+        type=str,
+        default=None,
+        help="Record rtl_fm's audio to rotating compressed files in this directory, so that it can be decoded again later using recording.py.",
+        dest="capture_directory",
+    )
+    parser.add_argument(
+        "--self-test",
+        action="store_true",
+        default=False,
+        help="Check that unparseable packets are saved and skipped, and exit with an error if not.",
+        dest="self_test",
+    )
     parser_options = parser.parse_args()
-
-    receiver_class = TestReceiver if parser_options.test else AprsReceiver
+    if parser_options.self_test:
+        sys.exit(0 if self_test() else 1)
+
+    if parser_options.test:
+        receiver_class = TestReceiver
+    elif parser_options.kiss:
+        receiver_class = KissReceiver
+    elif parser_options.afsk:
+        receiver_class = AfskReceiver
+    else:
+        receiver_class = AprsReceiver
+    if parser_options.capture_directory is not None and not parser_options.test:
+        receiver_class = functools.partial(receiver_class, capture_directory=parser_options.capture_directory)
 
     if parser_options.launch_site:
         lat, long = [float(i) for i in parser_options.launch_site.split(",")]
@@ -816,6 +1178,7 @@ to pick up other people.""",
         aprs_only=parser_options.aprs_only,
         rs41_only=parser_options.rs41_only,
         test=parser_options.test,
+        dongle_count=parser_options.dongle_count,
     )
 
     curses.wrapper(
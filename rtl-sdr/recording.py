@@ -0,0 +1,252 @@
+"""Records rtl_fm's audio to rotating compressed files, and replays them through a decoder.
+
+Recordings are raw signed 16 bit 24 kHz samples, gzipped, named after the frequency and the time
+the file was started, e.g. audio/144390000_2024-04-08_17-38-11.s16.gz. There are no colons, so
+that they can be copied to FAT formatted SD cards and Windows. To decode a whole flight
+as fast as the CPU allows:
+
+    python recording.py audio/144390000_*.s16.gz
+
+Or to compare against direwolf with different settings:
+
+    python recording.py --decoder direwolf --direwolf-args "-P E+" audio/144390000_*.s16.gz
+"""
+
+import argparse
+import datetime
+import glob
+import gzip
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import time
+import typing
+
+
+SAMPLE_RATE_HZ = 24000
+BYTES_PER_SAMPLE = 2
+FILE_NAME_TIME_FORMAT = "%Y-%m-%d_%H-%M-%S"
+# Recordings from before colons were replaced
+OLD_FILE_NAME_TIME_FORMAT = "%Y-%m-%d_%H:%M:%S"
+SUFFIX = ".s16.gz"
+
+
+class AudioRecorder:
+    """Writes audio to gzipped files, starting a new file every rotate_s seconds of audio."""
+
+    def __init__(self, directory: str, frequency_hz: int, rotate_s: float = 10 * 60):
+        self.directory = directory
+        self.frequency_hz = frequency_hz
+        self.rotate_bytes = int(rotate_s * SAMPLE_RATE_HZ) * BYTES_PER_SAMPLE
+        self._file: typing.Optional[gzip.GzipFile] = None
+        self._file_bytes = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _open(self) -> gzip.GzipFile:
+        now = datetime.datetime.now()
+        file_name = os.path.join(
+            self.directory,
+            f"{self.frequency_hz}_{datetime.datetime.strftime(now, FILE_NAME_TIME_FORMAT)}{SUFFIX}",
+        )
+        # Level 1 is plenty for audio and keeps up with rtl_fm easily
+        self._file_bytes = 0
+        return gzip.open(file_name, "wb", compresslevel=1)
+
+    def write(self, data: bytes) -> None:
+        while data:
+            if self._file is None:
+                self._file = self._open()
+            # Only rotate on sample boundaries
+            count = min(len(data), self.rotate_bytes - self._file_bytes)
+            self._file.write(data[:count])
+            self._file_bytes += count
+            data = data[count:]
+            if self._file_bytes >= self.rotate_bytes:
+                self.close()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def tee(source: typing.BinaryIO, destination: typing.BinaryIO, recorder: AudioRecorder) -> threading.Thread:
+    """Copies source to destination in a thread, recording everything that passes through."""
+
+    def run() -> None:
+        descriptor = source.fileno()
+        try:
+            while True:
+                data = os.read(descriptor, SAMPLE_RATE_HZ // 10 * BYTES_PER_SAMPLE)
+                if not data:
+                    break
+                recorder.write(data)
+                destination.write(data)
+                destination.flush()
+        except (BrokenPipeError, ValueError, OSError):
+            # The other end was shut down
+            pass
+        finally:
+            recorder.close()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def parse_start_time(path: str) -> datetime.datetime:
+    """Returns the time that the recording started from its file name."""
+    base_name = os.path.basename(path)[:-len(SUFFIX)]
+    _, formatted = base_name.split("_", 1)
+    try:
+        return datetime.datetime.strptime(formatted, FILE_NAME_TIME_FORMAT)
+    except ValueError:
+        return datetime.datetime.strptime(formatted, OLD_FILE_NAME_TIME_FORMAT)
+
+
+def recording_s(path: str) -> float:
+    """Returns the length of the recording. gzip stores the uncompressed size (mod 2^32) in the
+    last 4 bytes, which is plenty for 10 minute files.
+    """
+    with open(path, "rb") as file:
+        file.seek(-4, os.SEEK_END)
+        size = int.from_bytes(file.read(4), "little")
+    return size / (SAMPLE_RATE_HZ * BYTES_PER_SAMPLE)
+
+
+def read_blocks(path: str, block_bytes: int) -> typing.Iterator[bytes]:
+    """Reads a recording. If the monitor was killed, the last file might be truncated, so just
+    return whatever made it to disk.
+    """
+    with gzip.open(path, "rb") as file:
+        while True:
+            try:
+                data = file.read(block_bytes)
+            except EOFError:
+                break
+            if not data:
+                break
+            yield data
+
+
+def replay_afsk(paths: typing.Sequence[str]) -> typing.Iterator[typing.Tuple[datetime.datetime, str]]:
+    """Decodes recordings with the NumPy decoder, yielding the time each packet was received. The
+    files are treated as one stream, so packets that straddle a rotation aren't lost.
+    """
+    # Only import these here so that recording doesn't need NumPy
+    import afsk
+    import kiss
+    import numpy
+
+    demodulator = afsk.AfskDemodulator()
+    # Bigger blocks are faster, but the packets' timestamps are only as good as the block size
+    block_bytes = SAMPLE_RATE_HZ * BYTES_PER_SAMPLE
+    for path in paths:
+        start = parse_start_time(path)
+        sample_count = 0
+        for data in read_blocks(path, block_bytes):
+            samples = numpy.frombuffer(data[:len(data) // BYTES_PER_SAMPLE * BYTES_PER_SAMPLE], dtype="<i2")
+            sample_count += len(samples)
+            for frame in demodulator.feed(samples):
+                packet = kiss.decode_ax25(frame)
+                if packet is not None:
+                    yield start + datetime.timedelta(seconds=sample_count / SAMPLE_RATE_HZ), packet
+
+
+def replay_direwolf(paths: typing.Sequence[str], extra_args: typing.Sequence[str]) -> typing.Iterator[typing.Tuple[datetime.datetime, str]]:
+    """Decodes recordings with direwolf, one file at a time. direwolf doesn't say how far into the
+    audio it is, so packets are timestamped with the file's start plus how much audio had been fed
+    to direwolf when the packet came out. That's late by however much audio direwolf had buffered,
+    a second or two. Unlike replay_afsk, a packet that straddles a rotation is lost.
+    """
+    for path in paths:
+        yield from _replay_direwolf_file(path, extra_args)
+
+
+def _replay_direwolf_file(path: str, extra_args: typing.Sequence[str]) -> typing.Iterator[typing.Tuple[datetime.datetime, str]]:
+    start = parse_start_time(path)
+    direwolf = subprocess.Popen(
+        ("direwolf", "-c", "sdr.conf", "-r", str(SAMPLE_RATE_HZ), "-D", "1", "-t", "0", *extra_args, "-"),
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    assert direwolf.stdin is not None and direwolf.stdout is not None
+    fed_bytes = 0
+
+    def feed() -> None:
+        nonlocal fed_bytes
+        assert direwolf.stdin is not None
+        try:
+            # Small blocks so that fed_bytes follows direwolf closely
+            for data in read_blocks(path, SAMPLE_RATE_HZ // 10 * BYTES_PER_SAMPLE):
+                direwolf.stdin.write(data)
+                direwolf.stdin.flush()
+                fed_bytes += len(data)
+            direwolf.stdin.close()
+        except BrokenPipeError:
+            # direwolf quit
+            pass
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    for raw_line in direwolf.stdout:
+        line = raw_line.decode("utf-8", errors="replace")
+        # Same parsing as AprsReceiver
+        if line.startswith("[") and len(line) > 1 and line[1].isdigit():
+            offset_s = fed_bytes / (SAMPLE_RATE_HZ * BYTES_PER_SAMPLE)
+            yield start + datetime.timedelta(seconds=offset_s), " ".join(line.split(" ")[1:]).strip()
+    feeder.join()
+    direwolf.wait()
+
+
+def main(paths: typing.Sequence[str], decoder: str, direwolf_args: typing.Sequence[str]) -> None:
+    packet_count = 0
+    start = time.perf_counter()
+    audio_s = sum(recording_s(path) for path in paths)
+    if decoder == "afsk":
+        packets = replay_afsk(paths)
+    else:
+        packets = replay_direwolf(paths, direwolf_args)
+    for timestamp, packet in packets:
+        packet_count += 1
+        print(f"{datetime.datetime.strftime(timestamp, '%Y-%m-%d %H:%M:%S')} {packet}", flush=True)
+    elapsed_s = time.perf_counter() - start
+    print(
+        f"Decoded {packet_count} packets from {audio_s:.0f} s of audio in {elapsed_s:.1f} s",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Audio replay",
+        description="Decodes recorded rtl_fm audio as fast as possible",
+    )
+    parser.add_argument(
+        "paths",
+        nargs="+",
+        help="Recordings to decode, in order. Globs are expanded.",
+    )
+    parser.add_argument(
+        "--decoder",
+        action="store",
+        choices=("afsk", "direwolf"),
+        default="afsk",
+        help="Which decoder to use.",
+        dest="decoder",
+    )
+    parser.add_argument(
+        "--direwolf-args",
+        action="store",
+        type=str,
+        default="",
+        help="Extra arguments to pass to direwolf, for comparing settings.",
+        dest="direwolf_args",
+    )
+    parser_options = parser.parse_args()
+    expanded = [path for pattern in parser_options.paths for path in sorted(glob.glob(pattern)) or [pattern]]
+    main(expanded, parser_options.decoder, shlex.split(parser_options.direwolf_args))
@@ -0,0 +1,186 @@
+"""Simplifies balloon tracks as points arrive, and writes them as KML.
+
+Flights can last hours, and Google Earth re-reads the whole file every refresh, so instead of
+writing every point, only write the ones needed to draw the track within TOLERANCE_M.
+"""
+
+import math
+import os
+import tempfile
+import typing
+
+
+EARTH_RADIUS_M = 6371 * 1000
+
+# GPS noise is a few meters, so this drops the noise along with the points on straight stretches
+TOLERANCE_M = 10.0
+
+Point = typing.Tuple[float, float, float]  # longitude_d, latitude_d, altitude_m
+
+
+def distance_m(lat1: float, long1: float, lat2: float, long2: float) -> float:
+    """Great circle distance."""
+    lat_delta_r = math.radians(lat2 - lat1)
+    long_delta_r = math.radians(long2 - long1)
+    a = (
+        math.sin(lat_delta_r / 2) ** 2 +
+        math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) *
+        math.sin(long_delta_r / 2) * math.sin(long_delta_r / 2)
+    )
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return EARTH_RADIUS_M * c
+
+
+def _to_local_m(origin: Point, point: Point) -> typing.Tuple[float, float, float]:
+    """Converts to meters east, north, and up of the origin. Good enough for nearby points."""
+    x = math.radians(point[0] - origin[0]) * EARTH_RADIUS_M * math.cos(math.radians(origin[1]))
+    y = math.radians(point[1] - origin[1]) * EARTH_RADIUS_M
+    return x, y, point[2] - origin[2]
+
+
+def distance_to_segment_m(point: Point, start: Point, end: Point) -> float:
+    """3-D distance from the point to the line segment between start and end."""
+    return _distance_to_local_segment_m(_to_local_m(start, point), _to_local_m(start, end))
+
+
+def _distance_to_local_segment_m(
+    point: typing.Tuple[float, float, float],
+    end: typing.Tuple[float, float, float],
+) -> float:
+    """Same as distance_to_segment_m, but with everything already converted to local meters
+    relative to the start of the segment.
+    """
+    px, py, pz = point
+    ex, ey, ez = end
+    length_squared = ex * ex + ey * ey + ez * ez
+    if length_squared == 0:
+        return math.sqrt(px * px + py * py + pz * pz)
+    t = max(0.0, min(1.0, (px * ex + py * ey + pz * ez) / length_squared))
+    dx = px - t * ex
+    dy = py - t * ey
+    dz = pz - t * ez
+    return math.sqrt(dx * dx + dy * dy + dz * dz)
+
+
+class TrackSimplifier:
+    """Streaming line simplification. Keeps an anchor point and the points since then, and as
+    long as a straight line from the anchor to the newest point stays within the tolerance of
+    all of them, they're dropped. Otherwise, the previous point becomes the new anchor. This is
+    the same test that Douglas-Peucker does, just done incrementally.
+    """
+
+    def __init__(self, tolerance_m: float = TOLERANCE_M, max_pending: int = 64):
+        self.tolerance_m = tolerance_m
+        # Bounds the work done per point, by keeping a point even on a long straight stretch
+        self.max_pending = max_pending
+        self.points: typing.List[Point] = []
+        # KML coordinates for self.points, joined into one string. Kept points never change, so
+        # each one is only formatted and joined once, when it's first written.
+        self._formatted = ""
+        self._formatted_count = 0
+        self._pending: typing.List[Point] = []
+        # The pending points converted to meters from the anchor, so they're only converted once
+        self._pending_local: typing.List[typing.Tuple[float, float, float]] = []
+
+    def _keep(self, point: Point) -> None:
+        self.points.append(point)
+
+    def add(self, point: Point) -> None:
+        if not self.points:
+            self._keep(point)
+            return
+
+        anchor = self.points[-1]
+        local = _to_local_m(anchor, point)
+        if all(_distance_to_local_segment_m(pending, local) <= self.tolerance_m for pending in self._pending_local):
+            self._pending.append(point)
+            self._pending_local.append(local)
+            if len(self._pending) >= self.max_pending:
+                # Every pending point is within the tolerance of the line to this one, so it's
+                # safe to keep it and start over from here
+                self._keep(point)
+                self._pending = []
+                self._pending_local = []
+            return
+
+        # The line can't be stretched to this point, so keep the one before it
+        if self._pending:
+            self._keep(self._pending[-1])
+        self._pending = [point]
+        self._pending_local = [_to_local_m(self.points[-1], point)]
+
+    def coordinates(self) -> typing.List[Point]:
+        """The simplified track, including the most recent point."""
+        if self._pending:
+            return self.points + [self._pending[-1]]
+        return list(self.points)
+
+    def format_coordinates(self) -> str:
+        """The simplified track as the contents of a KML coordinates element. Only the points
+        kept since the last call and the most recent point are formatted, but the result still
+        has every kept point in it, so it grows with the number of kept points.
+        """
+        if self._formatted_count < len(self.points):
+            new = "\n".join(format_coordinate(point) for point in self.points[self._formatted_count:])
+            self._formatted = f"{self._formatted}\n{new}" if self._formatted else new
+            self._formatted_count = len(self.points)
+        if self._pending:
+            return f"{self._formatted}\n{format_coordinate(self._pending[-1])}"
+        return self._formatted
+
+
+def format_coordinate(point: Point) -> str:
+    return f"{point[0]},{point[1]},{point[2]}"
+
+
+def format_placemark(
+    simplifier: TrackSimplifier,
+    name: str,
+    description: str,
+    line_color: str,
+    poly_color: str,
+) -> str:
+    """Returns a KML Placemark with the simplified track."""
+    if not simplifier.points:
+        return ""
+    coordinates = simplifier.format_coordinates()
+    return f"""    <Placemark>
+      <name>{name}</name>
+      <description>{description}</description>
+      <Style>
+        <LineStyle>
+          <color>{line_color}</color>
+          <width>4</width>
+        </LineStyle>
+        <PolyStyle>
+          <color>{poly_color}</color>
+        </PolyStyle>
+      </Style>
+      <LineString>
+        <extrude>1</extrude>
+        <tessellate>1</tessellate>
+        <altitudeMode>absolute</altitudeMode>
+        <coordinates>
+{coordinates}
+        </coordinates>
+      </LineString>
+    </Placemark>
+"""
+
+
+def write_atomically(file_name: str, contents: str) -> None:
+    """Writes to a temporary file and renames it, so that Google Earth never sees a partially
+    written file. The whole file is rewritten each time, so this gets slower as more points are
+    kept, but simplification keeps that to hundreds of points for a whole flight.
+    """
+    directory = os.path.dirname(os.path.abspath(file_name))
+    descriptor, temporary_name = tempfile.mkstemp(dir=directory, prefix=".", suffix=".kml")
+    try:
+        # mkstemp makes it only readable by us, which would stick after the rename
+        os.fchmod(descriptor, 0o644)
+        with os.fdopen(descriptor, "w") as file:
+            file.write(contents)
+        os.replace(temporary_name, file_name)
+    except BaseException:
+        os.unlink(temporary_name)
+        raise